@@ -0,0 +1,174 @@
+#!/usr/bin/python
+'''
+Copyright (C) 2012 Mark West.
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+'''
+
+'''
+Information:
+  Generator of synthetic Filestack sites for benchmarks.
+
+  A site is written to a posts directory: catalog.xml, one content file
+  per page and post, and optionally a WordPress export.  The catalog is
+  imported into the SQLite database when Config.CATALOG_STORAGE is
+  'sqlite'.  The same seed always generates the same site.
+'''
+
+import os
+import random
+import datetime
+from filestack import util
+from filestack import views
+from filestack import storage
+from filestack import xmlbackend
+from filestack.xmlbackend import ET
+from filestack.config import Config
+
+WP_EXPORT_FILE = 'export.xml'
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do '
+  'eiusmod tempor incididunt ut labore et dolore magna aliqua enim ad minim '
+  'veniam quis nostrud exercitation ullamco laboris nisi aliquip ex ea '
+  'commodo consequat duis aute irure in reprehenderit voluptate velit esse '
+  'cillum fugiat nulla pariatur excepteur sint occaecat cupidatat non '
+  'proident sunt culpa qui officia deserunt mollit anim id est laborum').split()
+
+def sentence(rnd, words=12):
+  '''Get a random sentence.'''
+  return ' '.join(rnd.choice(WORDS) for i in range(words)).capitalize() + '.'
+
+def html(rnd, paragraphs=5):
+  '''Get random HTML content like the content written with TinyMCE.'''
+  ret = []
+  for i in range(paragraphs):
+    text = ' '.join(sentence(rnd) for j in range(rnd.randint(2, 6)))
+    words = text.split(' ')
+    n = rnd.randrange(len(words))
+    words[n] = '<strong>%s</strong>' % (words[n])
+    if rnd.random() < 0.3:
+      words.append('<a href="http://example.com/%d">%s</a>' % (i, rnd.choice(WORDS)))
+    if rnd.random() < 0.2:
+      words.append('<img src="/media/%s/image%d.jpg" alt="" />' % (Config.UPLOAD_DIR, i))
+    ret.append('<p>%s</p>' % (' '.join(words)))
+  return '\n'.join(ret)
+
+def terms(rnd, prefix, count, most):
+  '''Get a random list of up to most category or tag names.'''
+  return sorted(set('%s%d' % (prefix, rnd.randrange(count))
+    for i in range(rnd.randint(1, most))))
+
+def generate(posts=500, pages=20, wp_items=0, categories=10, tags=50,
+             seed=1, end=datetime.datetime(2012, 6, 1)):
+  '''Generate a site in Config.POST_DIR (which should be empty).
+
+  Args:
+    posts: Number of native posts.
+    pages: Number of native pages; about half of them are nested below
+      another page.
+    wp_items: Number of WordPress posts in the export (plus one page per
+      ten posts).  No export is written if 0.
+    categories: Size of the category pool.
+    tags: Size of the tag pool.
+    seed: Seed for the random generator.
+    end: Date of the newest post; older posts are a day apart.
+
+  Returns:
+    A dict with the names of the generated items: posts, pages, wp_posts,
+    wp_pages, categories and tags (the first and last post, page, ...).
+  '''
+  rnd = random.Random(seed)
+  filepath = util.checkBaseline()
+  tree = ET.parse(filepath)
+  root = tree.getroot()
+  ret = {'posts': [], 'pages': [], 'wp_posts': [], 'wp_pages': [],
+    'categories': set(), 'tags': set()}
+  items = []
+  for n in range(posts):
+    date = end - datetime.timedelta(days=n, minutes=rnd.randrange(600))
+    slug = 'post-%d' % (n)
+    cats = terms(rnd, 'category', categories, 2)
+    post_tags = terms(rnd, 'tag', tags, 4)
+    ret['categories'].update(cats)
+    ret['tags'].update(post_tags)
+    items.append({'type': 'post', 'date': date, 'name': slug,
+      'title': sentence(rnd, 6), 'categories': cats, 'tags': post_tags,
+      'parent': ''})
+    ret['posts'].append(slug)
+  for n in range(pages):
+    parent = ''
+    if n > 0 and rnd.random() < 0.5:
+      parent = rnd.choice(ret['pages'])
+    slug = 'page-%d' % (n)
+    items.append({'type': 'page', 'date': end - datetime.timedelta(days=n),
+      'name': slug, 'title': sentence(rnd, 3), 'categories': [], 'tags': [],
+      'parent': parent})
+    ret['pages'].append(slug)
+  for item in items:
+    date = item['date'].replace(microsecond=0)
+    item.update({
+      'date': date.isoformat(' '),
+      'url': util.getURL(date, item['name'], item['type']),
+      'filepath': util.getContentFilepath(date, item['name']),
+      'status': 'visible',
+      'trash': ''
+      })
+    element = views.updateElem(ET.Element(item['type']), item)
+    root.append(element)
+    content = views.updateElem(ET.Element(item['type']), item)
+    views.writeContentFile(views.toContentElement(content, html(rnd)))
+  xmlbackend.write(tree, filepath)
+  if storage.isSQLite():
+    storage.importXML(filepath)
+  if wp_items:
+    writeExport(rnd, wp_items, categories, tags, end, ret)
+  ret['categories'] = sorted(ret['categories'])
+  ret['tags'] = sorted(ret['tags'])
+  return ret
+
+def writeExport(rnd, count, categories, tags, end, ret):
+  '''Write a WordPress export with count posts older than the native posts.'''
+  out = ['<?xml version="1.0" encoding="UTF-8"?>',
+    '<rss version="2.0" '
+    'xmlns:content="http://purl.org/rss/1.0/modules/content/" '
+    'xmlns:wp="http://wordpress.org/export/1.0/">',
+    '<channel><title>Synthetic</title>']
+  start = end - datetime.timedelta(days=len(ret['posts']) + 1)
+  pages = count / 10
+  for n in range(count + pages):
+    is_page = n >= count
+    slug = 'wp-page-%d' % (n - count) if is_page else 'wp-post-%d' % (n)
+    date = start - datetime.timedelta(days=n)
+    cats = ''
+    if not is_page:
+      cats = ''.join('<category domain="category">%s</category>' % (c)
+        for c in terms(rnd, 'category', categories, 2))
+      cats += ''.join('<category domain="post_tag">%s</category>' % (t)
+        for t in terms(rnd, 'tag', tags, 4))
+    parent = 0
+    if is_page and n > count and rnd.random() < 0.5:
+      parent = 100000 + rnd.randrange(count, n)
+    out.append('<item><title>%s</title><link>http://example.com/%s</link>%s'
+      '<content:encoded><![CDATA[%s]]></content:encoded>'
+      '<wp:post_id>%d</wp:post_id><wp:post_date>%s</wp:post_date>'
+      '<wp:post_name>%s</wp:post_name><wp:status>publish</wp:status>'
+      '<wp:post_parent>%d</wp:post_parent><wp:post_type>%s</wp:post_type>'
+      '</item>' % (sentence(rnd, 5), slug, cats, html(rnd), 100000 + n,
+        date.strftime('%Y-%m-%d %H:%M:%S'), slug, parent,
+        'page' if is_page else 'post'))
+    ret['wp_pages' if is_page else 'wp_posts'].append(slug)
+  out.append('</channel></rss>')
+  f = open(os.path.join(util.getFilepath(Config.POST_DIR), WP_EXPORT_FILE), 'w')
+  try:
+    f.write('\n'.join(out))
+  finally:
+    f.close()
@@ -0,0 +1,90 @@
+#!/usr/bin/python
+'''
+Copyright (C) 2012 Mark West.
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+'''
+
+'''
+Information:
+  Field reads of util.ETWrap on a large synthetic WordPress export.
+
+  Reads the fields that filtering and converting a WordPress item reads,
+  once with an attribute read (a scan of the children) per field and once
+  with a mapped wrapper and fields().  It does not need Django settings:
+    > python -m filestack.bench.etwrap --wp 20000
+'''
+
+import time
+import shutil
+import tempfile
+import optparse
+
+from filestack import wp
+from filestack import util
+from filestack.config import Config
+from filestack.bench import corpus
+
+def readAttributes(elements):
+  '''Read the fields one attribute at a time.'''
+  for e in elements:
+    welement = util.ETWrap(e)
+    (welement.ns('wp').post_type, welement.ns('wp').status,
+     welement.ns('wp').status, welement.ns('wp').post_date)
+    (welement.title, welement.ns('wp').post_name, welement.link,
+     welement.ns('wp').post_date, welement.ns('content').encoded,
+     welement.ns('wp').post_type, welement.ns('wp').post_parent,
+     welement.ns('wp').post_id)
+
+def readMapped(elements):
+  '''Read the fields with a mapped wrapper.'''
+  for e in elements:
+    welement = util.ETWrap(e, mapped=True)
+    welement.ns('wp').fields('post_type', 'status', 'post_date')
+    (welement.fields('title', 'link'), welement.ns('content').encoded,
+     welement.ns('wp').fields('post_name', 'post_date', 'post_type',
+       'post_parent', 'post_id'))
+
+def best(fn, elements, repeat):
+  '''Get the best time (in milliseconds) of repeat runs.'''
+  ret = None
+  for i in range(repeat):
+    start = time.time()
+    fn(elements)
+    elapsed = (time.time() - start) * 1000
+    ret = elapsed if ret is None else min(ret, elapsed)
+  return ret
+
+def main():
+  parser = optparse.OptionParser(usage='%prog [options]')
+  parser.add_option('--wp', type='int', default=20000, help='WordPress posts')
+  parser.add_option('--repeat', type='int', default=3, help='runs per mode')
+  options, args = parser.parse_args()
+  Config.POST_DIR = tempfile.mkdtemp(prefix='filestack-bench-')
+  Config.WP_XML_FILE = corpus.WP_EXPORT_FILE
+  try:
+    corpus.generate(0, 0, options.wp)
+    tree, ns = util.parse_and_get_ns(wp.getXMLFilepath())
+  finally:
+    shutil.rmtree(Config.POST_DIR)
+  util.ETWrap.namespace = ns
+  elements = tree.findall('./channel/item')
+  attributes = best(readAttributes, elements, options.repeat)
+  mapped = best(readMapped, elements, options.repeat)
+  print "%d items" % (len(elements))
+  print "%-12s %10.1f ms" % ('attributes', attributes)
+  print "%-12s %10.1f ms" % ('mapped', mapped)
+  print "speedup: %.1fx" % (attributes / (mapped or 1))
+
+if __name__ == "__main__":
+  main()
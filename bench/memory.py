@@ -0,0 +1,99 @@
+#!/usr/bin/python
+'''
+Copyright (C) 2012 Mark West.
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+'''
+
+'''
+Information:
+  Memory used by the items of a synthetic site.
+
+  Compares the item records (records.Item) with the dicts items used to
+  be: a dict per item with lists of categories and tags and the five date
+  fields views.addDates() added.  Objects shared between items (term
+  tuples, strings) are counted once.  It does not need Django settings:
+    > python -m filestack.bench.memory --posts 5000 --wp 20000
+'''
+
+import sys
+import time
+import shutil
+import tempfile
+import optparse
+
+from filestack import wp
+from filestack import views
+from filestack import catalog
+from filestack import records
+from filestack.config import Config
+from filestack.bench import corpus
+
+def deepSize(objects):
+  '''Get the bytes used by objects and everything they reference.'''
+  seen = set()
+  total = 0
+  stack = list(objects)
+  while stack:
+    o = stack.pop()
+    if id(o) in seen:
+      continue
+    seen.add(id(o))
+    total += sys.getsizeof(o)
+    if isinstance(o, dict):
+      stack.extend(o.keys())
+      stack.extend(o.values())
+    elif isinstance(o, (list, tuple)):
+      stack.extend(o)
+    elif isinstance(o, records.Item):
+      stack.extend(v for k, v in o.iteritems())
+  return total
+
+def asDict(item):
+  '''Get the dict form items had before records.Item.'''
+  ret = dict(item.iteritems())
+  ret['categories'] = list(ret['categories'])
+  ret['tags'] = list(ret['tags'])
+  for key in records.DATE_FIELDS:
+    ret[key] = item[key][:]
+  return ret
+
+def main():
+  parser = optparse.OptionParser(usage='%prog [options]')
+  parser.add_option('--posts', type='int', default=5000, help='native posts')
+  parser.add_option('--wp', type='int', default=20000, help='WordPress posts')
+  parser.add_option('--seed', type='int', default=1, help='random seed')
+  options, args = parser.parse_args()
+  Config.POST_DIR = tempfile.mkdtemp(prefix='filestack-bench-')
+  Config.WP_XML_FILE = corpus.WP_EXPORT_FILE if options.wp else ''
+  try:
+    corpus.generate(options.posts, 0, options.wp, seed=options.seed)
+    start = time.time()
+    items = views.getItems(catalog.load()) + wp.getItems(wp.loadXML())
+    elapsed = time.time() - start
+  finally:
+    shutil.rmtree(Config.POST_DIR)
+  # The content is loaded separately; leave it out of both
+  for i in items:
+    i['content'] = ''
+  slotted = deepSize(items)
+  dicts = deepSize([asDict(i) for i in items])
+  n = len(items) or 1
+  print "%d items (loaded in %.1f ms)" % (len(items), elapsed * 1000)
+  print "%-8s %12s %10s" % ('', 'bytes', 'per item')
+  print "%-8s %12d %10d" % ('dicts', dicts, dicts / n)
+  print "%-8s %12d %10d" % ('records', slotted, slotted / n)
+  print "reduction: %.0f%%" % (100.0 * (dicts - slotted) / (dicts or 1))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,82 @@
+#!/usr/bin/python
+'''
+Copyright (C) 2012 Mark West.
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+'''
+
+'''
+Information:
+  Parse times of the installed XML backends (see xmlbackend).
+
+  Parses the catalog, the content files and the WordPress export of a
+  synthetic site with every installed backend.  It does not need Django
+  settings:
+    > python -m filestack.bench.parsers --posts 5000 --wp 20000
+'''
+
+import os
+import time
+import shutil
+import tempfile
+import optparse
+
+from filestack import wp
+from filestack import util
+from filestack import xmlbackend
+from filestack.config import Config
+from filestack.bench import corpus
+
+def best(fn, repeat):
+  '''Get the best time (in milliseconds) of repeat runs.'''
+  ret = None
+  for i in range(repeat):
+    start = time.time()
+    fn()
+    elapsed = (time.time() - start) * 1000
+    ret = elapsed if ret is None else min(ret, elapsed)
+  return ret
+
+def main():
+  parser = optparse.OptionParser(usage='%prog [options]')
+  parser.add_option('--posts', type='int', default=5000, help='native posts')
+  parser.add_option('--wp', type='int', default=20000, help='WordPress posts')
+  parser.add_option('--repeat', type='int', default=3, help='runs per backend')
+  options, args = parser.parse_args()
+  Config.POST_DIR = tempfile.mkdtemp(prefix='filestack-bench-')
+  Config.WP_XML_FILE = corpus.WP_EXPORT_FILE if options.wp else ''
+  try:
+    corpus.generate(options.posts, 0, options.wp)
+    catalog_file = util.checkBaseline()
+    post_dir = util.getFilepath(Config.POST_DIR)
+    content_files = [os.path.join(post_dir, f) for f in os.listdir(post_dir)
+      if f.endswith('.xml') and f not in (Config.CATALOG_FILE, corpus.WP_EXPORT_FILE)]
+    export_file = wp.getXMLFilepath()
+    print "%d posts, %d WordPress posts (selected backend: %s)" % (
+      options.posts, options.wp, xmlbackend.NAME)
+    print "%-14s %12s %12s %12s" % ('backend', 'catalog', 'content', 'export')
+    for name in xmlbackend.BACKENDS:
+      et = xmlbackend.load(name)
+      if et is None:
+        print "%-14s %12s" % (name, 'not installed')
+        continue
+      times = [best(lambda: xmlbackend.parse(catalog_file, et), options.repeat),
+        best(lambda: [xmlbackend.parse(f, et) for f in content_files], options.repeat)]
+      if export_file:
+        times.append(best(lambda: xmlbackend.parseNS(export_file, et), options.repeat))
+      print "%-14s" % (name) + ''.join(" %9.1f ms" % (t) for t in times)
+  finally:
+    shutil.rmtree(Config.POST_DIR)
+
+if __name__ == "__main__":
+  main()
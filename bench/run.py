@@ -0,0 +1,258 @@
+#!/usr/bin/python
+'''
+Copyright (C) 2012 Mark West.
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+'''
+
+'''
+Information:
+  Times the request paths and hot helpers of Filestack on a synthetic site.
+
+  Run it in the Django site directory with the site's settings, e.g.:
+    > DJANGO_SETTINGS_MODULE=mysite.settings python -m filestack.bench.run \
+        --posts 2000 --wp 1000 --out bench.json
+  and compare a later run against the stored result:
+    > ... python -m filestack.bench.run --posts 2000 --wp 1000 \
+        --baseline bench.json --threshold 0.2
+
+  The views are requested with Django's test client (the SU views as a
+  user created in a test database).  The synthetic site is generated in a
+  temporary posts directory, so the site's own content is not touched.
+  Every benchmark is run once cold and then --repeat times; the results
+  are in milliseconds.  With --baseline, a benchmark whose median is more
+  than --threshold slower than the baseline's is a regression and the
+  exit status is 1.
+'''
+
+import sys
+import time
+import shutil
+import platform
+import tempfile
+import datetime
+import optparse
+try:
+  import json
+except ImportError:
+  import simplejson as json
+
+from django.conf import settings
+from django.db import connection
+from django.test.client import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.contrib.auth.models import User
+
+from filestack import util
+from filestack import wp
+from filestack import views
+from filestack import storage
+from filestack.config import Config
+from filestack.bench import corpus
+
+FORMAT = 1
+USER = 'bench'
+# Settings recorded with the results, since they change what is measured
+SETTINGS = ['POSTS_PER_PAGE', 'PAGE_CACHE', 'CATALOG_LAYOUT',
+  'CATALOG_JOURNAL', 'CATALOG_STORAGE', 'MINIFY_HTML', 'COMPRESS_RESPONSES']
+
+def measure(fn, repeat):
+  '''Time a function once cold and then repeat times.
+
+  Returns:
+    A dict with cold, min, median and max times (in milliseconds) and the
+    number of runs.
+  '''
+  times = []
+  for i in range(repeat + 1):
+    start = time.time()
+    fn()
+    times.append((time.time() - start) * 1000.0)
+  cold = times.pop(0)
+  times.sort()
+  return {'cold': cold, 'min': times[0], 'median': times[len(times) / 2],
+    'max': times[-1], 'runs': repeat}
+
+def get(client, path, status=200):
+  '''Get a function that requests a path and checks the status.'''
+  def fn():
+    response = client.get(path)
+    if response.status_code != status:
+      raise Exception('%s returned %d' % (path, response.status_code))
+  return fn
+
+def saveForm(slug):
+  '''Get the POST data of the SU edit form of an item.'''
+  item = views.elementToItem(views.findElement(storage.load(), slug))
+  return {
+    'title': item['title'],
+    'date': item['date_short'],
+    'time': item['time'],
+    'status': item['status'],
+    'name': item['name'],
+    'categories': ','.join(item['categories']),
+    'tags': ','.join(item['tags']),
+    'content': views.loadContent(item),
+    'parent': item['parent'] or '0'
+    }
+
+def requestBenchmarks(site):
+  '''Get the (name, function) of the request benchmarks.'''
+  public = Client()
+  su = Client()
+  if not su.login(username=USER, password=USER):
+    raise Exception('Unable to log in the benchmark user')
+  posts = site['posts']
+  post = views.findElement(storage.load(), posts[len(posts) / 2])
+  last_page = max(0, len(posts) / Config.POSTS_PER_PAGE - 1)
+  save_slug = posts[1]
+  form = saveForm(save_slug)
+  def save():
+    response = su.post('/su/edit/%s/' % (save_slug), form)
+    if response.status_code != 302:
+      raise Exception('Saving %s failed' % (save_slug))
+  trash_slug = posts[2]
+  return [
+    ('index', get(public, '/')),
+    ('index_deep', get(public, '/?p=%d' % (last_page))),
+    ('category', get(public, '/category/%s/' % (site['categories'][0]))),
+    ('tag', get(public, '/tag/%s/' % (site['tags'][0]))),
+    ('detail', get(public, util.ETWrap(post).url)),
+    ('page', get(public, '/%s/' % (site['pages'][-1]))),
+    ('su', get(su, '/su/')),
+    ('su_edit', get(su, '/su/edit/%s/' % (save_slug))),
+    ('save', save),
+    ('trash', get(su, '/su/delete/%s/' % (trash_slug))),
+    ('restore', get(su, '/su/restore/%s/' % (trash_slug))),
+    ]
+
+def microBenchmarks():
+  '''Get the (name, function) of the helper benchmarks.'''
+  wp_filepath = wp.getXMLFilepath()
+  def parse():
+    util.parse_and_get_ns(wp_filepath or util.checkBaseline())
+  def wrap():
+    for e in storage.load().getroot():
+      w = util.ETWrap(e)
+      (w.name, w.date, w.title, w.status)
+  def wrapMapped():
+    for e in storage.load().getroot():
+      util.ETWrap(e, mapped=True).fields('name', 'date', 'title', 'status')
+  return [
+    ('util.parse_and_get_ns', parse),
+    ('util.ETWrap', wrap),
+    ('util.ETWrap.fields', wrapMapped),
+    ('wp.getItems', lambda: wp.getItems(wp.loadXML(), 'posts')),
+    ('views.getMenu', lambda: views.getMenu(storage.load(), wp.loadXML())),
+    ('views.buildMenu', lambda: views.buildMenu(storage.load(), wp.loadXML())),
+    ]
+
+def run(options):
+  '''Generate the site and run every benchmark.
+
+  Returns:
+    The results dict (see the module information).
+  '''
+  Config.POST_DIR = tempfile.mkdtemp(prefix='filestack-bench-')
+  Config.CATALOG_FILE = 'catalog.xml'
+  Config.WP_XML_FILE = corpus.WP_EXPORT_FILE if options.wp else ''
+  setup_test_environment()
+  old_name = settings.DATABASES['default']['NAME']
+  connection.creation.create_test_db(verbosity=0)
+  try:
+    User.objects.create_user(USER, '%s@example.com' % (USER), USER)
+    site = corpus.generate(options.posts, options.pages, options.wp,
+      seed=options.seed)
+    if site['wp_posts']:
+      # Serve WordPress posts on their detail URLs
+      Config.WP_END_DATE = (datetime.datetime(2012, 6, 1) -
+        datetime.timedelta(days=options.posts + 1)).strftime('%Y-%m-%d')
+    results = {}
+    for name, fn in requestBenchmarks(site) + microBenchmarks():
+      results[name] = measure(fn, options.repeat)
+  finally:
+    connection.creation.destroy_test_db(old_name, verbosity=0)
+    teardown_test_environment()
+    if options.keep:
+      print "Site kept in %s" % (Config.POST_DIR)
+    else:
+      shutil.rmtree(Config.POST_DIR)
+  return {
+    'format': FORMAT,
+    'date': datetime.datetime.utcnow().isoformat(' '),
+    'python': platform.python_version(),
+    'site': {'posts': options.posts, 'pages': options.pages,
+      'wp': options.wp, 'seed': options.seed},
+    'settings': dict((k, getattr(Config, k)) for k in SETTINGS),
+    'results': results
+    }
+
+def compare(results, baseline, threshold):
+  '''Print the results next to a baseline.
+
+  Returns:
+    The names of the benchmarks whose median regressed by more than
+    threshold (a fraction).
+  '''
+  regressions = []
+  if baseline['site'] != results['site']:
+    print "Warning: The baseline was run on a different site: %s" % (baseline['site'])
+  print "%-24s %10s %10s %8s" % ('benchmark', 'baseline', 'median', 'change')
+  for name in sorted(results['results']):
+    median = results['results'][name]['median']
+    if name not in baseline['results']:
+      print "%-24s %10s %10.2f" % (name, '-', median)
+      continue
+    base = baseline['results'][name]['median']
+    change = (median - base) / base if base else 0.0
+    flag = ''
+    if change > threshold:
+      regressions.append(name)
+      flag = '  REGRESSION'
+    print "%-24s %10.2f %10.2f %+7.0f%%%s" % (name, base, median, change * 100, flag)
+  return regressions
+
+def main():
+  parser = optparse.OptionParser(usage='%prog [options]')
+  parser.add_option('--posts', type='int', default=500, help='native posts')
+  parser.add_option('--pages', type='int', default=20, help='native pages')
+  parser.add_option('--wp', type='int', default=0, help='WordPress posts')
+  parser.add_option('--seed', type='int', default=1, help='random seed')
+  parser.add_option('--repeat', type='int', default=5, help='runs per benchmark')
+  parser.add_option('--out', help='write the results to this JSON file')
+  parser.add_option('--baseline', help='compare with this JSON results file')
+  parser.add_option('--threshold', type='float', default=0.25,
+    help='allowed slowdown of the median (0.25 = 25%)')
+  parser.add_option('--keep', action='store_true', help='keep the generated site')
+  options, args = parser.parse_args()
+  results = run(options)
+  if options.out:
+    f = open(options.out, 'w')
+    try:
+      json.dump(results, f, indent=2, sort_keys=True)
+    finally:
+      f.close()
+  if options.baseline:
+    f = open(options.baseline)
+    try:
+      baseline = json.load(f)
+    finally:
+      f.close()
+    if compare(results, baseline, options.threshold):
+      sys.exit(1)
+  else:
+    for name in sorted(results['results']):
+      print "%-24s %10.2f ms" % (name, results['results'][name]['median'])
+
+if __name__ == "__main__":
+  main()
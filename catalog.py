@@ -0,0 +1,722 @@
+#!/usr/bin/python
+'''
+Copyright (C) 2012 Mark West.
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+'''
+
+'''
+Information:
+  Process-wide cache of the parsed catalog file and the catalog writers.
+
+  The catalog is parsed once and kept in memory.  Every call to load()
+  revalidates the cached tree with a single os.stat() of the catalog file
+  (and its journal) and only re-parses it when the inode, size or mtime
+  changed.  Writers go through put() and remove(), which invalidate the
+  cache, so the next reader never sees a stale tree, even if the rewrite
+  happened within the resolution of the filesystem's mtime.
+
+  With Config.CATALOG_JOURNAL set, writers do not rewrite catalog.xml.
+  Each change is appended as one JSON record per line to a journal file
+  next to the catalog, and readers apply the journal on top of the
+  catalog.  Once the journal grows past Config.CATALOG_JOURNAL_MAX_BYTES
+  it is folded back into catalog.xml in a background thread (also
+  available as "su.py compact").  Replaying a record twice has no effect,
+  so a crash during compaction loses nothing.
+
+  With Config.CATALOG_LAYOUT set to 'sharded', the catalog is split into
+  one file per year of posts plus one file for pages and trash, all in
+  Config.CATALOG_SHARD_DIR (see "su.py shard").  Each shard is parsed and
+  cached on its own, so a change only re-parses its shard, and readers can
+  load just the shards they need (see load() and getYears()).  A small
+  shard index (see getShardIndex()) keeps the names, visible post dates
+  and terms of every year shard, so counts, categories, the publishing
+  schedule and the routing of writes need no year shard at all.
+'''
+
+import os
+import threading
+try:
+  import json
+except ImportError:
+  import simplejson as json
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+import util
+import timing
+import records
+import xmlbackend
+from xmlbackend import ET
+from config import Config
+
+JOURNAL_SUFFIX = '.journal'
+LOCK_SUFFIX = '.lock'
+PAGES_SHARD = 'pages'
+SHARD_INDEX_FILE = 'index.json'
+
+_lock = threading.Lock()
+_write_lock = threading.Lock()
+# Parsed catalog files: key=filepath, value=(signature, ElementTree)
+_files = {}
+# Loaded catalogs: key=tuple of filepaths, value=dict with tree, signature
+# and derived data
+_views = {}
+_version = [0]
+# Shard index (see getShardIndex()): signatures of the year shards, the
+# index built for them and a dict of element name to years
+_shard_index = {'signatures': None, 'index': None, 'years': None}
+
+# Counters for confirming the cache works (see getStats()).
+stats = {'hits': 0, 'misses': 0, 'reloads': 0, 'invalidations': 0,
+  'parses': 0}
+
+class ShardedTree:
+  '''Read-only view of several catalog shards as a single catalog tree.
+
+  Attributes:
+    shards: List of tuples with this structure: (filepath, ElementTree)
+  '''
+  def __init__(self, shards):
+    self.shards = shards
+
+  def findall(self, path):
+    '''Find the matching elements of all shards.'''
+    ret = []
+    for filepath, tree in self.shards:
+      ret.extend(tree.findall(path))
+    return ret
+
+  def getroot(self):
+    '''Get a root element with the elements of all shards (a copy).'''
+    root = ET.Element('catalog')
+    root.set('version', '0.1')
+    for filepath, tree in self.shards:
+      for e in tree.getroot():
+        xmlbackend.appendShared(root, e)
+    return root
+
+def isSharded():
+  '''Is the catalog split into per-year shards?'''
+  return Config.CATALOG_LAYOUT == 'sharded'
+
+def getShardDir():
+  '''Get the directory of the catalog shards.'''
+  return util.getFilepath(os.path.join(Config.POST_DIR, Config.CATALOG_SHARD_DIR))
+
+def getShardFilepath(name):
+  '''Get the file of a shard ('YYYY' or PAGES_SHARD).
+
+  The catalog file itself is the shard with the pages and trash.
+  '''
+  if name == PAGES_SHARD:
+    return util.checkBaseline()
+  return os.path.join(getShardDir(), '%s.xml' % (name))
+
+def getYears():
+  '''Get the years that have a shard, newest first.'''
+  shard_dir = getShardDir()
+  if not os.path.isdir(shard_dir):
+    return []
+  years = [f[0:4] for f in os.listdir(shard_dir)
+    if len(f) == len('YYYY.xml') and f.endswith('.xml') and f[0:4].isdigit()]
+  return sorted(years, reverse=True)
+
+def getShardIndexFilepath():
+  '''Get the file of the shard index.'''
+  return os.path.join(getShardDir(), SHARD_INDEX_FILE)
+
+def shardName(element):
+  '''Get the name of the shard an element belongs in.'''
+  if element.tag == 'post':
+    date = element.findtext('date') or ''
+    if date[0:4].isdigit():
+      return date[0:4]
+  return PAGES_SHARD
+
+def getFilepaths(years=None, pages=True):
+  '''Get the catalog files to load.
+
+  Args:
+    years: Only load the shards of these years (all years if None).
+    pages: Load the shard with the pages and trash.
+
+  Returns:
+    A list of file paths (newest year first).
+  '''
+  filepath = util.checkBaseline()
+  if not isSharded():
+    return [filepath]
+  if years is None:
+    years = getYears()
+  ret = [getShardFilepath(y) for y in years]
+  ret = [f for f in ret if os.path.exists(f)]
+  if pages:
+    ret.append(filepath)
+  return ret
+
+def currentSignature():
+  '''Get the change signature of every catalog file.'''
+  return tuple(fullSignature(f) for f in getFilepaths())
+
+def signature(filepath):
+  '''Get a cheap change signature for a file.
+
+  Args:
+    filepath: File to stat.
+
+  Returns:
+    Tuple with this structure: (inode, size, mtime)
+  '''
+  st = os.stat(filepath)
+  return (st.st_ino, st.st_size, st.st_mtime)
+
+def journalPath(filepath):
+  '''Get the journal file of a catalog file.'''
+  return filepath + JOURNAL_SUFFIX
+  
+def fullSignature(filepath):
+  '''Get the change signature of a catalog file and its journal.'''
+  journal = journalPath(filepath)
+  if not os.path.exists(journal):
+    return (signature(filepath), None)
+  return (signature(filepath), signature(journal))
+
+def readTree(filepath):
+  '''Parse a catalog file and apply its journal.
+
+  Args:
+    filepath: Catalog file to parse.
+
+  Returns:
+    ElementTree for the catalog.
+  '''
+  timing.countFile(filepath)
+  tree = ET.parse(filepath)
+  journal = journalPath(filepath)
+  if os.path.exists(journal):
+    applyRecords(tree, readJournal(journal))
+  return tree
+
+def readJournal(journal):
+  '''Read the records of a journal file.
+
+  A trailing record without a newline was cut short by a crash and is
+  ignored, as are records that cannot be decoded.
+
+  Args:
+    journal: Journal file to read.
+
+  Returns:
+    A list of record dicts.
+  '''
+  ret = []
+  f = open(journal, 'rb')
+  try:
+    for line in f:
+      if not line.endswith('\n'):
+        break
+      try:
+        ret.append(json.loads(line))
+      except ValueError:
+        continue
+  finally:
+    f.close()
+  return ret
+
+def applyRecords(tree, records):
+  '''Apply change records to a catalog tree.
+
+  Records are dicts with this structure:
+    {'op': 'put', 'replace': slug or None, 'xml': element as XML}
+      Remove the elements named 'replace' and the element's own name,
+      then append the element.
+    {'op': 'remove', 'names': [slugs]}
+      Remove the elements with these names.
+
+  Args:
+    tree: Catalog tree to change.
+    records: List of records.
+  '''
+  root = tree.getroot()
+  by_name = {}
+  for e in root:
+    by_name.setdefault(e.findtext('name'), []).append(e)
+  def removeName(name):
+    for e in by_name.pop(name, []):
+      root.remove(e)
+  for record in records:
+    if record['op'] == 'put':
+      element = ET.fromstring(record['xml'].encode('utf-8'))
+      if record.get('replace'):
+        removeName(record['replace'])
+      removeName(element.findtext('name'))
+      root.append(element)
+      by_name[element.findtext('name')] = [element]
+    elif record['op'] == 'remove':
+      for name in record['names']:
+        removeName(name)
+
+def writeTree(tree, filepath):
+  '''Write a catalog tree by writing a temporary file and renaming it.'''
+  tmp_path = '%s.%d.tmp' % (filepath, os.getpid())
+  xmlbackend.write(tree, tmp_path)
+  os.rename(tmp_path, filepath)
+
+def acquireFileLock(filepath, shared=False):
+  '''Lock a file against writers in other processes.
+
+  Args:
+    filepath: File to lock (the lock is taken on a separate lock file).
+    shared: Take a shared (reader) lock instead of an exclusive one.
+
+  Returns:
+    The open lock file; pass it to releaseFileLock().
+  '''
+  lock = open(filepath + LOCK_SUFFIX, 'a')
+  if fcntl:
+    fcntl.flock(lock.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+  return lock
+
+def releaseFileLock(lock):
+  '''Unlock a lock taken with acquireFileLock().'''
+  if fcntl:
+    fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+  lock.close()
+
+def writeFile(filepath, records):
+  '''Apply change records to a single catalog file.
+
+  Returns:
+    True if the journal of the file should be compacted.
+  '''
+  if not os.path.exists(filepath):
+    if not os.path.exists(os.path.dirname(filepath)):
+      os.makedirs(os.path.dirname(filepath), 0755)
+    writeTree(ET.ElementTree(ET.Element('catalog', version='0.1')), filepath)
+  if Config.CATALOG_JOURNAL:
+    f = open(journalPath(filepath), 'ab')
+    try:
+      for record in records:
+        f.write(json.dumps(record) + '\n')
+      f.flush()
+      os.fsync(f.fileno())
+      return f.tell() > Config.CATALOG_JOURNAL_MAX_BYTES
+    finally:
+      f.close()
+  tree = readTree(filepath)
+  applyRecords(tree, records)
+  writeTree(tree, filepath)
+  if os.path.exists(journalPath(filepath)):
+    os.remove(journalPath(filepath))  # Folded into the catalog
+  return False
+
+def routeRecords(records):
+  '''Split change records by the shard file they apply to.
+
+  Records are routed by the date of their element, and the shards that
+  hold stale copies of a name (e.g. after the date of a post changed its
+  year) are looked up in the shard index, so no other shard is loaded.
+
+  Args:
+    records: List of records (see applyRecords).
+
+  Returns:
+    A dict with key=filepath, value=list of records.
+  '''
+  if not isSharded():
+    return {util.checkBaseline(): records}
+  pages_names = set(e.findtext('name') for e in load(years=[]).findall('*'))
+  ret = {}
+  for record in records:
+    if record['op'] == 'put':
+      element = ET.fromstring(record['xml'].encode('utf-8'))
+      target = getShardFilepath(shardName(element))
+      ret.setdefault(target, []).append(record)
+      names = [record.get('replace'), element.findtext('name')]
+    else:
+      target = None
+      names = record['names']
+    for name in [n for n in names if n]:
+      filepaths = [getShardFilepath(y) for y in getNameYears(name)]
+      if name in pages_names:
+        filepaths.append(getShardFilepath(PAGES_SHARD))
+      for filepath in filepaths:
+        if filepath != target:
+          ret.setdefault(filepath, []).append({'op': 'remove', 'names': [name]})
+  return ret
+
+def write(records):
+  '''Apply change records to the catalog (see applyRecords).
+
+  Args:
+    records: List of records.
+  '''
+  lock_path = util.checkBaseline()
+  compact_needed = False
+  _write_lock.acquire()
+  lock = acquireFileLock(lock_path)
+  try:
+    filepaths = routeRecords(records)
+    for filepath, file_records in filepaths.iteritems():
+      if writeFile(filepath, file_records):
+        compact_needed = True
+    invalidate(filepaths.keys())
+    if isSharded():
+      writeShardIndex()
+  finally:
+    releaseFileLock(lock)
+    _write_lock.release()
+  if compact_needed:
+    thread = threading.Thread(target=compact)
+    thread.setDaemon(True)
+    thread.start()
+
+def toXML(element):
+  '''Serialize an element for a change record (unicode, no declaration).'''
+  xml = xmlbackend.tostring(element)
+  if xml.startswith('<?xml'):
+    xml = xml[xml.index('?>')+2:].lstrip()
+  return xml.decode('utf-8')
+
+def put(element, replace=None):
+  '''Add an element to the catalog, replacing an existing one.
+
+  Args:
+    element: The element to add.  An existing element with the same name
+      is replaced.
+    replace: Name of another element to remove (e.g. the old name of a
+      renamed item).
+  '''
+  write([{'op': 'put', 'replace': replace, 'xml': toXML(element)}])
+
+def remove(names):
+  '''Remove the elements with the given names from the catalog.'''
+  write([{'op': 'remove', 'names': list(names)}])
+
+def compact():
+  '''Fold the journals into the catalog files.
+
+  Returns:
+    The number of journal records that were folded into the catalog.
+  '''
+  lock_path = util.checkBaseline()
+  count = 0
+  _write_lock.acquire()
+  lock = acquireFileLock(lock_path)
+  try:
+    for filepath in getFilepaths():
+      journal = journalPath(filepath)
+      if not os.path.exists(journal):
+        continue
+      records = readJournal(journal)
+      tree = ET.parse(filepath)
+      applyRecords(tree, records)
+      writeTree(tree, filepath)
+      os.remove(journal)
+      count += len(records)
+    invalidate()
+    if isSharded():
+      writeShardIndex()
+  finally:
+    releaseFileLock(lock)
+    _write_lock.release()
+  return count
+
+def shard():
+  '''Move the posts of the catalog file into per-year shards.
+
+  The catalog file itself becomes the shard with the pages and trash.  A
+  copy of the original catalog is kept with the suffix '.single'.  Running
+  it again moves posts that are in the catalog file into their shards.
+
+  Returns:
+    The number of posts moved into shards.
+  '''
+  filepath = util.checkBaseline()
+  count = 0
+  _write_lock.acquire()
+  lock = acquireFileLock(filepath)
+  try:
+    tree = readTree(filepath)
+    if not os.path.exists(filepath + '.single'):
+      writeTree(tree, filepath + '.single')
+    shards = {}
+    for e in list(tree.getroot()):
+      name = shardName(e)
+      if name != PAGES_SHARD:
+        shards.setdefault(name, []).append(e)
+        tree.getroot().remove(e)
+    shard_dir = getShardDir()
+    if not os.path.exists(shard_dir):
+      os.makedirs(shard_dir, 0755)
+    for name, elements in shards.iteritems():
+      shard_path = getShardFilepath(name)
+      if os.path.exists(shard_path):
+        shard_tree = readTree(shard_path)
+      else:
+        shard_tree = ET.ElementTree(ET.Element('catalog', version='0.1'))
+      root = shard_tree.getroot()
+      names = set(e.findtext('name') for e in elements)
+      for e in list(root):
+        if e.findtext('name') in names:
+          root.remove(e)
+      for e in elements:
+        root.append(e)
+      writeTree(shard_tree, shard_path)
+      if os.path.exists(journalPath(shard_path)):
+        os.remove(journalPath(shard_path))  # Folded into the shard
+      count += len(elements)
+    writeTree(tree, filepath)
+    if os.path.exists(journalPath(filepath)):
+      os.remove(journalPath(filepath))  # Folded into the shards
+    invalidate()
+    writeShardIndex()
+  finally:
+    releaseFileLock(lock)
+    _write_lock.release()
+  return count
+
+def summarizeShard(tree):
+  '''Summarize a year shard for the shard index.
+
+  Args:
+    tree: ElementTree of the shard.
+
+  Returns:
+    A dict with these keys:
+      names: Names of the elements of the shard.
+      posts: Sorted dates of the posts with a visible status.
+      categories: Dict with key=category, value=sorted dates of its posts
+        with a visible status.
+      tags: Dict with key=tag, value=sorted dates of its posts with a
+        visible status.
+  '''
+  ret = {'names': [], 'posts': [], 'categories': {}, 'tags': {}}
+  for e in tree.getroot():
+    name, date, status, categories, tags = util.ETWrap(e, mapped=True).fields(
+      'name', 'date', 'status', 'categories', 'tags')
+    ret['names'].append(name)
+    if e.tag != 'post' or (status or '').lower() != 'visible':
+      continue
+    ret['posts'].append(date)
+    for field, terms in [('categories', categories), ('tags', tags)]:
+      for term in records.splitTerms(terms):
+        ret[field].setdefault(term, []).append(date)
+  ret['posts'].sort()
+  for field in ['categories', 'tags']:
+    for dates in ret[field].itervalues():
+      dates.sort()
+  return ret
+
+def readShardIndex():
+  '''Read the shard index file (an empty index if there is none).'''
+  filepath = getShardIndexFilepath()
+  if not os.path.exists(filepath):
+    return {}
+  f = open(filepath, 'rb')
+  try:
+    return json.load(f)
+  except ValueError:
+    return {}
+  finally:
+    f.close()
+
+def getShardIndex():
+  '''Get the shard index of the year shards.
+
+  The index is read from the shard index file, which the writers keep up
+  to date.  An entry whose shard changed since it was written (e.g. by a
+  crash between the two writes or an edit by hand) is built again from
+  its shard, so the index is always current.  It is kept in memory until a
+  shard changes.
+
+  NOTE: The returned index is shared and must be treated as read-only.
+
+  Returns:
+    A dict with key=year, value=dict with the signature of the shard (see
+      fullSignature()) and its summary (see summarizeShard()).
+  '''
+  # Signatures as read back from JSON (lists, not tuples)
+  signatures = json.loads(json.dumps(dict(
+    (y, fullSignature(getShardFilepath(y))) for y in getYears())))
+  _lock.acquire()
+  try:
+    if _shard_index['signatures'] == signatures:
+      return _shard_index['index']
+  finally:
+    _lock.release()
+  stored = readShardIndex()
+  index = {}
+  years = {}
+  for year, sig in signatures.iteritems():
+    entry = stored.get(year)
+    if not entry or entry['signature'] != sig:
+      entry = summarizeShard(load(years=[year], pages=False).shards[0][1])
+      entry['signature'] = sig
+    index[year] = entry
+    for name in entry['names']:
+      years.setdefault(name, []).append(year)
+  _lock.acquire()
+  try:
+    _shard_index['signatures'] = signatures
+    _shard_index['index'] = index
+    _shard_index['years'] = years
+  finally:
+    _lock.release()
+  return index
+
+def getNameYears(name):
+  '''Get the years whose shard has an element with the name.'''
+  getShardIndex()
+  return _shard_index['years'].get(name, [])
+
+def writeShardIndex():
+  '''Write the shard index file for the current year shards.
+
+  NOTE: Call with the write locks held (see write()).
+  '''
+  index = getShardIndex()
+  filepath = getShardIndexFilepath()
+  if not os.path.exists(os.path.dirname(filepath)):
+    os.makedirs(os.path.dirname(filepath), 0755)
+  tmp_path = '%s.%d.tmp' % (filepath, os.getpid())
+  f = open(tmp_path, 'wb')
+  try:
+    json.dump(index, f)
+  finally:
+    f.close()
+  os.rename(tmp_path, filepath)
+
+def loadFile(filepath, sig):
+  '''Get a parsed catalog file from the cache or parse it.
+
+  NOTE: Call with _lock held.
+  '''
+  cached = _files.get(filepath)
+  if cached and cached[0] == sig:
+    return cached[1]
+  stats['parses'] += 1
+  tree = readTree(filepath)
+  _files[filepath] = (sig, tree)
+  return tree
+
+@timing.timed('catalog')
+def load(years=None, pages=True):
+  '''Get the parsed catalog, re-parsing only files that have changed.
+
+  NOTE: The returned tree is shared by every request in the process and
+    must be treated as read-only.  Use put() and remove() to change the
+    catalog.
+
+  Args:
+    years: With a sharded catalog, only load the shards of these years
+      (all years if None, no posts if empty).  Ignored for a single
+      catalog file.
+    pages: With a sharded catalog, load the shard with pages and trash.
+
+  Returns:
+    ElementTree for the catalog file or a ShardedTree.
+  '''
+  filepaths = tuple(getFilepaths(years, pages))
+  sig = tuple(fullSignature(f) for f in filepaths)
+  _lock.acquire()
+  try:
+    view = _views.get(filepaths)
+    if view is not None:
+      if view['signature'] == sig:
+        stats['hits'] += 1
+        return view['tree']
+      stats['reloads'] += 1
+    else:
+      stats['misses'] += 1
+    trees = [loadFile(f, s) for f, s in zip(filepaths, sig)]
+    if isSharded():
+      tree = ShardedTree(zip(filepaths, trees))
+    else:
+      tree = trees[0]
+    _version[0] += 1
+    _views[filepaths] = {'tree': tree, 'signature': sig, 'derived': {}}
+    return tree
+  finally:
+    _lock.release()
+
+def invalidate(filepaths=None):
+  '''Drop cached trees so the next load() re-parses the catalog.
+
+  Args:
+    filepaths: Only drop these catalog files (all files if None).
+  '''
+  _lock.acquire()
+  try:
+    if filepaths is None:
+      _files.clear()
+      _views.clear()
+    else:
+      for filepath in filepaths:
+        _files.pop(filepath, None)
+      for key in _views.keys():
+        if [f for f in key if f in filepaths]:
+          del _views[key]
+    stats['invalidations'] += 1
+  finally:
+    _lock.release()
+
+def derived(tree, key, builder):
+  '''Get data derived from a catalog tree, building it on first use.
+
+  Derived data (indexes, menus, ...) of a cached tree is kept until the
+  catalog is re-parsed or invalidated, so it is built once per catalog
+  version.  Trees that are not cached (e.g. a writer's private copy) are
+  not memoized and the builder runs on every call.
+
+  Args:
+    tree: Catalog tree the data is derived from.
+    key: Name of the derived data.
+    builder: Called with the tree to build the data if needed.
+
+  Returns:
+    The derived data.
+  '''
+  _lock.acquire()
+  try:
+    cache = None
+    for view in _views.itervalues():
+      if view['tree'] is tree:
+        cache = view['derived']
+  finally:
+    _lock.release()
+  if cache is None:
+    return builder(tree)
+  if key not in cache:
+    cache[key] = builder(tree)
+  return cache[key]
+
+def version():
+  '''Get the version number of the catalog cache.
+
+  The number increases every time a catalog is (re-)loaded, so it can be
+  used as a key for data derived from the catalog.
+  '''
+  return _version[0]
+
+def getStats():
+  '''Get a snapshot of the cache counters.
+
+  Returns:
+    A dict with hits, misses, reloads, invalidations, parses and version.
+  '''
+  ret = dict(stats)
+  ret['version'] = _version[0]
+  return ret
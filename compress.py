@@ -0,0 +1,219 @@
+#!/usr/bin/python
+'''
+Copyright (C) 2012 Mark West.
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+'''
+
+'''
+Information:
+  Output stage of the public views: HTML minification and compression.
+
+  With Config.MINIFY_HTML, comments and runs of whitespace are collapsed,
+  except in <pre>, <textarea>, <script> and <style> elements and between
+  <!-- fs:raw --> and <!-- fs:endraw --> markers, which the templates put
+  around content written with TinyMCE.
+
+  With Config.COMPRESS_RESPONSES, a gzip variant (and a brotli variant if
+  the brotli module is installed) of every body is made once and kept in a
+  memory cache keyed by a digest of the rendered body, so a page that
+  renders to the same bytes is never minified or compressed again.  The
+  variant is picked by the request's Accept-Encoding header.
+'''
+
+import re
+import time
+import zlib
+import hashlib
+import functools
+import threading
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+from django.utils.cache import patch_vary_headers
+
+import contentcache
+from config import Config
+
+# Preferred encodings first
+ENCODINGS = ['br', 'gzip']
+GZIP_LEVEL = 6
+# Bodies smaller than this (in bytes) are not compressed
+MIN_SIZE = 512
+
+_PRESERVE_RE = re.compile(
+  r'<!-- fs:raw -->(.*?)<!-- fs:endraw -->|(<(pre|textarea|script|style)\b.*?</\3\s*>)',
+  re.IGNORECASE | re.DOTALL)
+# Conditional comments (<!--[if IE]>) are kept
+_COMMENT_RE = re.compile(r'<!--(?!\[if).*?-->', re.DOTALL)
+_SPACE_RE = re.compile(r'\s+')
+
+_lock = threading.Lock()
+_cache = contentcache.LRUCache(Config.COMPRESS_CACHE_BYTES)
+
+# Counters for the SU page (see getStats()).
+stats = {'hits': 0, 'misses': 0, 'raw_bytes': 0, 'sent_bytes': 0,
+  'cpu_time': 0.0, 'cpu_saved': 0.0}
+
+def minifyText(html):
+  '''Remove comments and collapse whitespace in HTML without raw parts.'''
+  return _SPACE_RE.sub(' ', _COMMENT_RE.sub('', html))
+
+def minify(html):
+  '''Minify HTML, keeping preformatted elements and raw content as is.
+
+  Args:
+    html: HTML string.
+
+  Returns:
+    The minified HTML string (without the fs:raw markers).
+  '''
+  ret = []
+  pos = 0
+  for m in _PRESERVE_RE.finditer(html):
+    ret.append(minifyText(html[pos:m.start()]))
+    ret.append(m.group(1) if m.group(1) is not None else m.group(2))
+    pos = m.end()
+  ret.append(minifyText(html[pos:]))
+  return ''.join(ret)
+
+def gzipBytes(data):
+  '''Compress data into the gzip format (without a timestamp).'''
+  compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+  return compressor.compress(data) + compressor.flush()
+
+def acceptedEncodings(header):
+  '''Get the set of encodings accepted by an Accept-Encoding header.'''
+  ret = set()
+  for part in header.split(','):
+    fields = part.split(';')
+    quality = 1.0
+    for field in fields[1:]:
+      field = field.strip()
+      if field.startswith('q='):
+        try:
+          quality = float(field[2:])
+        except ValueError:
+          quality = 0.0
+    if quality > 0:
+      ret.add(fields[0].strip().lower())
+  return ret
+
+def buildVariants(body):
+  '''Minify and compress a body.
+
+  Returns:
+    A dict with key=encoding ('identity', 'gzip', 'br'), value=body, and
+      key='cpu_time', value=seconds spent building it.
+  '''
+  start = time.time()
+  ret = {'identity': minify(body) if Config.MINIFY_HTML else body}
+  if Config.COMPRESS_RESPONSES and len(ret['identity']) >= MIN_SIZE:
+    ret['gzip'] = gzipBytes(ret['identity'])
+    if brotli:
+      ret['br'] = brotli.compress(ret['identity'])
+  ret['cpu_time'] = time.time() - start
+  return ret
+
+def getVariants(body):
+  '''Get the variants of a body from the cache or build them.'''
+  key = hashlib.sha1(body).digest()
+  _lock.acquire()
+  try:
+    entry = _cache.get(key)
+    if entry:
+      stats['hits'] += 1
+      stats['cpu_saved'] += entry['cpu_time']
+      return entry
+  finally:
+    _lock.release()
+  entry = buildVariants(body)
+  size = sum(len(v) for k, v in entry.iteritems() if k != 'cpu_time')
+  _lock.acquire()
+  try:
+    stats['misses'] += 1
+    stats['cpu_time'] += entry['cpu_time']
+    _cache.put(key, entry, size)
+  finally:
+    _lock.release()
+  return entry
+
+def requestEncoding(request):
+  '''Get the encoding of the variant sent for a request.
+
+  Bodies smaller than MIN_SIZE are sent as they are, whatever this says.
+
+  Returns:
+    'br', 'gzip' or 'identity'.
+  '''
+  if not Config.COMPRESS_RESPONSES:
+    return 'identity'
+  accepted = acceptedEncodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+  for e in ENCODINGS:
+    if e in accepted and (e != 'br' or brotli):
+      return e
+  return 'identity'
+
+def process(request, response):
+  '''Replace the body of a response with its best variant for the request.
+
+  Args:
+    request: View request object.
+    response: The rendered HttpResponse.
+
+  Returns:
+    The response.
+  '''
+  if not (Config.MINIFY_HTML or Config.COMPRESS_RESPONSES) or \
+     response.status_code not in (200, 404) or \
+     response.has_header('Content-Encoding') or \
+     not response['Content-Type'].startswith('text/html'):
+    return response
+  raw_size = len(response.content)
+  entry = getVariants(response.content)
+  if Config.COMPRESS_RESPONSES:
+    patch_vary_headers(response, ('Accept-Encoding',))
+  encoding = requestEncoding(request)
+  if encoding not in entry:
+    encoding = 'identity'
+  response.content = entry[encoding]
+  if encoding != 'identity':
+    response['Content-Encoding'] = encoding
+  response['Content-Length'] = str(len(response.content))
+  stats['raw_bytes'] += raw_size
+  stats['sent_bytes'] += len(response.content)
+  return response
+
+def compressed(view):
+  '''Decorator that passes the response of a public view through process().'''
+  @functools.wraps(view)
+  def wrapper(request, *args, **kwargs):
+    return process(request, view(request, *args, **kwargs))
+  return wrapper
+
+def getStats():
+  '''Get a snapshot of the counters.
+
+  Returns:
+    A dict with hits, misses, raw_bytes, sent_bytes, cpu_time (seconds
+    spent minifying and compressing), cpu_saved (seconds the cache saved),
+    ratio (sent to raw bytes), entries and bytes.
+  '''
+  ret = dict(stats)
+  ret['ratio'] = float(stats['sent_bytes']) / stats['raw_bytes'] \
+    if stats['raw_bytes'] else 1.0
+  ret['entries'] = len(_cache)
+  ret['bytes'] = _cache.bytes
+  return ret
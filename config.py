@@ -42,12 +42,104 @@ class Config:
   # Directory located in /media
   UPLOAD_DIR = 'uploads'
   
+  # Directory of the content-addressed upload store, located in UPLOAD_DIR
+  UPLOAD_STORE_DIR = '.store'
+  
+  # Widths (in pixels) of the smaller copies made of uploaded images
+  IMAGE_WIDTHS = [320, 640, 1024]
+  
+  # JPEG quality of the smaller copies
+  IMAGE_QUALITY = 80
+  
+  # Displayed image width for the browser to pick a copy (sizes attribute)
+  IMAGE_SIZES = '(max-width: 620px) 100vw, 620px'
+  
   # No reason to change this
   CATALOG_FILE = "catalog.xml"
   
+  # ElementTree implementation: 'lxml', 'cElementTree', 'ElementTree' or
+  # '' for the fastest installed one
+  XML_BACKEND = ''
+  
+  # Append catalog changes to a journal instead of rewriting the catalog
+  CATALOG_JOURNAL = False
+  
+  # Journal size (in bytes) that triggers folding it into the catalog
+  CATALOG_JOURNAL_MAX_BYTES = 256 * 1024
+  
+  # 'single' catalog file or 'sharded' into a catalog file per year (see
+  # "su.py shard")
+  CATALOG_LAYOUT = 'single'
+  
+  # Directory of the year shards, located in posts dir
+  CATALOG_SHARD_DIR = 'catalog'
+  
+  # 'xml' catalog file(s) or 'sqlite' database (see "su.py import-xml")
+  CATALOG_STORAGE = 'xml'
+  
+  # SQLite catalog database, located in posts dir
+  CATALOG_DB = 'catalog.db'
+  
+  # Posts listed per page on the SU page (0 to list them all)
+  SU_POSTS_PER_PAGE = 0
+  
+  # Full-text search index, located in posts dir (see "su.py reindex")
+  SEARCH_INDEX = 'search.idx'
+  
   # Located in posts dir
   WP_XML_FILE = ''
   
+  # Located in public dir; WordPress uploads (see "su.py uploads derive")
+  WP_UPLOAD_DIR = 'wp-content/uploads'
+  
   # Posts on or older than WP_END_DATE will be served by WP_XML_FILE
   WP_END_DATE = '1910-01-13'
-  
\ No newline at end of file
+  
+  # Memory used for caching parsed content files (in bytes)
+  CONTENT_CACHE_BYTES = 8 * 1024 * 1024
+  
+  # Threads used to parse the content files of a page
+  CONTENT_LOADER_THREADS = 4
+  
+  # Processes used by "su.py build" (0 to use one per CPU)
+  BUILD_PROCESSES = 0
+  
+  # Cache rendered public pages: '' (off), 'memory' or 'disk'
+  PAGE_CACHE = ''
+  
+  # Size of the page cache (in bytes, in memory or on disk)
+  PAGE_CACHE_BYTES = 32 * 1024 * 1024
+  
+  # Located in project dir; used by the 'disk' page cache
+  PAGE_CACHE_DIR = 'cache'
+  
+  # Seconds a process trusts the theme templates unchanged before it stats
+  # them again for the validators (ETag, Last-Modified) of public pages
+  TEMPLATE_RECHECK_SECONDS = 2
+  
+  # "Random News" posts: 'request' (drawn for every page) or 'pool' (drawn
+  # once and shared until it is re-drawn, so pages can be cached)
+  RANDOM_POSTS = 'request'
+  
+  # Seconds between draws of the 'pool' random posts (0 to keep them until
+  # the posts change)
+  RANDOM_POOL_SECONDS = 300
+  
+  # Public requests (per process) between draws of the 'pool' random posts
+  # (0 for no limit)
+  RANDOM_POOL_REQUESTS = 0
+  
+  # Minify the HTML of public pages (content between <!-- fs:raw --> and
+  # <!-- fs:endraw --> in the templates is kept as is)
+  MINIFY_HTML = False
+  
+  # Send public pages gzip (or brotli, if installed) compressed when the
+  # client accepts it
+  COMPRESS_RESPONSES = False
+  
+  # Memory used for caching minified and compressed pages (in bytes)
+  COMPRESS_CACHE_BYTES = 16 * 1024 * 1024
+  
+  # Record the time spent in each phase of a request (Server-Timing header
+  # for logged-in users and the SU timing page)
+  TIMING = False
@@ -0,0 +1,231 @@
+#!/usr/bin/python
+'''
+Copyright (C) 2012 Mark West.
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+'''
+
+'''
+Information:
+  Loader and in-memory cache for the content files in Config.POST_DIR.
+  
+  Decoded content is kept in a least recently used cache that is bounded
+  by memory size (Config.CONTENT_CACHE_BYTES) rather than entry count.
+  Entries are keyed by file path and mtime, so an edited file is never
+  served stale.  Cache misses of a page of posts are parsed together in a
+  small thread pool (Config.CONTENT_LOADER_THREADS).
+'''
+
+import os
+import sys
+import threading
+import multiprocessing.dummy
+import util
+import timing
+from xmlbackend import ET
+from config import Config
+
+class LRUCache:
+  '''Least recently used cache bounded by the total size of its values.
+  
+  Attributes:
+    max_bytes: Upper bound of the total size of the cached values.
+    bytes: Current total size of the cached values.
+  '''
+  def __init__(self, max_bytes):
+    '''Initializes LRUCache.
+    
+    Args:
+      max_bytes: Upper bound of the total size of the cached values.
+    '''
+    self.max_bytes = max_bytes
+    self.bytes = 0
+    self._map = {}
+    # Circular doubly linked list of [prev, next, key, value, size] with a
+    # sentinel; the most recently used entry is root[1].
+    self._root = []
+    self._root[:] = [self._root, self._root, None, None, 0]
+    
+  def __len__(self):
+    return len(self._map)
+    
+  def _unlink(self, link):
+    link[0][1] = link[1]
+    link[1][0] = link[0]
+    
+  def _push(self, link):
+    root = self._root
+    link[0] = root
+    link[1] = root[1]
+    root[1][0] = link
+    root[1] = link
+    
+  def get(self, key, default=None):
+    '''Get a value and mark it as most recently used.'''
+    link = self._map.get(key)
+    if link is None:
+      return default
+    self._unlink(link)
+    self._push(link)
+    return link[3]
+    
+  def put(self, key, value, size):
+    '''Add a value, evicting least recently used values as needed.
+    
+    Values larger than max_bytes are not cached.
+    '''
+    self.remove(key)
+    if size > self.max_bytes:
+      return
+    link = [None, None, key, value, size]
+    self._push(link)
+    self._map[key] = link
+    self.bytes += size
+    while self.bytes > self.max_bytes:
+      self.remove(self._root[0][2])
+      
+  def remove(self, key):
+    '''Remove a value if it is cached.'''
+    link = self._map.pop(key, None)
+    if link is not None:
+      self._unlink(link)
+      self.bytes -= link[4]
+      
+  def keys(self):
+    return self._map.keys()
+    
+_lock = threading.Lock()
+_cache = LRUCache(Config.CONTENT_CACHE_BYTES)
+_pool = []
+# Marks a cache miss (cached content may be None: a file without content)
+_MISSING = object()
+
+# Counters for confirming the cache works (see getStats()).
+stats = {'hits': 0, 'misses': 0}
+
+def parse(filepath):
+  '''Parse a content file.
+  
+  Args:
+    filepath: Content file to parse.
+  
+  Returns:
+    The content string.
+  '''
+  xml_tree = ET.parse(filepath)
+  wroot = util.ETWrap(xml_tree.getroot())
+  return wroot.content
+  
+def lookup(filepath):
+  '''Get the cache key of a content file.
+  
+  Returns:
+    Tuple with this structure: (filepath, mtime) or None if the file
+    does not exist.
+  '''
+  try:
+    return (filepath, os.stat(filepath).st_mtime)
+  except OSError:
+    return None
+    
+def store(key, content):
+  '''Add parsed content to the cache.'''
+  _lock.acquire()
+  try:
+    _cache.put(key, content, sys.getsizeof(content))
+  finally:
+    _lock.release()
+    
+def load(filepath):
+  '''Load the content of a single content file.
+  
+  Args:
+    filepath: Content file to load.
+  
+  Returns:
+    The content string (empty if the file does not exist).
+  '''
+  return loadMany([filepath])[0]
+  
+def loadMany(filepaths):
+  '''Load the content of several content files at once.
+  
+  Cached content is returned right away; the remaining files are parsed
+  in parallel.
+  
+  Args:
+    filepaths: List of content files to load.
+  
+  Returns:
+    A list with the content string for each file path (empty if the file
+    does not exist).
+  '''
+  ret = [''] * len(filepaths)
+  missing = []
+  # Stat the files before taking the lock, so readers never wait on the disk
+  keys = [lookup(filepath) for filepath in filepaths]
+  _lock.acquire()
+  try:
+    for n, key in enumerate(keys):
+      if key is None:
+        continue
+      content = _cache.get(key, _MISSING)
+      if content is _MISSING:
+        missing.append((n, key))
+        stats['misses'] += 1
+      else:
+        ret[n] = content
+        stats['hits'] += 1
+  finally:
+    _lock.release()
+  for n, key in missing:
+    timing.countFile(key[0])
+  if len(missing) > 1 and Config.CONTENT_LOADER_THREADS > 1:
+    parsed = getPool().map(parse, [key[0] for n, key in missing])
+  else:
+    parsed = [parse(key[0]) for n, key in missing]
+  for (n, key), content in zip(missing, parsed):
+    store(key, content)
+    ret[n] = content
+  return ret
+  
+def getPool():
+  '''Get the thread pool used for parsing (created on first use).'''
+  _lock.acquire()
+  try:
+    if not _pool:
+      _pool.append(multiprocessing.dummy.Pool(Config.CONTENT_LOADER_THREADS))
+    return _pool[0]
+  finally:
+    _lock.release()
+    
+def invalidate(filepath):
+  '''Drop all cached content of a content file.'''
+  _lock.acquire()
+  try:
+    for key in _cache.keys():
+      if key[0] == filepath:
+        _cache.remove(key)
+  finally:
+    _lock.release()
+    
+def getStats():
+  '''Get a snapshot of the cache counters.
+  
+  Returns:
+    A dict with hits, misses, entries and bytes.
+  '''
+  ret = dict(stats)
+  ret['entries'] = len(_cache)
+  ret['bytes'] = _cache.bytes
+  return ret
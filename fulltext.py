@@ -0,0 +1,358 @@
+#!/usr/bin/python
+'''
+Copyright (C) 2012 Mark West.
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+'''
+
+'''
+Information:
+  Full-text search over the titles and content of visible pages and posts.
+
+  The inverted index is kept on disk in a shelve file (Config.SEARCH_INDEX
+  in the posts dir) with these records:
+    't:TERM': Dict with key=document id, value=tuple with this
+              structure: (term frequency, document length, date)
+    'd:ID':   Dict with the document's title, URL, date, snippet, length
+              and term frequencies (needed to remove it again).
+    'meta':   Dict with the number of documents and their total length.
+  Native items use their name as document id, WordPress items 'wp:NAME'.
+
+  views.save() and views.trash() update single documents (see update() and remove());
+  "su.py reindex" rebuilds the whole index in parallel, e.g. after the
+  WordPress export changed, and writes every term record once (see
+  writeIndex()).  Results are ranked with Okapi BM25.
+'''
+
+import os
+import re
+import math
+import shelve
+import anydbm
+import datetime
+import htmlentitydefs
+import multiprocessing
+
+import util
+import wp
+import catalog
+import storage
+import contentcache
+from config import Config
+
+INDEX_FORMAT = 1
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+# Title words count as often as this in the document
+TITLE_WEIGHT = 2
+SNIPPET_SIZE = 200
+
+_MARKUP_RE = re.compile(r'<(script|style)\b.*?</\1\s*>|<!--.*?-->|<[^>]*>',
+  re.IGNORECASE | re.DOTALL)
+_ENTITY_RE = re.compile(r'&(#x[0-9a-fA-F]+|#[0-9]+|\w+);')
+_WORD_RE = re.compile(r'\w\w+', re.UNICODE)
+
+def getIndexFilepath():
+  '''Get the file of the search index.'''
+  return util.getFilepath(os.path.join(Config.POST_DIR, Config.SEARCH_INDEX))
+
+def toUnicode(text):
+  '''Decode UTF-8 strings (ElementTree returns str for ASCII text).'''
+  if isinstance(text, unicode):
+    return text
+  return (text or '').decode('utf-8', 'replace')
+
+def unescape(match):
+  '''Replace an HTML entity match with its character.'''
+  entity = match.group(1)
+  try:
+    if entity.startswith('#x'):
+      return unichr(int(entity[2:], 16))
+    if entity.startswith('#'):
+      return unichr(int(entity[1:]))
+    return unichr(htmlentitydefs.name2codepoint[entity])
+  except (KeyError, ValueError, OverflowError):
+    return match.group(0)
+
+def stripHTML(html):
+  '''Get the text of HTML content (e.g. written by TinyMCE).
+
+  Tags, comments, scripts and styles are removed and entities decoded.
+  '''
+  text = _MARKUP_RE.sub(' ', toUnicode(html))
+  return _ENTITY_RE.sub(unescape, text)
+
+def tokenize(text):
+  '''Split text into lower case search terms (words of 2+ characters).'''
+  return [w.lower() for w in _WORD_RE.findall(toUnicode(text))]
+
+def termKey(term):
+  return 't:' + term.encode('utf-8')
+
+def docKey(doc_id):
+  return 'd:' + doc_id.encode('utf-8')
+
+def docId(item):
+  '''Get the document id of an item.'''
+  if 'content_ref' in item:
+    return u'wp:' + toUnicode(item['name'])
+  return toUnicode(item['name'])
+
+def analyze(item, content):
+  '''Build the document of an item.
+
+  Args:
+    item: Page or post item.
+    content: Content of the item (HTML).
+
+  Returns:
+    Tuple with this structure: (document id, document dict)
+  '''
+  text = stripHTML(content)
+  title = toUnicode(item['title'])
+  tokens = tokenize(title) * TITLE_WEIGHT + tokenize(text)
+  terms = {}
+  for t in tokens:
+    terms[t] = terms.get(t, 0) + 1
+  url = item.get('url') or util.getURL(None, item['name'], item['type'])
+  doc = {
+    'type': item['type'],
+    'name': item['name'],
+    'title': item['title'],
+    'date': item['date'],
+    'url': url,
+    'snippet': ' '.join(text.split())[0:SNIPPET_SIZE],
+    'length': len(tokens),
+    'terms': terms
+    }
+  return (docId(item), doc)
+
+def openIndex(flag='c'):
+  '''Open the index shelf (see shelve.open for the flags).'''
+  return shelve.open(getIndexFilepath(), flag, protocol=2)
+
+def getMeta(shelf):
+  meta = shelf.get('meta')
+  if not meta or meta.get('format') != INDEX_FORMAT:
+    meta = {'format': INDEX_FORMAT, 'docs': 0, 'length': 0}
+  return meta
+
+def removeDoc(shelf, meta, doc_id):
+  '''Remove a document from an open index.'''
+  key = docKey(doc_id)
+  doc = shelf.get(key)
+  if doc is None:
+    return
+  for term in doc['terms']:
+    postings = shelf.get(termKey(term), {})
+    postings.pop(doc_id, None)
+    if postings:
+      shelf[termKey(term)] = postings
+    elif termKey(term) in shelf:
+      del shelf[termKey(term)]
+  del shelf[key]
+  meta['docs'] -= 1
+  meta['length'] -= doc['length']
+
+def addDoc(shelf, meta, doc_id, doc):
+  '''Add a document to an open index (replacing an existing one).
+
+  Every term record of the document is read and written again, which is
+  fine for single documents (see update()) but not for a whole index (see
+  writeIndex()).
+  '''
+  removeDoc(shelf, meta, doc_id)
+  for term, tf in doc['terms'].iteritems():
+    postings = shelf.get(termKey(term), {})
+    postings[doc_id] = (tf, doc['length'], doc['date'])
+    shelf[termKey(term)] = postings
+  shelf[docKey(doc_id)] = doc
+  meta['docs'] += 1
+  meta['length'] += doc['length']
+
+def writeIndex(shelf, docs):
+  '''Write every document to a new, empty index.
+
+  The postings of all documents are collected in memory first, so every
+  term record is written once.
+
+  Args:
+    shelf: The open, empty index.
+    docs: List of tuples with this structure: (document id, document dict)
+  '''
+  meta = getMeta(shelf)
+  postings = {}
+  for doc_id, doc in dict(docs).iteritems():
+    for term, tf in doc['terms'].iteritems():
+      postings.setdefault(term, {})[doc_id] = (tf, doc['length'], doc['date'])
+    shelf[docKey(doc_id)] = doc
+    meta['docs'] += 1
+    meta['length'] += doc['length']
+  for term, term_postings in postings.iteritems():
+    shelf[termKey(term)] = term_postings
+  shelf['meta'] = meta
+
+def isIndexed(item):
+  '''Should the item be in the index?  (Only visible pages and posts.)'''
+  if 'content_ref' in item:
+    return True
+  return item['type'] in ('post', 'page') and \
+    (item.get('status') or '').lower() == 'visible'
+
+def change(removals, additions):
+  '''Remove and add documents in a single locked update of the index.'''
+  filepath = getIndexFilepath()
+  lock = catalog.acquireFileLock(filepath)
+  try:
+    shelf = openIndex()
+    try:
+      meta = getMeta(shelf)
+      for doc_id in removals:
+        removeDoc(shelf, meta, doc_id)
+      for doc_id, doc in additions:
+        addDoc(shelf, meta, doc_id, doc)
+      shelf['meta'] = meta
+    finally:
+      shelf.close()
+  finally:
+    catalog.releaseFileLock(lock)
+
+def update(item, content, old_name=None):
+  '''Update the document of a saved item.
+
+  Items that are not visible are removed from the index.
+
+  Args:
+    item: The saved item.
+    content: Content of the item (HTML).
+    old_name: Previous name of a renamed item.
+  '''
+  removals = [toUnicode(old_name)] if old_name else []
+  additions = []
+  if isIndexed(item):
+    additions.append(analyze(item, content))
+  else:
+    removals.append(docId(item))
+  change(removals, additions)
+
+def remove(names):
+  '''Remove the documents of native items (e.g. sent to the trash).'''
+  change([toUnicode(n) for n in names], [])
+
+def analyzeJob(item):
+  '''Load and analyze an item; runs in a worker process of reindex().'''
+  if 'content_ref' in item:
+    content = wp.loadContent(item)
+  else:
+    content = contentcache.parse(item['filepath']) \
+      if os.path.exists(item['filepath']) else ''
+  return analyze(item, content)
+
+def reindex(processes=None):
+  '''Rebuild the whole index.
+
+  Args:
+    processes: Number of worker processes.  Defaults to
+      Config.BUILD_PROCESSES or the CPU count.
+
+  Returns:
+    The number of indexed documents.
+  '''
+  xml_tree = storage.load()
+  wp_tree = wp.loadXML(wait=True)
+  items = []
+  for tag in ['post', 'page']:
+    for e in xml_tree.findall('./' + tag):
+      keys = ['type', 'name', 'title', 'date', 'url', 'status', 'filepath']
+      item = dict(zip(keys, util.ETWrap(e, mapped=True).fields(*keys)))
+      if isIndexed(item):
+        items.append(item)
+  for what in ['posts', 'pages']:
+    items.extend(wp.getItems(wp_tree, what))
+  processes = processes or Config.BUILD_PROCESSES or multiprocessing.cpu_count()
+  if len(items) > 1 and processes > 1:
+    pool = multiprocessing.Pool(processes)
+    try:
+      docs = pool.map(analyzeJob, items, chunksize=16)
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    docs = [analyzeJob(i) for i in items]
+  filepath = getIndexFilepath()
+  lock = catalog.acquireFileLock(filepath)
+  try:
+    shelf = openIndex('n')
+    try:
+      shelf.clear()  # dumbdbm ignores the 'n' flag
+      writeIndex(shelf, docs)
+    finally:
+      shelf.close()
+  finally:
+    catalog.releaseFileLock(lock)
+  return len(docs)
+
+def search(query, start=0, stop=None, now=None):
+  '''Find the pages and posts that match a query, best match first.
+
+  Args:
+    query: Search string; documents matching any of its words are found.
+    start: Index of the first result to return.
+    stop: Index after the last result to return (all if None).
+    now: Items dated after this are not found.  Defaults to utcnow().
+
+  Returns:
+    Tuple with this structure: (total number of results, list of result
+      dicts with type, name, title, date, url, snippet and score)
+  '''
+  terms = set(tokenize(query))
+  if not terms:
+    return (0, [])
+  if not now:
+    now = datetime.datetime.utcnow().isoformat(' ')
+  lock = catalog.acquireFileLock(getIndexFilepath(), shared=True)
+  try:
+    try:
+      shelf = openIndex('r')
+    except anydbm.error:
+      return (0, [])  # Not indexed yet
+    try:
+      meta = getMeta(shelf)
+      if meta['docs'] < 1:
+        return (0, [])
+      avg_length = float(meta['length']) / meta['docs']
+      scores = {}
+      for term in terms:
+        postings = shelf.get(termKey(term), {})
+        if not postings:
+          continue
+        idf = math.log(1 + (meta['docs'] - len(postings) + 0.5) / (len(postings) + 0.5))
+        for doc_id, (tf, length, date) in postings.iteritems():
+          if date > now:
+            continue  # Scheduled
+          norm = K1 * (1 - B + B * length / avg_length)
+          score = idf * tf * (K1 + 1) / (tf + norm)
+          scores[doc_id] = (scores.get(doc_id, (0,))[0] + score, date)
+      ranked = sorted(scores.iteritems(), key=lambda s: s[1], reverse=True)
+      results = []
+      for doc_id, (score, date) in ranked[start:stop]:
+        doc = shelf[docKey(doc_id)]
+        del doc['terms']
+        doc['score'] = score
+        results.append(doc)
+    finally:
+      shelf.close()
+  finally:
+    catalog.releaseFileLock(lock)
+  return (len(ranked), results)
@@ -0,0 +1,273 @@
+#!/usr/bin/python
+'''
+Copyright (C) 2012 Mark West.
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+'''
+
+'''
+Information:
+  Smaller variants ("derivatives") of uploaded images.
+
+  For every JPEG or PNG image, a resized and recompressed copy is made for
+  each width in Config.IMAGE_WIDTHS that is smaller than the image.  The
+  copies are written to "sizes/WIDTH/FILENAME" next to the image.
+  Uploads are queued to a background thread, so resizing never delays a
+  request, and "su.py uploads derive" backfills the existing uploads in a
+  pool of worker processes.  addSrcset (applied by the public views) lets
+  browsers pick the smallest variant that fits.
+
+  Resizing needs the Python Imaging Library (PIL).  Without it nothing is
+  derived and image tags are left as they are.
+'''
+
+import os
+import re
+import threading
+import multiprocessing
+import Queue
+import urllib
+import urlparse
+try:
+  from PIL import Image
+except ImportError:
+  try:
+    import Image
+  except ImportError:
+    Image = None
+
+import uploads
+import contentcache
+from config import Config
+
+EXTENSIONS = ['.jpg', '.jpeg', '.png']
+SIZES_DIR = uploads.SIZES_DIR
+# Directory the public URLs are served from
+PUBLIC_DIR = 'public'
+# Memory used for caching the widths of originals (in bytes, estimated)
+WIDTHS_CACHE_BYTES = 256 * 1024
+
+_lock = threading.Lock()
+# Uploads waiting for the background thread
+_queue = Queue.Queue()
+_worker = []
+# Widths of originals: key=filepath, value=(mtime, width)
+_widths = contentcache.LRUCache(WIDTHS_CACHE_BYTES)
+
+_IMG_RE = re.compile(r'<img\b[^>]*>', re.IGNORECASE)
+_SRC_RE = re.compile(r'''\bsrc\s*=\s*(["'])(.*?)\1''', re.IGNORECASE | re.DOTALL)
+
+def isImage(filepath):
+  '''Can derivatives be made of the file?'''
+  return os.path.splitext(filepath)[1].lower() in EXTENSIONS
+
+def derivedPath(filepath, width):
+  '''Get the derivative of an image for a width.'''
+  dirpath, filename = os.path.split(filepath)
+  return os.path.join(dirpath, SIZES_DIR, str(width), filename)
+
+def derive(filepath):
+  '''Make the missing or outdated derivatives of an image.
+
+  Args:
+    filepath: Image file.
+
+  Returns:
+    The number of derivatives written.
+  '''
+  if not Image or not isImage(filepath):
+    return 0
+  mtime = os.stat(filepath).st_mtime
+  todo = [w for w in Config.IMAGE_WIDTHS
+    if not os.path.exists(derivedPath(filepath, w)) or
+       os.stat(derivedPath(filepath, w)).st_mtime < mtime]
+  if not todo:
+    return 0
+  try:
+    original = Image.open(filepath)
+    original.load()
+  except IOError:
+    return 0  # Not an image PIL can read
+  count = 0
+  for width in todo:
+    if width >= original.size[0]:
+      continue
+    height = max(1, original.size[1] * width / original.size[0])
+    image = original
+    if image.mode not in ('RGB', 'RGBA', 'L'):
+      image = image.convert('RGBA' if original.format == 'PNG' else 'RGB')
+    image = image.resize((width, height), Image.ANTIALIAS)
+    path = derivedPath(filepath, width)
+    uploads.makeDirs(os.path.dirname(path))
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    if original.format == 'PNG':
+      image.save(tmp_path, 'PNG', optimize=True)
+    else:
+      image.save(tmp_path, 'JPEG', quality=Config.IMAGE_QUALITY,
+        optimize=True, progressive=True)
+    os.rename(tmp_path, path)
+    count += 1
+  return count
+
+def deriveJob(filepath):
+  '''Derive an image; runs in a worker process or the background thread.'''
+  try:
+    return derive(filepath)
+  except Exception:
+    return 0  # A broken image must not stop the other jobs
+
+def work():
+  '''Derive the queued uploads, one at a time; runs in the background thread.'''
+  while True:
+    deriveJob(_queue.get())
+
+def enqueue(filepath):
+  '''Queue an uploaded file for deriving in the background.
+
+  The web process only gets a thread (started on first use): forking worker
+  processes from a threaded server is unsafe.
+  '''
+  if not (Image and isImage(filepath) and Config.IMAGE_WIDTHS):
+    return
+  _lock.acquire()
+  try:
+    if not _worker:
+      thread = threading.Thread(target=work)
+      thread.daemon = True
+      thread.start()
+      _worker.append(thread)
+  finally:
+    _lock.release()
+  _queue.put(filepath)
+
+def getImageDirs():
+  '''Get the directories with images: uploads and WordPress uploads.'''
+  return [uploads.getUploadDir(), os.path.join(PUBLIC_DIR, Config.WP_UPLOAD_DIR)]
+
+def deriveAll(processes=None):
+  '''Make the missing derivatives of every image in getImageDirs().
+
+  Args:
+    processes: Number of worker processes.  Defaults to
+      Config.BUILD_PROCESSES or the CPU count.
+
+  Returns:
+    A dict with the counts of images and written derivatives.
+  '''
+  todo = []
+  for image_dir in getImageDirs():
+    for dirpath, dirnames, filenames in os.walk(image_dir):
+      for skip in uploads.getSkippedDirs():
+        if skip in dirnames:
+          dirnames.remove(skip)
+      todo.extend(os.path.join(dirpath, f) for f in filenames if isImage(f))
+  processes = processes or Config.BUILD_PROCESSES or multiprocessing.cpu_count()
+  if len(todo) > 1 and processes > 1:
+    pool = multiprocessing.Pool(processes)
+    try:
+      counts = pool.map(deriveJob, todo)
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    counts = [deriveJob(f) for f in todo]
+  return {'images': len(todo), 'derived': sum(counts)}
+
+def getWidth(filepath, mtime):
+  '''Get the width of an image (cached by mtime) or None.'''
+  _lock.acquire()
+  try:
+    cached = _widths.get(filepath)
+  finally:
+    _lock.release()
+  if cached and cached[0] == mtime:
+    return cached[1]
+  try:
+    width = Image.open(filepath).size[0]  # Only reads the header
+  except IOError:
+    width = None
+  _lock.acquire()
+  try:
+    _widths.put(filepath, (mtime, width), len(filepath) + 64)
+  finally:
+    _lock.release()
+  return width
+
+def srcset(url, host=None):
+  '''Get the srcset attribute value for an image URL.
+
+  Only local images (/media/... or /wp-content/...) with derivatives are
+  considered; absolute URLs keep their scheme and host.
+
+  Args:
+    url: URL of the image.
+    host: Host of the site.  Absolute URLs of other hosts are skipped, as
+      their derivatives are not served from PUBLIC_DIR.
+
+  Returns:
+    The srcset string or None if there are no derivatives.
+  '''
+  if not Image:
+    return None
+  parts = urlparse.urlsplit(url)
+  if parts.scheme not in ('', 'http', 'https') or \
+     (parts.netloc and parts.netloc.lower() != (host or '').lower()):
+    return None
+  path = urllib.unquote(parts.path)
+  filepath = os.path.join(PUBLIC_DIR, *path.strip('/').split('/'))
+  if not isImage(filepath) or '..' in path.split('/'):
+    return None
+  try:
+    mtime = os.stat(filepath).st_mtime
+  except OSError:
+    return None
+  candidates = []
+  for width in Config.IMAGE_WIDTHS:
+    try:
+      if os.stat(derivedPath(filepath, width)).st_mtime < mtime:
+        continue
+    except OSError:
+      continue
+    derived_url = derivedPath(parts.path, width).replace(os.sep, '/')
+    derived_url = urlparse.urlunsplit(parts[0:2] + (derived_url, '', ''))
+    candidates.append('%s %dw' % (derived_url, width))
+  if not candidates:
+    return None
+  width = getWidth(filepath, mtime)
+  if width:
+    candidates.append('%s %dw' % (url, width))
+  return ', '.join(candidates)
+
+def addSrcset(html, host=None):
+  '''Add srcset and sizes attributes to the <img> tags of HTML content.
+
+  Tags that already have a srcset are left alone.
+
+  Args:
+    html: HTML content.
+    host: Host of the site (see srcset()).
+  '''
+  def rewrite(match):
+    tag = match.group(0)
+    if 'srcset' in tag.lower():
+      return tag
+    src = _SRC_RE.search(tag)
+    if not src:
+      return tag
+    value = srcset(src.group(2).replace('&amp;', '&'), host)
+    if not value:
+      return tag
+    end = -2 if tag.endswith('/>') else -1
+    return '%s srcset="%s" sizes="%s"%s' % (tag[:end].rstrip(), value,
+      Config.IMAGE_SIZES, tag[end:])
+  return _IMG_RE.sub(rewrite, html)
@@ -0,0 +1,276 @@
+#!/usr/bin/python
+'''
+Copyright (C) 2012 Mark West.
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+'''
+
+'''
+Information:
+  Newest first post lists and the operations used to page through them.
+  
+  Listings combine several sorted sources (native posts and WordPress
+  posts).  Instead of materializing and concatenating every source, the
+  sources are merged lazily and only the requested page window is
+  visited.
+'''
+
+import datetime
+import itertools
+
+class PostList:
+  '''A read-only, newest first list of posts without the scheduled posts.
+  
+  Posts dated in the future are always at the front of a newest first
+  list, so they are skipped by moving the start of the list instead of
+  filtering every item.  NOTE: The items are shared; copy them before
+  making changes.
+  '''
+  def __init__(self, items, now=None):
+    '''Initializes PostList.
+    
+    Args:
+      items: Newest first list of items with a visible status.
+      now: Posts dated after this are skipped.  Defaults to utcnow().
+    '''
+    if not now:
+      now = datetime.datetime.utcnow().isoformat(' ')
+    first = 0
+    while first < len(items) and items[first]['date'] > now:
+      first += 1
+    self._items = items
+    self._first = first
+    
+  def __len__(self):
+    return len(self._items) - self._first
+    
+  def newest(self):
+    '''Get the date of the newest post.'''
+    return self._items[self._first]['date']
+    
+  def oldest(self):
+    '''Get the date of the oldest post.'''
+    return self._items[-1]['date']
+    
+  def countSince(self, date):
+    '''Get the number of posts dated on or after date (a binary search).'''
+    lo, hi = self._first, len(self._items)
+    while lo < hi:
+      mid = (lo + hi) // 2
+      if self._items[mid]['date'] >= date:
+        lo = mid + 1
+      else:
+        hi = mid
+    return lo - self._first
+    
+  def iterFrom(self, offset=0):
+    '''Iterate over the posts, starting at offset.'''
+    for i in xrange(self._first + offset, len(self._items)):
+      yield self._items[i]
+  
+class ShardedPostList:
+  '''A newest first list of posts split into shards that are loaded lazily.
+  
+  The shards must not overlap in time (e.g. one shard per year).  Shards
+  are only loaded when iteration reaches them, so a listing window near
+  the front never loads the older shards.  With a sizer, the length of
+  the list and the shards before an offset are known without loading them,
+  and with a dater too, getWindow() skips the shards before a window
+  without merging them.
+  '''
+  lazy = True
+  
+  def __init__(self, keys, loader, sizer=None, dater=None):
+    '''Initializes ShardedPostList.
+    
+    Args:
+      keys: Keys of the shards, newest first.
+      loader: Called with a key to get the PostList of the shard.
+      sizer: Called with a key to get the length of the PostList of the
+        shard without loading it (optional).
+      dater: Called with a key to get the date of the oldest post of the
+        shard (None if it has none) without loading it (optional).
+    '''
+    self._keys = keys
+    self._loader = loader
+    self._sizer = sizer
+    self._dater = dater
+    self._lists = {}
+    
+  def _list(self, key):
+    if key not in self._lists:
+      self._lists[key] = self._loader(key)
+    return self._lists[key]
+    
+  def _size(self, key):
+    if self._sizer and key not in self._lists:
+      return self._sizer(key)
+    return len(self._list(key))
+    
+  def __len__(self):
+    return sum(self._size(k) for k in self._keys)
+    
+  def spans(self):
+    '''Get the (length, date of the oldest post) of every shard, newest first.
+    
+    Returns:
+      A list of tuples (the date is None for an empty shard), or an empty
+        list without a sizer and a dater.
+    '''
+    if not (self._sizer and self._dater):
+      return []
+    ret = []
+    for key in self._keys:
+      if key in self._lists:
+        size = len(self._lists[key])
+        ret.append((size, self._lists[key].oldest() if size else None))
+      else:
+        ret.append((self._sizer(key), self._dater(key)))
+    return ret
+    
+  def iterFrom(self, offset=0):
+    '''Iterate over the posts, starting at offset.'''
+    for key in self._keys:
+      size = self._size(key)
+      if offset >= size:
+        offset -= size
+        continue
+      for item in self._list(key).iterFrom(offset):
+        yield item
+      offset = 0
+  
+def mergeItems(sources):
+  '''Lazily merge newest first item iterables (a k-way merge).
+    
+  Args:
+    sources: List of iterables, each sorted newest first.
+    
+  Returns:
+    A generator of the merged items, newest first.
+  '''
+  heads = []
+  for source in sources:
+    it = iter(source)
+    for first in it:
+      heads.append([first, it])
+      break
+  while heads:
+    head = max(heads, key=lambda h: h[0]['date'])
+    yield head[0]
+    try:
+      head[0] = head[1].next()
+    except StopIteration:
+      heads.remove(head)
+      
+def getItem(post_lists, index):
+  '''Get a copy of a post of the post lists by its index.
+  
+  The index counts the posts of the lists one list after the other (not
+  in merged order), so only the list with the post is visited.  Used to
+  draw random posts.
+    
+  Args:
+    post_lists: List of PostList objects.
+    index: Index of the post, less than the sum of the lengths.
+    
+  Returns:
+    A copy of the post.
+  '''
+  for l in post_lists:
+    size = len(l)
+    if index < size:
+      return l.iterFrom(index).next().copy()
+    index -= size
+  raise IndexError(index)
+  
+def skipShards(post_lists, start):
+  '''Get the offsets in the post lists where the merge of a window starts.
+  
+  The shards of a lazy list (see ShardedPostList.spans()) do not overlap
+  in time, so the posts of the first shards and the posts of the other
+  lists that are at least as new as the oldest of them are the front of
+  the merged lists.  Whole shards that end before start are skipped that
+  way, with a binary search in the other lists, instead of being merged.
+    
+  Args:
+    post_lists: List of PostList objects, one of them lazy.
+    start: Index of the first post of the window.
+    
+  Returns:
+    Tuple with this structure: (list of offsets, number of skipped posts)
+  '''
+  offsets = [0] * len(post_lists)
+  skipped = 0
+  lazy = [l for l in post_lists if getattr(l, 'lazy', False)]
+  others = [l for l in post_lists if l not in lazy]
+  if len(lazy) != 1 or [l for l in others if not hasattr(l, 'countSince')]:
+    return (offsets, skipped)
+  position = 0
+  for size, oldest in lazy[0].spans():
+    if not size:
+      continue
+    counts = [position + size if l is lazy[0] else l.countSince(oldest)
+      for l in post_lists]
+    if sum(counts) > start:
+      break
+    position += size
+    offsets = counts
+    skipped = sum(counts)
+  return (offsets, skipped)
+  
+def getWindow(post_lists, start, stop):
+  '''Get the [start:stop] window of the merged post lists.
+  
+  Only the posts needed to fill the window are visited.  If the lists do
+  not overlap in time (e.g. the WordPress archive ends before the first
+  native post) the window is taken from each list by offset, and lists
+  outside the window are never iterated.  Lazy lists (see
+  ShardedPostList) are always merged, from the first shard that reaches
+  the window (see skipShards()), so they are only loaded as far as the
+  window reaches.
+    
+  Args:
+    post_lists: List of PostList objects.
+    start: Index of the first post of the window.
+    stop: Index after the last post of the window.
+    
+  Returns:
+    A list of copies of the posts in the window, newest first.
+  '''
+  if [l for l in post_lists if getattr(l, 'lazy', False)]:
+    offsets, skipped = skipShards(post_lists, start)
+    sources = [l.iterFrom(o) for l, o in zip(post_lists, offsets)]
+    window = itertools.islice(mergeItems(sources), start - skipped,
+      stop - skipped)
+    return [i.copy() for i in window]
+  post_lists = [l for l in post_lists if len(l) > 0]
+  post_lists.sort(key=lambda l: l.newest(), reverse=True)
+  disjoint = True
+  for i in range(len(post_lists) - 1):
+    if post_lists[i].oldest() < post_lists[i+1].newest():
+      disjoint = False
+  size = stop - start
+  if disjoint:
+    window = []
+    for l in post_lists:
+      if start >= len(l):
+        start -= len(l)
+        continue
+      window.extend(itertools.islice(l.iterFrom(start), size - len(window)))
+      start = 0
+      if len(window) >= size:
+        break
+  else:
+    sources = [l.iterFrom() for l in post_lists]
+    window = itertools.islice(mergeItems(sources), start, stop)
+  return [i.copy() for i in window]
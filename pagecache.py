@@ -0,0 +1,378 @@
+#!/usr/bin/python
+'''
+Copyright (C) 2012 Mark West.
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+'''
+
+'''
+Information:
+  Opt-in cache of rendered public pages (see Config.PAGE_CACHE).
+  
+  Responses are cached by path and page number (the 'p' query key; other
+  query keys are ignored, so they cannot fill the cache) and served to
+  anonymous visitors without parsing or rendering anything.  Only 200
+  responses are cached.  Both backends are bounded by
+  Config.PAGE_CACHE_BYTES.  An entry is dropped when:
+    * the SU user changes content (views.save, views.trash, views.su_new
+      and "su.py trash" call invalidate()),
+    * the catalog or the WordPress export changed on disk (checked with
+      os.stat, or the version of an SQLite catalog, on every hit, which
+      covers other processes),
+    * a scheduled post or page is published (entries expire at the date
+      of the next scheduled item), or
+    * the version of the page changed (see cached(); e.g. the random posts
+      pool was drawn again).
+  Authenticated users always get a freshly rendered page.
+
+  Public pages also answer conditional GET requests (see conditional()).
+  The ETag and Last-Modified validators are computed from file stats of
+  the catalog, the WordPress export, the theme templates and the content
+  files, plus the date of the last published item, so a 304 Not Modified
+  is returned without rendering anything.  The ETag of a compressed body
+  names the encoding compress.process() picked for it (e.g.
+  "<digest>-gzip"), so every encoding of a page has its own strong
+  validator; If-None-Match is compared without that suffix.
+'''
+
+import os
+import re
+import hashlib
+import functools
+import datetime
+import threading
+import cPickle as pickle
+
+from django.http import HttpResponse
+from django.views.decorators.http import condition
+
+import util
+import wp
+import storage
+import compress
+import contentcache
+from config import Config
+
+_lock = threading.Lock()
+_memory = contentcache.LRUCache(Config.PAGE_CACHE_BYTES)
+# Estimated size of the disk backend (None until the directory is scanned)
+_disk_bytes = [None]
+
+# Encoding suffix of an entity tag (see conditional())
+_ENCODING_RE = re.compile(r'-(?:%s)"' % ('|'.join(compress.ENCODINGS)))
+
+# Counters for confirming the cache works (see getStats()).
+stats = {'hits': 0, 'misses': 0, 'bypasses': 0, 'invalidations': 0}
+
+def enabled():
+  '''Is the page cache turned on?'''
+  return Config.PAGE_CACHE in ('memory', 'disk')
+  
+def getCacheDir():
+  '''Get the directory of the disk backend.'''
+  return util.getFilepath(Config.PAGE_CACHE_DIR)
+  
+def signature():
+  '''Get the signature of the sources every cached page depends on.'''
+  ret = [storage.signature()]
+  wp_tree = wp.loadXML()
+  if wp_tree:
+    ret.append(wp_tree.source)  # Of the served sidecar (see wp.loadXML())
+  return tuple(ret)
+  
+def fileSignature(filepath):
+  '''Get the (mtime, size, inode) of a file or None if it does not exist.'''
+  try:
+    st = os.stat(filepath)
+  except OSError:
+    return None
+  return (st.st_mtime, st.st_size, st.st_ino)
+  
+def validators(request, modified, content_filepath=None, *args, **kwargs):
+  '''Get the validators of a public page for conditional GET requests.
+  
+  The validators are computed once per request.
+  
+  Args:
+    request: View request object.
+    modified: Called without arguments to get the date string (UTC) of the
+      last published page or post.
+    content_filepath: Called with the view arguments to get the content file
+      of the page.
+  
+  Returns:
+    Tuple with this structure: (ETag, Last-Modified datetime (UTC)) or
+      (None, None) for authenticated users.
+  '''
+  if request.user.is_authenticated():
+    return (None, None)
+  if not hasattr(request, 'filestack_validators'):
+    filepaths = [util.getFilepath(Config.POST_DIR)] + storage.getFilepaths()
+    filepaths += wp.getFilepaths()
+    if content_filepath:
+      filepaths.append(content_filepath(*args, **kwargs))
+    sources = [fileSignature(f) for f in filepaths]
+    templates = util.getTemplateSignature(
+      max_age=Config.TEMPLATE_RECHECK_SECONDS)
+    sources += [t[1:] for t in templates]
+    published = modified()
+    etag = hashlib.sha1(repr((sources, signature(), published))).hexdigest()
+    last_modified = datetime.datetime.utcfromtimestamp(max(s[0] for s in sources if s))
+    if published:
+      published = datetime.datetime.strptime(published[0:19], '%Y-%m-%d %H:%M:%S')
+      last_modified = max(last_modified, published)
+    request.filestack_validators = (etag, last_modified)
+  return request.filestack_validators
+  
+def conditional(modified, content_filepath=None):
+  '''Decorator that answers conditional GET requests of a public view.
+  
+  Uses Django's condition decorator with the validators of validators().
+  The encoding of a compressed body is appended to its ETag afterwards, and
+  stripped from the tags of If-None-Match before they are compared.
+  
+  Args:
+    modified: See validators().
+    content_filepath: See validators().
+  
+  Returns:
+    The decorator.
+  '''
+  def etag(request, *args, **kwargs):
+    return validators(request, modified, content_filepath, *args, **kwargs)[0]
+  def lastModified(request, *args, **kwargs):
+    return validators(request, modified, content_filepath, *args, **kwargs)[1]
+  def decorator(view):
+    view = condition(etag_func=etag, last_modified_func=lastModified)(view)
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+      if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+      if if_none_match:
+        request.META['HTTP_IF_NONE_MATCH'] = _ENCODING_RE.sub('"', if_none_match)
+      response = view(request, *args, **kwargs)
+      if response.has_header('ETag') and response.has_header('Content-Encoding'):
+        response['ETag'] = '%s-%s"' % (response['ETag'][:-1],
+          response['Content-Encoding'])
+      return response
+    return wrapper
+  return decorator
+  
+def cacheKey(request):
+  '''Get the cache key of a request: its path and the page number.'''
+  key = request.path
+  try:
+    p = int(request.GET.get('p', 0))
+  except ValueError:
+    p = 0  # The view answers it with an error, which is not cached
+  if p:
+    key += '?p=%d' % (p)
+  return key
+  
+def trimDisk():
+  '''Remove the oldest entries of the disk backend to make room.
+  
+  The directory is shrunk to three quarters of Config.PAGE_CACHE_BYTES, so
+  it is not scanned again on every following write.
+  '''
+  cache_dir = getCacheDir()
+  entries = []
+  total = 0
+  for filename in os.listdir(cache_dir):
+    if filename.endswith('.tmp'):
+      continue  # Being written by another process
+    filepath = os.path.join(cache_dir, filename)
+    try:
+      st = os.stat(filepath)
+    except OSError:
+      continue  # Removed by another process
+    entries.append((st.st_mtime, st.st_size, filepath))
+    total += st.st_size
+  if total > Config.PAGE_CACHE_BYTES:
+    entries.sort()
+    for mtime, size, filepath in entries:
+      if total <= Config.PAGE_CACHE_BYTES * 3 / 4:
+        break
+      try:
+        os.remove(filepath)
+      except OSError:
+        pass  # Already removed by another process
+      total -= size
+  _disk_bytes[0] = total
+  
+def diskFilepath(key):
+  '''Get the file of a cache key in the disk backend.'''
+  return os.path.join(getCacheDir(), hashlib.sha1(key).hexdigest())
+  
+def read(key):
+  '''Read a raw cache entry from the backend (or None).'''
+  if Config.PAGE_CACHE == 'disk':
+    try:
+      f = open(diskFilepath(key), 'rb')
+    except IOError:
+      return None
+    try:
+      try:
+        return pickle.load(f)
+      except Exception:
+        return None
+    finally:
+      f.close()
+  _lock.acquire()
+  try:
+    return _memory.get(key)
+  finally:
+    _lock.release()
+    
+def write(key, entry):
+  '''Write a raw cache entry to the backend.'''
+  if Config.PAGE_CACHE == 'disk':
+    cache_dir = getCacheDir()
+    if not os.path.exists(cache_dir):
+      os.makedirs(cache_dir, 0755)
+    filepath = diskFilepath(key)
+    tmp_path = '%s.%d.tmp' % (filepath, os.getpid())
+    f = open(tmp_path, 'wb')
+    try:
+      pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+      size = f.tell()
+    finally:
+      f.close()
+    os.rename(tmp_path, filepath)
+    _lock.acquire()
+    try:
+      if _disk_bytes[0] is not None:
+        _disk_bytes[0] += size
+      if _disk_bytes[0] is None or _disk_bytes[0] > Config.PAGE_CACHE_BYTES:
+        trimDisk()
+    finally:
+      _lock.release()
+    return
+  _lock.acquire()
+  try:
+    _memory.put(key, entry, len(entry['body']))
+  finally:
+    _lock.release()
+    
+def get(key, version=None):
+  '''Get a cached response for a key if it is still valid.
+  
+  Args:
+    key: Cache key of the request (see cacheKey()).
+    version: Version of the page the entry must have been cached with.
+  
+  Returns:
+    A HttpResponse or None if there is no valid entry.
+  '''
+  entry = read(key)
+  if not entry:
+    return None
+  now = datetime.datetime.utcnow().isoformat(' ')
+  if entry['signature'] != signature() or \
+     entry.get('version') != version or \
+     (entry['expires'] and entry['expires'] <= now):
+    return None
+  response = HttpResponse(entry['body'], content_type=entry['content_type'])
+  response.status_code = entry['status']
+  return response
+  
+def put(key, response, expires=None, version=None):
+  '''Cache a response.
+  
+  Args:
+    key: Cache key of the request (see cacheKey()).
+    response: The rendered HttpResponse.
+    expires: Date string (UTC, 'YYYY-MM-DD HH:MM:SS') when the entry
+      becomes stale or None.
+    version: Version of the page (see get()).
+  '''
+  write(key, {
+    'signature': signature(),
+    'version': version,
+    'expires': expires,
+    'status': response.status_code,
+    'content_type': response['Content-Type'],
+    'body': response.content
+  })
+  
+def invalidate():
+  '''Drop every cached page.'''
+  _lock.acquire()
+  try:
+    for key in _memory.keys():
+      _memory.remove(key)
+    _disk_bytes[0] = None
+    stats['invalidations'] += 1
+  finally:
+    _lock.release()
+  cache_dir = getCacheDir()
+  if os.path.isdir(cache_dir):
+    for filename in os.listdir(cache_dir):
+      try:
+        os.remove(os.path.join(cache_dir, filename))
+      except OSError:
+        pass  # Already removed by another process
+        
+def cached(expires, version=None):
+  '''Decorator that serves a public view from the page cache.
+  
+  Args:
+    expires: Called without arguments to get the expiry date of a newly
+      cached page (see put()).
+    version: Called without arguments to get the current version of the
+      pages, for changes that cannot be dated in advance.  Entries of
+      another version are stale.
+  
+  Returns:
+    The decorator.
+  '''
+  def decorator(view):
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+      if not enabled() or request.method != 'GET' or \
+         request.user.is_authenticated():
+        stats['bypasses'] += 1
+        return view(request, *args, **kwargs)
+      key = cacheKey(request)
+      current = version() if version else None
+      response = get(key, current)
+      if response:
+        stats['hits'] += 1
+        return response
+      stats['misses'] += 1
+      response = view(request, *args, **kwargs)
+      if response.status_code == 200:
+        put(key, response, expires(), current)
+      return response
+    return wrapper
+  return decorator
+  
+def getStats():
+  '''Get a snapshot of the cache counters.
+  
+  Returns:
+    A dict with hits, misses, bypasses, invalidations, hit_ratio, entries
+    and bytes.
+  '''
+  ret = dict(stats)
+  lookups = stats['hits'] + stats['misses']
+  ret['hit_ratio'] = float(stats['hits']) / lookups if lookups else 0.0
+  if Config.PAGE_CACHE == 'disk':
+    cache_dir = getCacheDir()
+    filenames = os.listdir(cache_dir) if os.path.isdir(cache_dir) else []
+    ret['entries'] = len(filenames)
+    ret['bytes'] = sum(os.path.getsize(os.path.join(cache_dir, f))
+      for f in filenames)
+  else:
+    ret['entries'] = len(_memory)
+    ret['bytes'] = _memory.bytes
+  return ret
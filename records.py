@@ -0,0 +1,158 @@
+#!/usr/bin/python
+'''
+Copyright (C) 2012 Mark West.
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+'''
+
+'''
+Information:
+  Compact records of pages and posts ("items").
+
+  Items of the catalog and of the WordPress export are Item objects with
+  __slots__ instead of dicts, so a large archive costs a fraction of the
+  memory.  Categories and tags are tuples shared by all items with the
+  same terms, and the date fields (date_short, year, month, day, time)
+  are sliced from the date when they are read instead of being stored.
+'''
+
+# Fields an item can have
+FIELDS = ('type', 'name', 'date', 'url', 'title', 'status', 'filepath',
+  'parent', 'content', 'tags', 'categories', 'trash', 'post_id',
+  'content_ref', 'tag')
+# Fields computed from the date
+DATE_FIELDS = ('date_short', 'year', 'month', 'day', 'time')
+_KEYS = frozenset(FIELDS + DATE_FIELDS)
+DATE_SIZE = len("YYYY-MM-DD")
+
+# Shared term tuples: key=tuple or CSV string, value=tuple
+_terms = {}
+
+def terms(values):
+  '''Get the shared tuple of a list of category or tag names.'''
+  values = tuple(values)
+  return _terms.setdefault(values, values)
+
+def splitTerms(csv):
+  '''Get the shared tuple of a comma separated list of names.'''
+  if not csv:
+    return ()
+  ret = _terms.get(csv)
+  if ret is None:
+    ret = _terms.setdefault(csv, terms(csv.split(',')))
+  return ret
+
+class Item(object):
+  '''A page or post.
+
+  Behaves like the dicts items used to be: item['title'], item.get(),
+  'parent' in item, and keys()/iteritems() over the fields that are set
+  (so Django templates, the forms code and views.updateElem() work as
+  before).  Only the names in FIELDS can be set; the names in DATE_FIELDS
+  can be read.
+  '''
+  __slots__ = FIELDS
+
+  def __init__(self, **fields):
+    for key, value in fields.iteritems():
+      self[key] = value
+
+  def __getitem__(self, key):
+    if key in _KEYS:
+      try:
+        return getattr(self, key)
+      except AttributeError:
+        pass
+    raise KeyError(key)
+
+  def __setitem__(self, key, value):
+    if key not in FIELDS:
+      raise KeyError(key)
+    setattr(self, key, value)
+
+  def __delitem__(self, key):
+    try:
+      delattr(self, key)
+    except AttributeError:
+      raise KeyError(key)
+
+  def __contains__(self, key):
+    return key in FIELDS and hasattr(self, key)
+
+  def __iter__(self):
+    return iter(self.keys())
+
+  def __len__(self):
+    return len(self.keys())
+
+  def __repr__(self):
+    return 'Item(%s)' % (', '.join('%s=%r' % kv for kv in self.iteritems()))
+
+  def __getstate__(self):
+    return dict(self.iteritems())
+
+  def __setstate__(self, state):
+    self.update(state)
+
+  def get(self, key, default=None):
+    try:
+      return self[key]
+    except KeyError:
+      return default
+
+  def keys(self):
+    return [k for k in FIELDS if hasattr(self, k)]
+
+  def iteritems(self):
+    for k in FIELDS:
+      try:
+        yield (k, getattr(self, k))
+      except AttributeError:
+        pass
+
+  def items(self):
+    return list(self.iteritems())
+
+  def update(self, other):
+    for key, value in other.iteritems():
+      self[key] = value
+
+  def copy(self):
+    '''Get a shallow copy.'''
+    ret = Item()
+    for k in FIELDS:
+      try:
+        setattr(ret, k, getattr(self, k))
+      except AttributeError:
+        pass
+    return ret
+
+  @property
+  def date_short(self):
+    return self.date[0:DATE_SIZE]
+
+  @property
+  def year(self):
+    return self.date[0:4]
+
+  @property
+  def month(self):
+    return self.date[5:7]
+
+  @property
+  def day(self):
+    return self.date[8:10]
+
+  @property
+  def time(self):
+    return self.date[DATE_SIZE+1:DATE_SIZE+9]
@@ -0,0 +1,268 @@
+#!/usr/bin/python
+'''
+Copyright (C) 2012 Mark West.
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+'''
+
+'''
+Information:
+  Pre-renders the public site into static files (see "su.py build").
+  
+  Every public URL (index and its pagination, posts, pages, category and
+  tag listings, and the 404 page) is rendered with the theme templates and
+  written below an output directory that a webserver can serve directly.
+  Listing pages are written to "<URL>p=<N>/index.html" for ?p=<N>.  Pages
+  are rendered without the page cache and output stages of the live views,
+  and the random posts pool is drawn from the shared inputs of the build.
+  
+  Rebuilds are incremental.  A manifest in the output directory records a
+  digest of the inputs of every output file, and only the outputs whose
+  inputs changed are rendered again:
+    * the shared sidebars: titles, URLs and categories of all visible
+      posts, and the page menu,
+    * the theme templates,
+    * the catalog entry and content file of every post shown on the page.
+'''
+
+import os
+import random
+import hashlib
+import datetime
+import multiprocessing
+try:
+  import json
+except ImportError:
+  import simplejson as json
+
+from django.http import HttpRequest, QueryDict
+from django.contrib.auth.models import AnonymousUser
+
+import util
+import wp
+import views
+import storage
+import contentcache
+import listing
+from config import Config
+
+MANIFEST_FILE = '.filestack-manifest.json'
+
+def getRequest(path, query=''):
+  '''Create an anonymous GET request for rendering a view.'''
+  request = HttpRequest()
+  request.method = 'GET'
+  request.path = path
+  request.GET = QueryDict(query)
+  request.user = AnonymousUser()
+  return request
+  
+def digest(*parts):
+  '''Get a hex digest of a JSON serializable value.'''
+  return hashlib.sha1(json.dumps(parts, sort_keys=True)).hexdigest()
+  
+def contentSignature(item):
+  '''Get the signature of an item's catalog entry and content.'''
+  keys = ['name', 'title', 'url', 'date', 'categories', 'tags', 'parent']
+  ret = [item.get(k) for k in keys]
+  if 'content_ref' in item:
+    ret.append(item['content_ref'])
+  else:
+    key = contentcache.lookup(item['filepath'])
+    ret.append(key and key[1])
+  return ret
+  
+def listingPath(path, p):
+  '''Get the output path of page p of a listing URL.'''
+  if p == 0:
+    return path
+  return '%sp=%d/' % (path, p)
+  
+def menuPaths(menu, prefix='/'):
+  '''Get the URL of every page in the menu (including nested URLs).'''
+  ret = []
+  for title, slug, children in menu:
+    path = '%s%s/' % (prefix, slug)
+    ret.append(path)
+    ret.extend(menuPaths(children, path))
+  return ret
+  
+def plan(xml_tree, wp_tree):
+  '''Get every output of the site and the digest of its inputs.
+  
+  Args:
+    xml_tree: Standard XML tree object.
+    wp_tree: WordPress XML tree object.
+  
+  Returns:
+    A tuple with this structure: (digest of the shared inputs, jobs)
+    A job is a tuple with this structure:
+      (URL path, render function name in views, args, query string, digest)
+  '''
+  post_lists = [views.getPostList(xml_tree), wp.getPostList(wp_tree)]
+  posts = listing.getWindow(post_lists, 0, sum(len(l) for l in post_lists))
+  menu = views.getMenu(xml_tree, wp_tree)
+  shared = digest(
+    [(p['url'], p['title'], p['categories']) for p in posts],
+    menu, util.getTemplateSignature(),
+    [(k, v) for k, v in sorted(Config.__dict__.items()) if k.isupper()])
+  jobs = []
+  per_page = Config.POSTS_PER_PAGE
+  
+  def addListing(path, view, args, items):
+    for p in range(max(1, (len(items) + per_page - 1) / per_page)):
+      window = items[p*per_page:(p+1)*per_page]
+      query = 'p=%d' % (p) if p else ''
+      deps = digest(shared, [contentSignature(i) for i in window])
+      jobs.append((listingPath(path, p), view, args, query, deps))
+      
+  addListing('/', 'showList', [], posts)
+  terms = {'categories': {}, 'tags': {}}
+  for post in posts:
+    for field in terms:
+      for term in post[field]:
+        terms[field].setdefault(term, []).append(post)
+  for cat, items in sorted(terms['categories'].items()):
+    addListing('/category/%s/' % (cat), 'showList', [cat], items)
+  for tag, items in sorted(terms['tags'].items()):
+    addListing('/tag/%s/' % (tag), 'showList', [None, tag], items)
+  for post in posts:
+    date = datetime.datetime.strptime(post['date'][0:10], '%Y-%m-%d')
+    path = util.getURL(date, post['name'])
+    args = ['post', post['name'], date]
+    jobs.append((path, 'getDetail', args, '', digest(shared, contentSignature(post))))
+  pages = views.getVisiblePages(xml_tree) + wp.getItems(wp_tree, 'pages')
+  pages = dict((p['name'], p) for p in pages)
+  for path in menuPaths(menu):
+    slug = path.split('/')[-2]
+    page = pages.get(slug)
+    deps = digest(shared, page and contentSignature(page))
+    jobs.append((path, 'getDetail', ['page', slug], '', deps))
+  jobs.append(('/404', 'get404', [], '', shared))
+  return (shared, jobs)
+  
+def outputFilepath(outdir, path):
+  '''Get the file written for a URL path.'''
+  if path.endswith('/'):
+    path += 'index.html'
+  else:
+    path += '.html'
+  return os.path.join(outdir, *path.strip('/').split('/'))
+  
+def render(job):
+  '''Render a job and write its output file.
+  
+  Runs in a worker process of the build pool.
+  
+  Args:
+    job: Tuple with this structure: (output directory, job from plan())
+  
+  Returns:
+    Tuple with this structure: (URL path, status code)
+  '''
+  outdir, (path, view, args, query, deps) = job
+  # Keep the "Random News" sidebar stable between builds (when it is drawn
+  # for every page, see Config.RANDOM_POSTS; the pool is fixed by build()).
+  random.seed(deps)
+  request = getRequest(path, query)
+  response = getattr(views, view)(request, *args)
+  filepath = outputFilepath(outdir, path)
+  if not os.path.exists(os.path.dirname(filepath)):
+    try:
+      os.makedirs(os.path.dirname(filepath), 0755)
+    except OSError:
+      pass  # Created by another worker
+  tmp_path = '%s.%d.tmp' % (filepath, os.getpid())
+  f = open(tmp_path, 'wb')
+  try:
+    f.write(response.content)
+  finally:
+    f.close()
+  os.rename(tmp_path, filepath)
+  return (path, response.status_code)
+  
+def readManifest(outdir):
+  '''Read the manifest of a previous build (empty if there is none).'''
+  filepath = os.path.join(outdir, MANIFEST_FILE)
+  if not os.path.exists(filepath):
+    return {}
+  f = open(filepath, 'rb')
+  try:
+    return json.load(f)
+  except ValueError:
+    return {}
+  finally:
+    f.close()
+    
+def writeManifest(outdir, manifest):
+  '''Write the manifest of a build.'''
+  filepath = os.path.join(outdir, MANIFEST_FILE)
+  f = open(filepath + '.tmp', 'wb')
+  try:
+    json.dump(manifest, f, sort_keys=True, indent=1)
+  finally:
+    f.close()
+  os.rename(filepath + '.tmp', filepath)
+  
+def build(outdir, processes=None):
+  '''Render the site into outdir, skipping unchanged outputs.
+  
+  Args:
+    outdir: Output directory.
+    processes: Number of render processes.  Defaults to
+      Config.BUILD_PROCESSES or the CPU count.
+  
+  Returns:
+    A dict with the counts of rendered, skipped and removed outputs.
+  '''
+  if not os.path.exists(outdir):
+    os.makedirs(outdir, 0755)
+  xml_tree = storage.load()
+  wp_tree = wp.loadXML(wait=True)
+  old = readManifest(outdir)
+  manifest = {}
+  todo = []
+  skipped = 0
+  shared, jobs = plan(xml_tree, wp_tree)
+  # Every page depends on the shared inputs, so a pool drawn from them only
+  # changes when every page is rendered again
+  views.fixRandomPool(shared)
+  for job in jobs:
+    path, deps = job[0], job[4]
+    manifest[path] = deps
+    if old.get(path) == deps and os.path.exists(outputFilepath(outdir, path)):
+      skipped += 1
+    else:
+      todo.append((outdir, job))
+  removed = 0
+  for path in old:
+    if path not in manifest:
+      filepath = outputFilepath(outdir, path)
+      if os.path.exists(filepath):
+        os.remove(filepath)
+        removed += 1
+  processes = processes or Config.BUILD_PROCESSES or multiprocessing.cpu_count()
+  try:
+    if len(todo) > 1 and processes > 1:
+      pool = multiprocessing.Pool(processes)
+      try:
+        pool.map(render, todo)
+      finally:
+        pool.close()
+        pool.join()
+    else:
+      map(render, todo)
+  finally:
+    views.fixRandomPool(None)
+  writeManifest(outdir, manifest)
+  return {'rendered': len(todo), 'skipped': skipped, 'removed': removed}
@@ -0,0 +1,500 @@
+#!/usr/bin/python
+'''
+Copyright (C) 2012 Mark West.
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+'''
+
+'''
+Information:
+  Storage of the catalog: the XML catalog file(s) or an SQLite database.
+
+  Readers get the catalog with load() and writers change it with put()
+  and remove(), whatever the storage.  Config.CATALOG_STORAGE picks it:
+    'xml':    The catalog file(s) of the catalog module (the default).
+              load() returns an ElementTree or a catalog.ShardedTree.
+    'sqlite': A table in Config.CATALOG_DB (in the posts dir) indexed on
+              type, status, date, slug, category and tag.  load() returns
+              an SQLTree, and listings, post pages and the SU lists are
+              indexed queries with LIMIT/OFFSET (see isIndexed()).
+  Content files stay in the posts dir either way.
+
+  Each row keeps its catalog element as XML, so "su.py export-xml" writes
+  a plain catalog file (e.g. before a tar backup) and "su.py import-xml"
+  loads one (e.g. to move an existing catalog into the database).
+'''
+
+import os
+import datetime
+import threading
+import sqlite3
+
+import util
+import catalog
+import records
+from xmlbackend import ET
+from config import Config
+
+# Tags of the catalog elements
+TAGS = ('post', 'page', 'trash')
+# Element fields kept in columns, in the order of ITEM_COLUMNS
+COLUMNS = ('name', 'type', 'status', 'date', 'url', 'title', 'filepath',
+  'parent', 'trash', 'tags', 'categories')
+ITEM_COLUMNS = ', '.join('i.' + c for c in COLUMNS)
+# Rows read by the first query of a listing; each next query reads twice
+# as many, so a full walk only takes a few queries
+BATCH_SIZE = 50
+
+SCHEMA = [
+  '''CREATE TABLE IF NOT EXISTS items (
+    name TEXT PRIMARY KEY,
+    tag TEXT NOT NULL,
+    type TEXT,
+    status TEXT,
+    date TEXT,
+    url TEXT,
+    title TEXT,
+    filepath TEXT,
+    parent TEXT,
+    trash TEXT,
+    tags TEXT,
+    categories TEXT,
+    status_key TEXT,
+    slug TEXT,
+    day TEXT,
+    xml TEXT NOT NULL)''',
+  'CREATE INDEX IF NOT EXISTS items_listing ON items (tag, status_key, date)',
+  'CREATE INDEX IF NOT EXISTS items_slug ON items (slug, tag)',
+  'CREATE INDEX IF NOT EXISTS items_day ON items (day, slug)',
+  '''CREATE TABLE IF NOT EXISTS terms (
+    name TEXT NOT NULL,
+    field TEXT NOT NULL,
+    term TEXT NOT NULL,
+    date TEXT)''',
+  'CREATE INDEX IF NOT EXISTS terms_listing ON terms (field, term, date)',
+  'CREATE INDEX IF NOT EXISTS terms_name ON terms (name)',
+  'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)',
+  "INSERT OR IGNORE INTO meta VALUES ('version', 0)",
+]
+
+_local = threading.local()
+_lock = threading.Lock()
+# Loaded catalogs: key=database file, value=SQLTree of its latest version
+_trees = {}
+
+def isSQLite():
+  '''Is the catalog stored in the SQLite database?'''
+  return Config.CATALOG_STORAGE == 'sqlite'
+
+def isSharded():
+  '''Is the catalog split into per-year XML shards (see catalog)?'''
+  return not isSQLite() and catalog.isSharded()
+
+def isIndexed(tree):
+  '''Is a loaded catalog an SQLTree (use its queries instead of findall)?'''
+  return isinstance(tree, SQLTree)
+
+def getDBFilepath():
+  '''Get the file of the SQLite catalog.'''
+  return util.getFilepath(os.path.join(Config.POST_DIR, Config.CATALOG_DB))
+
+def connect():
+  '''Get the database connection of this thread, made on first use.
+
+  Connections are not shared between threads, nor with processes forked
+  after they were made (e.g. by "su.py build").
+  '''
+  filepath = getDBFilepath()
+  key = (os.getpid(), filepath)
+  if getattr(_local, 'key', None) != key:
+    dirpath = os.path.dirname(filepath)
+    if not os.path.exists(dirpath):
+      os.makedirs(dirpath, 0755)
+    conn = sqlite3.connect(filepath, timeout=30)
+    conn.text_factory = decodeText
+    for statement in SCHEMA:
+      conn.execute(statement)
+    conn.commit()
+    _local.conn = conn
+    _local.key = key
+  return _local.conn
+
+def decodeText(data):
+  '''Decode a TEXT value like ElementTree does (str if it is ASCII).'''
+  try:
+    data.decode('ascii')
+    return data
+  except UnicodeError:
+    return data.decode('utf-8')
+
+def utcnow():
+  return datetime.datetime.utcnow().isoformat(' ')
+
+def toElement(xml):
+  '''Parse the XML of a row into an element.'''
+  return ET.fromstring(xml.encode('utf-8'))
+
+def rowToItem(row):
+  '''Convert a row of ITEM_COLUMNS into an item (see views.elementToItem).'''
+  (name, type, status, date, url, title, filepath, parent, trash, tags,
+   categories) = row
+  return records.Item(
+    type=type,
+    name=name,
+    date=date,
+    url=url,
+    title=title,
+    status=status,
+    filepath=filepath,
+    parent=parent,
+    content=None,
+    tags=records.splitTerms(tags),
+    categories=records.splitTerms(categories),
+    trash=trash
+    )
+
+def escapeLike(text):
+  '''Escape the wildcards of a LIKE pattern (with ESCAPE '\\').'''
+  return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def limit(start, stop):
+  '''Get the LIMIT/OFFSET clause and arguments of a [start:stop] window.'''
+  return (' LIMIT ? OFFSET ?', [-1 if stop is None else max(0, stop - start), start])
+
+class QueryPostList:
+  '''A listing.PostList of visible posts that reads the database.
+
+  The count and the newest and oldest dates are single indexed queries,
+  and iterating reads the rows in growing batches (see BATCH_SIZE), so a
+  listing window near the front only reads the rows it shows.
+  '''
+  def __init__(self, field=None, term=None, now=None):
+    '''Initializes QueryPostList.
+
+    Args:
+      field: Either 'categories', 'tags', or None for all posts.
+      term: The category or tag.
+      now: Posts dated after this are skipped.  Defaults to utcnow().
+    '''
+    now = now or utcnow()
+    if field:
+      self._from = "FROM terms t JOIN items i ON i.name = t.name " \
+        "WHERE t.field = ? AND t.term = ? AND t.date <= ? " \
+        "AND i.tag = 'post' AND i.status_key = 'visible'"
+      self._args = [field, term, now]
+      self._date = 't.date'
+    else:
+      self._from = "FROM items i WHERE i.tag = 'post' " \
+        "AND i.status_key = 'visible' AND i.date <= ?"
+      self._args = [now]
+      self._date = 'i.date'
+    self._len = None
+
+  def _query(self, select, rest='', args=[]):
+    sql = 'SELECT %s %s%s' % (select, self._from, rest)
+    return connect().execute(sql, self._args + args).fetchall()
+
+  def __len__(self):
+    if self._len is None:
+      self._len = self._query('COUNT(*)')[0][0]
+    return self._len
+
+  def newest(self):
+    '''Get the date of the newest post.'''
+    return self._query(self._date, ' ORDER BY %s DESC LIMIT 1' % (self._date))[0][0]
+
+  def oldest(self):
+    '''Get the date of the oldest post.'''
+    return self._query(self._date, ' ORDER BY %s LIMIT 1' % (self._date))[0][0]
+
+  def iterFrom(self, offset=0):
+    '''Iterate over the posts, starting at offset.'''
+    order = ' ORDER BY %s DESC' % (self._date)
+    size = BATCH_SIZE
+    while True:
+      clause, args = limit(offset, offset + size)
+      rows = self._query(ITEM_COLUMNS, order + clause, args)
+      for row in rows:
+        yield rowToItem(row)
+      if len(rows) < size:
+        return
+      offset += size
+      size *= 2
+
+class SQLTree:
+  '''Read-only view of one version of the SQLite catalog (see load()).
+
+  findall() and getroot() build the elements like an ElementTree does; the
+  other methods are the indexed queries.
+
+  Attributes:
+    version: Version of the database the view was loaded at.
+    derived: Data derived from this version (see derived()).
+  '''
+  def __init__(self, version):
+    self.version = version
+    self.derived = {}
+
+  def _query(self, sql, args=()):
+    return connect().execute(sql, args).fetchall()
+
+  def findall(self, path):
+    '''Find the elements of a tag ('./TAG'), in the order they were added.'''
+    rows = self._query('SELECT xml FROM items WHERE tag = ? ORDER BY rowid',
+      (path.split('/')[-1],))
+    return [toElement(r[0]) for r in rows]
+
+  def getroot(self):
+    '''Get a root element with all the elements (a copy).'''
+    root = ET.Element('catalog')
+    root.set('version', '0.1')
+    for r in self._query('SELECT xml FROM items ORDER BY rowid'):
+      root.append(toElement(r[0]))
+    return root
+
+  def find(self, name):
+    '''Get the element with a name or None.'''
+    rows = self._query('SELECT xml FROM items WHERE name = ?', (name,))
+    return toElement(rows[0][0]) if rows else None
+
+  def items(self, tag, visible=False, suffix=None, start=0, stop=None,
+      now=None):
+    '''Get the items of a tag, newest first.
+
+    Args:
+      tag: One of TAGS.
+      visible: Only items with a visible status that are published by now.
+      suffix: Only items whose slug ends with this (case-insensitive).
+      start: Index of the first item.
+      stop: Index after the last item (None for all).
+      now: Moment for visible.  Defaults to utcnow().
+
+    Returns:
+      A list of items (see records.Item).
+    '''
+    sql = 'SELECT %s FROM items i WHERE i.tag = ?' % (ITEM_COLUMNS)
+    args = [tag]
+    if visible:
+      sql += " AND i.status_key = 'visible' AND i.date <= ?"
+      args.append(now or utcnow())
+    if suffix:
+      sql += " AND i.slug LIKE ? ESCAPE '\\'"
+      args.append('%' + escapeLike(suffix.upper()))
+    clause, limit_args = limit(start, stop)
+    sql += ' ORDER BY i.date DESC' + clause
+    return [rowToItem(r) for r in self._query(sql, args + limit_args)]
+
+  def findSlug(self, tag, slug, day=None):
+    '''Get the items with a slug (case-insensitive), newest first.
+
+    Args:
+      tag: One of TAGS.
+      slug: Name/ID of the items.
+      day: Only items of this date (YYYY-MM-DD), if any has the slug.
+    '''
+    sql = 'SELECT %s FROM items i WHERE i.slug = ? AND i.tag = ?' % (ITEM_COLUMNS)
+    args = [slug.upper(), tag]
+    rows = []
+    if day:
+      rows = self._query(sql + ' AND i.day = ? ORDER BY i.date DESC', args + [day])
+    if not rows:
+      rows = self._query(sql + ' ORDER BY i.date DESC', args)
+    return [rowToItem(r) for r in rows]
+
+  def postList(self, field=None, term=None, now=None):
+    '''Get the visible posts, optionally only those with a category or tag.
+
+    Returns:
+      A QueryPostList.
+    '''
+    return QueryPostList(field, term, now)
+
+  def schedule(self):
+    '''Get the sorted dates of all pages and posts with a visible status.'''
+    rows = self._query("SELECT date FROM items WHERE tag IN ('post', 'page') "
+      "AND status_key = 'visible' ORDER BY date")
+    return [r[0] for r in rows]
+
+  def categories(self, now=None):
+    '''Get the categories that have at least one visible post.'''
+    rows = self._query("SELECT DISTINCT t.term FROM terms t "
+      "JOIN items i ON i.name = t.name WHERE t.field = 'categories' "
+      "AND t.date <= ? AND i.tag = 'post' AND i.status_key = 'visible'",
+      (now or utcnow(),))
+    return set(r[0] for r in rows)
+
+def load(years=None, pages=True):
+  '''Get the catalog.
+
+  NOTE: The returned catalog is shared by every request in the process and
+    must be treated as read-only.  Use put() and remove() to change it.
+
+  Args:
+    years: With a sharded XML catalog, only load the shards of these years
+      (see catalog.load()).
+    pages: With a sharded XML catalog, load the shard with pages and trash.
+
+  Returns:
+    ElementTree, catalog.ShardedTree or SQLTree.
+  '''
+  if not isSQLite():
+    return catalog.load(years, pages)
+  conn = connect()
+  version = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+  filepath = getDBFilepath()
+  _lock.acquire()
+  try:
+    tree = _trees.get(filepath)
+    if tree is None or tree.version != version:
+      tree = _trees[filepath] = SQLTree(version)
+    return tree
+  finally:
+    _lock.release()
+
+def loadNamed(names):
+  '''Get the catalog with the elements of the given names (see load()).
+
+  With a sharded XML catalog only the shard with pages and trash and the
+  year shards that have one of the names are loaded (see
+  catalog.getNameYears()).
+
+  Args:
+    names: Names of the elements.
+  '''
+  if not isSharded():
+    return load()
+  years = set()
+  for name in names:
+    years.update(catalog.getNameYears(name))
+  return load(years=sorted(years, reverse=True))
+
+def signature():
+  '''Get the change signature of the catalog.
+
+  For the XML catalog it is catalog.currentSignature().  The SQLite
+  catalog is signed with its version, which every change increments, so
+  changes made by other processes are seen as well.
+  '''
+  if isSQLite():
+    return (getDBFilepath(), load().version)
+  return catalog.currentSignature()
+
+def getFilepaths():
+  '''Get the files of the catalog (XML files with their journals).'''
+  if isSQLite():
+    return [getDBFilepath()]
+  ret = []
+  for filepath in catalog.getFilepaths():
+    ret += [filepath, catalog.journalPath(filepath)]
+  return ret
+
+def derived(tree, key, builder):
+  '''Get data derived from a loaded catalog (see catalog.derived()).'''
+  if not isIndexed(tree):
+    return catalog.derived(tree, key, builder)
+  if key not in tree.derived:
+    tree.derived[key] = builder(tree)
+  return tree.derived[key]
+
+def deleteRows(conn, names):
+  for name in names:
+    conn.execute('DELETE FROM items WHERE name = ?', (name,))
+    conn.execute('DELETE FROM terms WHERE name = ?', (name,))
+
+def insertRow(conn, element):
+  '''Insert an element, replacing the row with the same name.'''
+  fields = dict(zip(COLUMNS, util.ETWrap(element, mapped=True).fields(*COLUMNS)))
+  name = fields['name'] or ''
+  date = fields['date'] or ''
+  deleteRows(conn, [name])
+  conn.execute('INSERT INTO items VALUES (%s)' % (', '.join(['?'] * 16)),
+    (name, element.tag, fields['type'], fields['status'], date,
+     fields['url'], fields['title'], fields['filepath'], fields['parent'],
+     fields['trash'], fields['tags'], fields['categories'],
+     (fields['status'] or '').lower(), name.upper(), date[0:len('YYYY-MM-DD')],
+     catalog.toXML(element)))
+  if element.tag == 'post':
+    for field in ['categories', 'tags']:
+      for term in records.splitTerms(fields[field]):
+        conn.execute('INSERT INTO terms VALUES (?, ?, ?, ?)',
+          (name, field, term, date))
+
+def writeRows(elements=[], names=[], clear=False):
+  '''Change the SQLite catalog in a single transaction.
+
+  Args:
+    elements: Elements to add (replacing those with the same name).
+    names: Names of the elements to remove first.
+    clear: Remove every element first.
+  '''
+  conn = connect()
+  try:
+    if clear:
+      conn.execute('DELETE FROM items')
+      conn.execute('DELETE FROM terms')
+    deleteRows(conn, [n for n in names if n])
+    for element in elements:
+      insertRow(conn, element)
+    conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+    conn.commit()
+  except:
+    conn.rollback()
+    raise
+
+def put(element, replace=None):
+  '''Add an element to the catalog, replacing an existing one.
+
+  Args:
+    element: The element to add.  An existing element with the same name
+      is replaced.
+    replace: Name of another element to remove (e.g. the old name of a
+      renamed item).
+  '''
+  if isSQLite():
+    writeRows([element], [replace])
+  else:
+    catalog.put(element, replace)
+
+def remove(names):
+  '''Remove the elements with the given names from the catalog.'''
+  if isSQLite():
+    writeRows(names=names)
+  else:
+    catalog.remove(names)
+
+def exportXML(filepath):
+  '''Write the whole catalog to a single catalog file.
+
+  Returns:
+    The number of elements written.
+  '''
+  root = load().getroot()
+  catalog.writeTree(ET.ElementTree(root), filepath)
+  return len(root)
+
+def importXML(filepath):
+  '''Replace the whole catalog with the elements of a catalog file.
+
+  Returns:
+    The number of elements read.
+  '''
+  elements = [e for e in ET.parse(filepath).getroot() if e.tag in TAGS]
+  if isSQLite():
+    writeRows(elements, clear=True)
+  else:
+    names = [e.findtext('name') for e in load().getroot()]
+    changes = [{'op': 'remove', 'names': names}]
+    changes.extend({'op': 'put', 'replace': None, 'xml': catalog.toXML(e)}
+      for e in elements)
+    catalog.write(changes)
+  return len(elements)
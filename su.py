@@ -24,9 +24,15 @@ Information:
 
 import os
 import sys
-import elementtree.ElementTree as ET
 
 import util
+import catalog
+import storage
+import pagecache
+import fulltext
+import uploads
+import images
+import wp
 
 def main():
   argc = len(sys.argv)
@@ -42,6 +48,41 @@ def main():
           return
       trash(path)
       return
+    if arg_1 == 'compact' and argc == 2:
+      compact()
+      return
+    if arg_1 == 'export-xml' and argc == 3:
+      exportXML(os.path.normpath(sys.argv[2]))
+      return
+    if arg_1 == 'import-xml' and argc == 3:
+      path = os.path.normpath(sys.argv[2])
+      if not os.path.isfile(path):
+        print "Error: Path is not a valid file.\n"
+        return
+      importXML(path)
+      return
+    if arg_1 == 'shard' and argc == 2:
+      shard()
+      return
+    if arg_1 == 'uploads' and argc == 3 and sys.argv[2].lower() == 'dedupe':
+      uploadsDedupe()
+      return
+    if arg_1 == 'uploads' and argc == 3 and sys.argv[2].lower() == 'derive':
+      uploadsDerive()
+      return
+    if arg_1 == 'reindex' and argc == 2:
+      reindex()
+      return
+    if arg_1 == 'build' and argc == 3:
+      outdir = os.path.normpath(sys.argv[2])
+      if os.path.exists(outdir) and not os.path.isdir(outdir):
+        print "Error: Path is not a valid directory.\n"
+        return
+      build(outdir)
+      return
+    if arg_1 == 'wp' and argc == 3 and sys.argv[2].lower() == 'build':
+      wpBuild()
+      return
   print usage()
 
 def usage():
@@ -50,20 +91,35 @@ def usage():
     "help:  This help text\n" \
     "trash: Remove trash elements from listing\n" \
     "  delete:  Trash files are deleted\n" \
-    "  DIRPATH: Trash files are moved to the supplied path"
+    "  DIRPATH: Trash files are moved to the supplied path\n" \
+    "compact: Fold the catalog journal into the catalog file\n" \
+    "shard: Split the catalog into a catalog file per year\n" \
+    "export-xml: Write the whole catalog to a single XML catalog file\n" \
+    "  FILEPATH: The file to write (e.g. for a backup)\n" \
+    "import-xml: Replace the whole catalog with an XML catalog file\n" \
+    "  FILEPATH: The file to read (e.g. the catalog.xml of a site)\n" \
+    "reindex: Rebuild the full-text search index\n" \
+    "uploads: Manage the uploaded files\n" \
+    "  dedupe:  Store identical uploads only once (run in the directory\n" \
+    "           with public/media)\n" \
+    "  derive:  Make the smaller copies of all uploaded images\n" \
+    "build: Render the public site into static files\n" \
+    "  DIRPATH: Output directory (only changed files are rendered)\n" \
+    "wp:    Manage the WordPress export file\n" \
+    "  build:   Rebuild the pre-parsed sidecar of the export"
     
 def trash(path):
-  catalog_path = util.checkBaseline()
-  tree = ET.parse(catalog_path)
-  root = tree.getroot()
-  items = tree.findall('/trash')
+  tree = storage.load()
+  items = tree.findall('./trash')
   files_to_trash = []
+  names = []
   for i in items:
     witem = util.ETWrap(i)
     files_to_trash.append(witem.filepath)
-    root.remove(i)
+    names.append(witem.name)
   if files_to_trash:
-    tree.write(catalog_path, 'UTF-8')
+    storage.remove(names)
+    pagecache.invalidate()
     for f in files_to_trash:
       if path:
         new_path = os.path.join(path, os.path.basename(f))
@@ -74,6 +130,67 @@ def trash(path):
   else:
     print "Success: Trash was already empty."
   return True
+
+def compact():
+  count = catalog.compact()
+  print "Success: %d journal records folded into the catalog." % (count)
+  return True
+
+def exportXML(path):
+  count = storage.exportXML(path)
+  print "Success: %d catalog elements written to %s." % (count, path)
+  return True
+
+def importXML(path):
+  count = storage.importXML(path)
+  pagecache.invalidate()
+  print "Success: %d catalog elements imported." % (count)
+  print "Run \"su.py reindex\" if the items changed."
+  return True
+
+def shard():
+  if not catalog.isSharded():
+    print "Error: Set Config.CATALOG_LAYOUT to 'sharded' first."
+    return False
+  count = catalog.shard()
+  print "Success: %d posts moved into the year shards." % (count)
+  return True
+
+def reindex():
+  count = fulltext.reindex()
+  print "Success: %d pages and posts indexed." % (count)
+  return True
+
+def uploadsDedupe():
+  counts = uploads.dedupe()
+  print "Success: %(files)d files, %(duplicates)d duplicates, " \
+    "%(saved)d bytes saved, %(removed)d unused files removed." % counts
+  return True
+
+def uploadsDerive():
+  if not images.Image:
+    print "Error: The Python Imaging Library (PIL) is not installed."
+    return False
+  counts = images.deriveAll()
+  print "Success: %(images)d images, %(derived)d copies written." % counts
+  return True
+
+def build(outdir):
+  # Rendering needs the Django settings of the site (DJANGO_SETTINGS_MODULE).
+  import sitebuild
+  counts = sitebuild.build(outdir)
+  print "Success: %(rendered)d rendered, %(skipped)d unchanged, " \
+    "%(removed)d removed." % counts
+  return True
+
+def wpBuild():
+  filepath = wp.getXMLFilepath()
+  if not filepath:
+    print "Error: No WordPress export file is configured (Config.WP_XML_FILE)."
+    return False
+  sidecar_path = wp.buildSidecar(filepath)
+  print "Success: Sidecar written to %s" % (sidecar_path)
+  return True
     
 if __name__ == "__main__":
   main()
@@ -0,0 +1,133 @@
+#!/usr/bin/python
+'''
+Copyright (C) 2012 Mark West.
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+'''
+
+'''
+Information:
+  Shared fixtures of the tests.
+
+  TempDirTestCase runs every test in a new temporary directory with the
+  posts directory and the page cache inside it, and restores every setting
+  of Config and the loaded catalog and WordPress export afterwards.
+'''
+
+import os
+import types
+import shutil
+import tempfile
+import datetime
+import unittest
+
+from filestack import wp
+from filestack import util
+from filestack import views
+from filestack import catalog
+from filestack.xmlbackend import ET
+from filestack.config import Config
+
+def makeElement(name, date, type='post', status='visible', categories='', tags='',
+    parent=''):
+  '''Create a catalog element the way the SU editor saves one.'''
+  d = datetime.datetime.strptime(date, '%Y-%m-%d %H:%M:%S')
+  return views.updateElem(ET.Element(type), {
+    'name': name,
+    'date': date,
+    'type': type,
+    'status': status,
+    'title': name.title(),
+    'url': util.getURL(d, name, type),
+    'filepath': util.getContentFilepath(d, name),
+    'parent': parent,
+    'trash': '',
+    'categories': categories,
+    'tags': tags
+    })
+
+def writeExport(filepath, posts, pages=()):
+  '''Write a WordPress export with published posts and pages.
+
+  Args:
+    filepath: Path of the export file.
+    posts: List of (name, date) tuples.
+    pages: List of (name, date) tuples.
+  '''
+  out = ['<?xml version="1.0" encoding="UTF-8"?>',
+    '<rss version="2.0" xmlns:content="http://purl.org/rss/1.0/modules/content/" '
+    'xmlns:wp="http://wordpress.org/export/1.0/"><channel><title>Blog</title>']
+  for type, items in (('post', posts), ('page', pages)):
+    for i, (name, date) in enumerate(items):
+      out.append('<item><title>%s</title><link>http://wp/%s</link>'
+        '<category domain="category">wp</category>'
+        '<content:encoded><![CDATA[Text of %s]]></content:encoded>'
+        '<wp:post_id>%d</wp:post_id><wp:post_date>%s</wp:post_date>'
+        '<wp:post_name>%s</wp:post_name><wp:status>publish</wp:status>'
+        '<wp:post_parent>0</wp:post_parent><wp:post_type>%s</wp:post_type>'
+        '</item>' % (name.title(), name, name, i + 1, date, name, type))
+  out.append('</channel></rss>')
+  f = open(filepath, 'w')
+  try:
+    f.write('\n'.join(out))
+  finally:
+    f.close()
+
+def fixedClock(date):
+  '''Get a stand-in for the datetime module whose utcnow() is date.
+
+  Assign it to the datetime global of a module (e.g. views.datetime) to
+  set the time that module sees.
+  '''
+  class FixedDatetime(datetime.datetime):
+    @classmethod
+    def utcnow(cls):
+      return datetime.datetime.strptime(date, '%Y-%m-%d %H:%M:%S')
+  clock = types.ModuleType('datetime')
+  clock.__dict__.update(datetime.__dict__)
+  clock.datetime = FixedDatetime
+  return clock
+
+def names(tree):
+  '''Get the sorted names of the elements of a loaded catalog.'''
+  return sorted(e.findtext('name') for e in tree.getroot())
+
+def utcDate(days=0, seconds=0):
+  '''Get the date string (UTC) of a time from now.'''
+  date = datetime.datetime.utcnow() + datetime.timedelta(days, seconds)
+  return date.isoformat(' ')[0:19]
+
+class TempDirTestCase(unittest.TestCase):
+  '''Runs every test in a new temporary directory (the working directory).'''
+  def setUp(self):
+    self.settings = dict((k, v) for k, v in Config.__dict__.items() if k.isupper())
+    self.cwd = os.getcwd()
+    self.dir = tempfile.mkdtemp()
+    os.chdir(self.dir)
+    Config.POST_DIR = os.path.join(self.dir, 'posts')
+    Config.CATALOG_STORAGE = 'xml'
+    Config.CATALOG_LAYOUT = 'single'
+    Config.CATALOG_JOURNAL = False
+    Config.WP_XML_FILE = ''
+    Config.PAGE_CACHE = ''
+    Config.PAGE_CACHE_DIR = os.path.join(self.dir, 'cache')
+    catalog.invalidate()
+    wp._cache.update(index=None, building=False, failed=None)
+
+  def tearDown(self):
+    for key, value in self.settings.iteritems():
+      setattr(Config, key, value)
+    catalog.invalidate()
+    wp._cache.update(index=None, building=False, failed=None)
+    os.chdir(self.cwd)
+    shutil.rmtree(self.dir)
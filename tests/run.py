@@ -0,0 +1,55 @@
+#!/usr/bin/python
+'''
+Copyright (C) 2012 Mark West.
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+'''
+
+'''
+Information:
+  Runs the regression tests.
+
+  Run it in the Django site directory with the site's settings, e.g.:
+    > DJANGO_SETTINGS_MODULE=mysite.settings python -m filestack.tests.run
+  Name test modules to run only those:
+    > ... python -m filestack.tests.run test_storage test_shards
+'''
+
+import os
+import sys
+import unittest
+import optparse
+
+def getModules():
+  '''Get the names of the test modules of this package.'''
+  return sorted(f[:-len('.py')] for f in os.listdir(os.path.dirname(__file__))
+    if f.startswith('test_') and f.endswith('.py'))
+
+def suite(modules):
+  '''Get the test suite of the named test modules.'''
+  loader = unittest.TestLoader()
+  return unittest.TestSuite(loader.loadTestsFromName('filestack.tests.' + m)
+    for m in modules)
+
+def main():
+  parser = optparse.OptionParser(usage='%prog [options] [test modules]')
+  parser.add_option('-v', '--verbose', action='store_true',
+    help='list every test')
+  options, args = parser.parse_args()
+  runner = unittest.TextTestRunner(verbosity=options.verbose and 2 or 1)
+  result = runner.run(suite(args or getModules()))
+  if not result.wasSuccessful():
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,152 @@
+#!/usr/bin/python
+'''
+Copyright (C) 2012 Mark West.
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+'''
+
+'''
+Information:
+  Tests of minifying and compressing public pages and of the ETag of the
+  sent variant (see compress).
+'''
+
+import zlib
+import unittest
+
+from django.http import HttpResponse
+
+from filestack import storage
+from filestack import contentcache
+from filestack import compress
+from filestack import pagecache
+from filestack import sitebuild
+from filestack.config import Config
+from filestack.tests.base import TempDirTestCase, makeElement
+
+RAW = '''<pre>
+  keep   this
+</pre><textarea>  and
+  this </textarea><script>
+  var s = "a  b";
+</script><!-- fs:raw --><p>  raw   text </p><!-- fs:endraw -->'''
+
+def page(size):
+  '''Get an HTML body of at least size bytes.'''
+  return '<html>\n  <body>\n' + '<p>text</p>\n' * (size / 12 + 1) + '</body></html>'
+
+def gunzip(data):
+  return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+class MinifyTest(unittest.TestCase):
+  def testWhitespaceAndCommentsAreCollapsed(self):
+    html = '<div>\n  <!-- note -->\n  <p>a    b</p>\n</div>'
+    self.assertEqual(compress.minify(html), '<div> <p>a b</p> </div>')
+
+  def testPreformattedContentIsKept(self):
+    html = '<div>\n  <p>a    b</p>\n' + RAW + '\n</div>'
+    self.assertEqual(compress.minify(html), '<div> <p>a b</p> ' +
+      RAW.replace('<!-- fs:raw -->', '').replace('<!-- fs:endraw -->', '') +
+      ' </div>')
+
+  def testConditionalCommentsAreKept(self):
+    html = '<!--[if IE]><link href="ie.css"><![endif]-->'
+    self.assertEqual(compress.minify(html), html)
+
+class VariantsTest(TempDirTestCase):
+  def setUp(self):
+    TempDirTestCase.setUp(self)
+    Config.MINIFY_HTML = True
+    Config.COMPRESS_RESPONSES = True
+    self.cache = compress._cache
+    compress._cache = contentcache.LRUCache(Config.COMPRESS_CACHE_BYTES)
+
+  def tearDown(self):
+    self.cache = compress._cache
+    compress._cache = contentcache.LRUCache(Config.COMPRESS_CACHE_BYTES)
+    TempDirTestCase.tearDown(self)
+
+  def respond(self, body, accept='gzip, deflate'):
+    request = sitebuild.getRequest('/')
+    request.META['HTTP_ACCEPT_ENCODING'] = accept
+    return compress.process(request, HttpResponse(body))
+
+  def testVariantsAreBuiltOnce(self):
+    body = page(compress.MIN_SIZE * 2)
+    misses, hits = compress.stats['misses'], compress.stats['hits']
+    entry = compress.getVariants(body)
+    self.assertTrue(compress.getVariants(body) is entry)
+    self.assertEqual(compress.stats['misses'], misses + 1)
+    self.assertEqual(compress.stats['hits'], hits + 1)
+    self.assertEqual(gunzip(entry['gzip']), compress.minify(body))
+
+  def testVariantIsPickedByAcceptEncoding(self):
+    body = page(compress.MIN_SIZE * 2)
+    response = self.respond(body)
+    self.assertEqual(response['Content-Encoding'], 'gzip')
+    self.assertEqual(response['Vary'], 'Accept-Encoding')
+    self.assertEqual(gunzip(response.content), compress.minify(body))
+    self.assertEqual(response['Content-Length'], str(len(response.content)))
+    response = self.respond(body, 'gzip;q=0')
+    self.assertFalse(response.has_header('Content-Encoding'))
+    self.assertEqual(response.content, compress.minify(body))
+
+  def testSmallBodiesAreNotCompressed(self):
+    body = page(compress.MIN_SIZE / 4)
+    response = self.respond(body)
+    self.assertFalse(response.has_header('Content-Encoding'))
+    self.assertEqual(response.content, compress.minify(body))
+
+class ETagTest(TempDirTestCase):
+  def setUp(self):
+    TempDirTestCase.setUp(self)
+    Config.COMPRESS_RESPONSES = True
+    self.cache = compress._cache
+    compress._cache = contentcache.LRUCache(Config.COMPRESS_CACHE_BYTES)
+    storage.put(makeElement('first', '2010-03-01 10:00:00'))
+    self.body = page(compress.MIN_SIZE * 2)
+    @pagecache.conditional(lambda: '2010-03-01 10:00:00')
+    @compress.compressed
+    def view(request):
+      return HttpResponse(self.body)
+    self.view = view
+
+  def tearDown(self):
+    self.cache = compress._cache
+    compress._cache = contentcache.LRUCache(Config.COMPRESS_CACHE_BYTES)
+    TempDirTestCase.tearDown(self)
+
+  def respond(self, accept='gzip', if_none_match=None):
+    request = sitebuild.getRequest('/')
+    request.META['HTTP_ACCEPT_ENCODING'] = accept
+    if if_none_match:
+      request.META['HTTP_IF_NONE_MATCH'] = if_none_match
+    return self.view(request)
+
+  def testETagNamesTheSentEncoding(self):
+    identity = self.respond('identity')['ETag']
+    self.assertEqual(self.respond('gzip')['ETag'], identity[:-1] + '-gzip"')
+    # A small body is sent as is, whatever the request accepts
+    self.body = page(compress.MIN_SIZE / 4)
+    response = self.respond('gzip')
+    self.assertFalse(response.has_header('Content-Encoding'))
+    self.assertEqual(response['ETag'], identity)
+
+  def testEncodedETagIsNotModified(self):
+    etag = self.respond('gzip')['ETag']
+    self.assertEqual(self.respond('gzip', etag).status_code, 304)
+    self.assertEqual(self.respond('identity', etag).status_code, 304)
+    self.assertEqual(self.respond('gzip', '"other-gzip"').status_code, 200)
+
+if __name__ == '__main__':
+  unittest.main()
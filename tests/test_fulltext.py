@@ -0,0 +1,123 @@
+#!/usr/bin/python
+'''
+Copyright (C) 2012 Mark West.
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+'''
+
+'''
+Information:
+  Tests of the full-text search index (see fulltext).
+'''
+
+import unittest
+
+from filestack import views
+from filestack import storage
+from filestack import fulltext
+from filestack.tests.base import TempDirTestCase, makeElement, utcDate
+
+def putItem(name, date, content, status='visible'):
+  '''Put a post and its content file into the catalog.
+
+  Returns:
+    The item of the post.
+  '''
+  storage.put(makeElement(name, date, status=status))
+  views.writeContentFile(views.toContentElement(
+    makeElement(name, date, status=status), content))
+  return views.elementToItem(makeElement(name, date, status=status))
+
+def found(query):
+  '''Get the names of the documents found for a query, best match first.'''
+  return [r['name'] for r in fulltext.search(query)[1]]
+
+def dumpIndex():
+  '''Get every record of the index.'''
+  shelf = fulltext.openIndex('r')
+  try:
+    return dict(shelf)
+  finally:
+    shelf.close()
+
+class TextTest(unittest.TestCase):
+  def testTokenize(self):
+    self.assertEqual(fulltext.tokenize(u'A Caf\xe9, x2 and E-Mail!'),
+      [u'caf\xe9', u'x2', u'and', u'mail'])
+
+  def testStripHTML(self):
+    html = ('<p class="x">Caf&eacute; &amp; &#x41;&#66;c &bogus;</p>'
+      '<script type="text/javascript">var hidden;</script>'
+      '<!-- <b>comment</b> --><STYLE>p {}</STYLE>')
+    self.assertEqual(fulltext.tokenize(fulltext.stripHTML(html)),
+      [u'caf\xe9', u'abc', u'bogus'])
+
+class IndexTest(TempDirTestCase):
+  def setUp(self):
+    TempDirTestCase.setUp(self)
+    self.items = [
+      putItem('apples', '2011-01-01 10:00:00', '<p>apple apple apple pie</p>'),
+      putItem('fruit', '2011-02-01 10:00:00',
+        '<p>An apple is one of many kinds of fruit: pears, plums, '
+        'cherries, grapes and more.</p>'),
+      putItem('bread', '2011-03-01 10:00:00', '<p>Bread and butter</p>'),
+      putItem('hidden', '2011-04-01 10:00:00', 'apple', status='hidden'),
+      putItem('scheduled', utcDate(days=1), 'apple')]
+
+  def testReindexRanksWithBM25(self):
+    self.assertEqual(fulltext.reindex(processes=1), 4)
+    self.assertEqual(found('apple'), ['apples', 'fruit'])
+    self.assertEqual(found('butter apple'), ['bread', 'apples', 'fruit'])
+    # Titles count as well
+    self.assertEqual(found('fruit'), ['fruit'])
+    self.assertEqual(found('missing'), [])
+    total, results = fulltext.search('apple', start=1)
+    self.assertEqual((total, [r['name'] for r in results]), (2, ['fruit']))
+
+  def testReindexMatchesIncrementalUpdates(self):
+    for item in self.items:
+      fulltext.update(item, views.loadContent(item))
+    incremental = dumpIndex()
+    fulltext.reindex(processes=1)
+    self.assertEqual(dumpIndex(), incremental)
+
+  def testReindexWritesEveryRecordOnce(self):
+    writes = []
+    class Shelf(dict):
+      def __setitem__(self, key, value):
+        writes.append(key)
+        dict.__setitem__(self, key, value)
+    docs = [fulltext.analyze(i, views.loadContent(i)) for i in self.items]
+    fulltext.writeIndex(Shelf(), docs)
+    self.assertTrue(fulltext.termKey(u'apple') in writes)
+    self.assertEqual(len(writes), len(set(writes)))
+
+  def testUpdateRenameAndRemove(self):
+    fulltext.reindex(processes=1)
+    meta = dumpIndex()['meta']
+    renamed = putItem('pie', '2011-01-01 10:00:00', '<p>apple pie</p>')
+    fulltext.update(renamed, views.loadContent(renamed), old_name='apples')
+    self.assertEqual(found('apple'), ['pie', 'fruit'])
+    self.assertEqual(dumpIndex()['meta']['docs'], meta['docs'])
+    # A post that is hidden again leaves the index
+    hidden = putItem('fruit', '2011-02-01 10:00:00', 'apple', status='hidden')
+    fulltext.update(hidden, views.loadContent(hidden))
+    self.assertEqual(found('apple'), ['pie'])
+    # Sent to the trash; terms without documents are dropped
+    fulltext.remove(['bread'])
+    self.assertEqual(found('bread'), [])
+    self.assertFalse(fulltext.termKey(u'butter') in dumpIndex())
+    self.assertEqual(dumpIndex()['meta']['docs'], meta['docs'] - 2)
+
+if __name__ == '__main__':
+  unittest.main()
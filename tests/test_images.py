@@ -0,0 +1,98 @@
+#!/usr/bin/python
+'''
+Copyright (C) 2012 Mark West.
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+'''
+
+'''
+Information:
+  Tests of the srcset attributes of uploaded images (see images).
+
+  PIL is replaced by a stand-in that only reports the width of an image,
+  so the tests run without it; deriving itself is not tested.
+'''
+
+import os
+import unittest
+
+from filestack import images
+from filestack import contentcache
+from filestack.config import Config
+from filestack.tests.base import TempDirTestCase
+
+class Original:
+  size = (800, 600)
+
+class ImageModule:
+  '''Stands in for PIL's Image module and counts the opened files.'''
+  def __init__(self):
+    self.opened = []
+
+  def open(self, filepath):
+    self.opened.append(filepath)
+    return Original()
+
+def touch(filepath):
+  if not os.path.exists(os.path.dirname(filepath)):
+    os.makedirs(os.path.dirname(filepath))
+  open(filepath, 'wb').close()
+
+class SrcsetTest(TempDirTestCase):
+  def setUp(self):
+    TempDirTestCase.setUp(self)
+    Config.IMAGE_WIDTHS = [320]
+    self.image = images.Image
+    self.widths = images._widths
+    images.Image = ImageModule()
+    images._widths = contentcache.LRUCache(images.WIDTHS_CACHE_BYTES)
+    original = os.path.join(images.PUBLIC_DIR, 'media', 'a.jpg')
+    touch(original)
+    touch(images.derivedPath(original, 320))
+
+  def tearDown(self):
+    images.Image = self.image
+    images._widths = self.widths
+    TempDirTestCase.tearDown(self)
+
+  def testLocalImagesGetSrcset(self):
+    html = images.addSrcset('<p><img src="/media/a.jpg" /></p>')
+    self.assertEqual(html, '<p><img src="/media/a.jpg" srcset="'
+      '/media/sizes/320/a.jpg 320w, /media/a.jpg 800w" sizes="%s"/></p>'
+      % (Config.IMAGE_SIZES))
+    for tag in ['<img src="/media/b.jpg">', '<img src="/media/../a.jpg">',
+        '<img srcset="x 1w" src="/media/a.jpg">']:
+      self.assertEqual(images.addSrcset(tag), tag)
+
+  def testOtherHostsAreSkipped(self):
+    for url in ['http://other.example/media/a.jpg',
+        '//other.example/media/a.jpg', 'ftp://site.example/media/a.jpg']:
+      tag = '<img src="%s">' % (url)
+      self.assertEqual(images.addSrcset(tag, 'site.example'), tag)
+    self.assertEqual(images.srcset('http://site.example/media/a.jpg'), None)
+    self.assertEqual(images.srcset('http://Site.example/media/a.jpg',
+      'site.example'), 'http://Site.example/media/sizes/320/a.jpg 320w, '
+      'http://Site.example/media/a.jpg 800w')
+
+  def testWidthsAreCachedAndBounded(self):
+    for n in range(2):
+      images.addSrcset('<img src="/media/a.jpg">')
+    self.assertEqual(len(images.Image.opened), 1)
+    images._widths = contentcache.LRUCache(1024)
+    for n in range(100):
+      self.assertEqual(images.getWidth('image%d.jpg' % (n), 0), 800)
+    self.assertTrue(0 < len(images._widths) < 100)
+    self.assertTrue(images._widths.bytes <= 1024)
+
+if __name__ == '__main__':
+  unittest.main()
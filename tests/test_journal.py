@@ -0,0 +1,92 @@
+#!/usr/bin/python
+'''
+Copyright (C) 2012 Mark West.
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+'''
+
+'''
+Information:
+  Tests of the catalog journal: replay and compaction (see catalog).
+'''
+
+import os
+import time
+import unittest
+
+from filestack import util
+from filestack import catalog
+from filestack import storage
+from filestack.xmlbackend import ET
+from filestack.config import Config
+from filestack.tests.base import TempDirTestCase, makeElement, names
+
+class JournalTest(TempDirTestCase):
+  def setUp(self):
+    TempDirTestCase.setUp(self)
+    storage.put(makeElement('first', '2010-03-01 10:00:00'))
+    Config.CATALOG_JOURNAL = True
+    self.filepath = util.checkBaseline()
+    self.journal = catalog.journalPath(self.filepath)
+
+  def putChanges(self):
+    storage.put(makeElement('second', '2011-01-01 10:00:00'))
+    storage.put(makeElement('third', '2011-02-01 10:00:00'))
+    storage.put(makeElement('renamed', '2011-01-01 10:00:00'), 'second')
+    storage.remove(['first'])
+
+  def fileNames(self):
+    '''Get the names in the catalog file itself, without its journal.'''
+    return names(ET.parse(self.filepath))
+
+  def testChangesAreAppendedToTheJournal(self):
+    self.putChanges()
+    self.assertEqual(self.fileNames(), ['first'])
+    self.assertEqual(len(catalog.readJournal(self.journal)), 4)
+    self.assertEqual(names(storage.load()), ['renamed', 'third'])
+
+  def testReplayAfterCrashBeforeCompaction(self):
+    self.putChanges()
+    # A record cut short by the crash
+    f = open(self.journal, 'ab')
+    f.write('{"op": "remove", "names": ["thi')
+    f.close()
+    catalog.invalidate()
+    self.assertEqual(names(storage.load()), ['renamed', 'third'])
+    self.assertEqual(catalog.compact(), 4)
+    self.assertFalse(os.path.exists(self.journal))
+    self.assertEqual(self.fileNames(), ['renamed', 'third'])
+    self.assertEqual(names(storage.load()), ['renamed', 'third'])
+
+  def testReplayAfterCrashDuringCompaction(self):
+    self.putChanges()
+    # The catalog was rewritten but the journal not removed yet
+    catalog.writeTree(catalog.readTree(self.filepath), self.filepath)
+    catalog.invalidate()
+    self.assertEqual(self.fileNames(), ['renamed', 'third'])
+    self.assertEqual(names(storage.load()), ['renamed', 'third'])
+    catalog.compact()
+    self.assertEqual(self.fileNames(), ['renamed', 'third'])
+
+  def testLongJournalIsCompactedInTheBackground(self):
+    Config.CATALOG_JOURNAL_MAX_BYTES = 1
+    storage.put(makeElement('second', '2011-01-01 10:00:00'))
+    for i in range(500):
+      if not os.path.exists(self.journal):
+        break
+      time.sleep(0.01)
+    self.assertFalse(os.path.exists(self.journal))
+    self.assertEqual(self.fileNames(), ['first', 'second'])
+
+if __name__ == '__main__':
+  unittest.main()
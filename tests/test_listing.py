@@ -0,0 +1,110 @@
+#!/usr/bin/python
+'''
+Copyright (C) 2012 Mark West.
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+'''
+
+'''
+Information:
+  Tests of the newest first post lists and their windows (see listing).
+'''
+
+import os
+import unittest
+
+from filestack import wp
+from filestack import views
+from filestack import listing
+from filestack import storage
+from filestack.config import Config
+from filestack.tests.base import TempDirTestCase, makeElement, writeExport
+
+def posts(*dates):
+  '''Get newest first items named after their dates.'''
+  return [{'name': d, 'date': d} for d in sorted(dates, reverse=True)]
+
+def dates(items):
+  return [i['date'] for i in items]
+
+class PostListTest(unittest.TestCase):
+  def testScheduledPostsAreSkipped(self):
+    l = listing.PostList(posts('2012', '2011', '2010', '2009'), now='2010.5')
+    self.assertEqual(len(l), 2)
+    self.assertEqual((l.newest(), l.oldest()), ('2010', '2009'))
+    self.assertEqual(dates(l.iterFrom()), ['2010', '2009'])
+    self.assertEqual(dates(l.iterFrom(1)), ['2009'])
+    self.assertEqual(dates(l.iterFrom(2)), [])
+
+  def testCountSince(self):
+    l = listing.PostList(posts('2012', '2011', '2011', '2009'), now='2011.5')
+    self.assertEqual([l.countSince(d) for d in ['2013', '2011', '2010', '']],
+      [0, 2, 2, 3])
+
+class WindowTest(unittest.TestCase):
+  def setUp(self):
+    self.native = listing.PostList(posts('2012-05', '2012-03', '2011-07',
+      '2011-01'), now='2013')
+    self.wp = listing.PostList(posts('2012-04', '2011-08', '2010-02'),
+      now='2013')
+
+  def testMergeIsNewestFirst(self):
+    merged = listing.mergeItems([self.native.iterFrom(), [], self.wp.iterFrom()])
+    self.assertEqual(dates(merged), ['2012-05', '2012-04', '2012-03', '2011-08',
+      '2011-07', '2011-01', '2010-02'])
+
+  def testWindowBounds(self):
+    lists = [self.native, self.wp]
+    merged = dates(listing.mergeItems([l.iterFrom() for l in lists]))
+    for start in range(0, 9):
+      for stop in range(start, 10):
+        self.assertEqual(dates(listing.getWindow(lists, start, stop)),
+          merged[start:stop], (start, stop))
+    self.assertEqual(listing.getWindow([listing.PostList([])], 0, 5), [])
+
+  def testDisjointListsAreTakenByOffset(self):
+    old = listing.PostList(posts('2009-12', '2009-06', '2008-01'), now='2013')
+    lists = [old, self.native]
+    self.assertEqual(dates(listing.getWindow(lists, 3, 6)),
+      ['2011-01', '2009-12', '2009-06'])
+    self.assertEqual(dates(listing.getWindow(lists, 6, 10)), ['2008-01'])
+
+  def testWindowItemsAreCopies(self):
+    window = listing.getWindow([self.native, self.wp], 0, 1)
+    window[0]['name'] = 'changed'
+    self.assertEqual(self.native.iterFrom().next()['name'], '2012-05')
+
+  def testGetItemCountsListByList(self):
+    lists = [self.native, self.wp]
+    self.assertEqual([listing.getItem(lists, i)['date'] for i in range(7)],
+      dates(self.native.iterFrom()) + dates(self.wp.iterFrom()))
+    self.assertRaises(IndexError, listing.getItem, lists, 7)
+
+class SiteStateTest(TempDirTestCase):
+  def testNativeAndWordPressPostsAreMerged(self):
+    storage.put(makeElement('native-new', '2011-03-01 10:00:00'))
+    storage.put(makeElement('native-old', '2010-06-01 10:00:00'))
+    storage.put(makeElement('hidden', '2011-01-01 10:00:00', status='hidden'))
+    Config.WP_XML_FILE = 'export.xml'
+    writeExport(os.path.join(Config.POST_DIR, 'export.xml'), [
+      ('wp-new', '2011-02-01 08:00:00'), ('wp-old', '2009-01-01 08:00:00')])
+    state = views.SiteState(storage.load(years=[]), wp.loadXML(wait=True))
+    self.assertEqual(state.count(), 4)
+    self.assertEqual([i['name'] for i in state.window(0, 10)],
+      ['native-new', 'wp-new', 'native-old', 'wp-old'])
+    self.assertEqual([i['name'] for i in state.window(1, 3)],
+      ['wp-new', 'native-old'])
+    self.assertEqual(state.window(4, 8), [])
+
+if __name__ == '__main__':
+  unittest.main()
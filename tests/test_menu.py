@@ -0,0 +1,91 @@
+#!/usr/bin/python
+'''
+Copyright (C) 2012 Mark West.
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+'''
+
+'''
+Information:
+  Tests of the page menu and its cache (see views.getMenu).
+'''
+
+import datetime
+import unittest
+
+from filestack import views
+from filestack import storage
+from filestack.tests.base import TempDirTestCase, makeElement, fixedClock
+
+class MenuTest(TempDirTestCase):
+  def setUp(self):
+    TempDirTestCase.setUp(self)
+    self.builds = []
+    self.buildMenu = views.buildMenu
+    def buildMenu(xml_tree, wp_tree=None):
+      self.builds.append(xml_tree)
+      return self.buildMenu(xml_tree, wp_tree)
+    views.buildMenu = buildMenu
+    for element in [
+        makeElement('about', '2010-01-01 00:00:00', type='page'),
+        makeElement('team', '2010-01-02 00:00:00', type='page', parent='about'),
+        makeElement('draft', '2010-01-03 00:00:00', type='page', status='hidden'),
+        makeElement('news', '2010-01-04 00:00:00')]:
+      storage.put(element)
+
+  def tearDown(self):
+    views.buildMenu = self.buildMenu
+    views.datetime = datetime
+    TempDirTestCase.tearDown(self)
+
+  def testMenuHasTheVisiblePages(self):
+    xml_tree = storage.load()
+    self.assertEqual(views.getMenu(xml_tree),
+      [('About', 'about', [('Team', 'team', [])])])
+    self.assertEqual(views.getMenuSlugs(xml_tree), ['about', 'team'])
+
+  def testMenuIsBuiltOncePerCatalog(self):
+    for n in range(3):
+      views.getMenu(storage.load())
+    self.assertEqual(len(self.builds), 1)
+    slugs = views.getMenuSlugs(storage.load())
+    slugs.append('changed')
+    self.assertEqual(views.getMenuSlugs(storage.load()), ['about', 'team'])
+    storage.put(makeElement('contact', '2010-01-05 00:00:00', type='page'))
+    self.assertEqual(views.getMenuSlugs(storage.load()),
+      ['contact', 'about', 'team'])
+    self.assertEqual(len(self.builds), 2)
+
+  def testScheduledPageAppearsWhenPublished(self):
+    storage.put(makeElement('launch', '2012-06-01 12:00:00', type='page'))
+    views.datetime = fixedClock('2012-06-01 11:59:59')
+    for n in range(2):
+      self.assertEqual(views.getMenuSlugs(storage.load()), ['about', 'team'])
+    self.assertEqual(len(self.builds), 1)
+    views.datetime = fixedClock('2012-06-01 12:00:00')
+    self.assertEqual(views.getMenuSlugs(storage.load()),
+      ['launch', 'about', 'team'])
+    self.assertEqual(len(self.builds), 2)
+
+  def testParentLoopsAndDeepTreesTerminate(self):
+    family_tree = {'0': [('A', 'a', 'a')], 'a': [('B', 'b', 'b')],
+      'b': [('A', 'a', 'a')]}
+    self.assertEqual(views.flattenMenu(views.getChildren(family_tree)),
+      ['a', 'b', 'a'])
+    family_tree = dict((str(i), [('T', 's%d' % (i), str(i + 1))])
+      for i in range(5000))
+    family_tree['0'] = [('T', 's0', '1')]
+    self.assertEqual(len(views.flattenMenu(views.getChildren(family_tree))), 5000)
+
+if __name__ == '__main__':
+  unittest.main()
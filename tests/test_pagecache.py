@@ -0,0 +1,206 @@
+#!/usr/bin/python
+'''
+Copyright (C) 2012 Mark West.
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+'''
+
+'''
+Information:
+  Tests of the page cache: invalidation, expiry and bounds, and the answers
+  to conditional GET requests (see pagecache).
+'''
+
+import os
+import unittest
+
+from django.http import HttpResponse, HttpResponseNotFound
+
+from filestack import util
+from filestack import views
+from filestack import storage
+from filestack import pagecache
+from filestack import sitebuild
+from filestack.config import Config
+from filestack.tests.base import TempDirTestCase, makeElement, utcDate
+
+class PageCacheTest(TempDirTestCase):
+  def setUp(self):
+    TempDirTestCase.setUp(self)
+    Config.PAGE_CACHE = 'memory'
+    pagecache.invalidate()
+    storage.put(makeElement('first', '2010-03-01 10:00:00'))
+
+  def tearDown(self):
+    pagecache.invalidate()
+    TempDirTestCase.tearDown(self)
+
+  def testInvalidate(self):
+    for backend in ['memory', 'disk']:
+      Config.PAGE_CACHE = backend
+      pagecache.put('/', HttpResponse('index'))
+      self.assertEqual(pagecache.get('/').content, 'index', backend)
+      pagecache.invalidate()
+      self.assertEqual(pagecache.get('/'), None, backend)
+
+  def testCatalogChangesDropEntries(self):
+    for backend in ['xml', 'sqlite']:
+      Config.CATALOG_STORAGE = backend
+      if backend == 'sqlite':
+        storage.importXML(util.checkBaseline())
+      pagecache.put('/', HttpResponse('index'))
+      self.assertEqual(pagecache.get('/').content, 'index', backend)
+      storage.put(makeElement('third', '2012-01-01 00:00:00'))
+      self.assertEqual(pagecache.get('/'), None, backend)
+
+  def testExpiry(self):
+    pagecache.put('/old/', HttpResponse('old'), utcDate(-1))
+    pagecache.put('/new/', HttpResponse('new'), utcDate(1))
+    self.assertEqual(pagecache.get('/old/'), None)
+    self.assertEqual(pagecache.get('/new/').content, 'new')
+
+  def testCachedView(self):
+    calls = []
+    @pagecache.cached(lambda: None)
+    def view(request):
+      calls.append(request.path)
+      if request.path == '/missing/':
+        return HttpResponseNotFound('missing')
+      return HttpResponse('page %s' % (request.GET.get('p', '0')))
+    for query in ['', 'utm=1', 'p=0', 'p=x']:
+      self.assertEqual(view(sitebuild.getRequest('/', query)).content, 'page 0')
+    self.assertEqual(len(calls), 1)
+    self.assertEqual(view(sitebuild.getRequest('/', 'p=1')).content, 'page 1')
+    self.assertEqual(len(calls), 2)
+    # Error pages are never cached
+    for n in range(2):
+      self.assertEqual(view(sitebuild.getRequest('/missing/')).status_code, 404)
+    self.assertEqual(len(calls), 4)
+
+  def testDiskIsBounded(self):
+    Config.PAGE_CACHE = 'disk'
+    Config.PAGE_CACHE_BYTES = 16 * 1024
+    for n in range(64):
+      pagecache.put('/page/%d/' % (n), HttpResponse('x' * 1024))
+    cache_dir = pagecache.getCacheDir()
+    filenames = os.listdir(cache_dir)
+    total = sum(os.path.getsize(os.path.join(cache_dir, f)) for f in filenames)
+    self.assertTrue(total <= Config.PAGE_CACHE_BYTES)
+    self.assertTrue(0 < len(filenames) < 64)
+
+class RandomPoolTest(TempDirTestCase):
+  def setUp(self):
+    TempDirTestCase.setUp(self)
+    Config.PAGE_CACHE = 'memory'
+    Config.RANDOM_POSTS = 'pool'
+    Config.RANDOM_POOL_SECONDS = 0
+    Config.RANDOM_POOL_REQUESTS = 2
+    pagecache.invalidate()
+    views._random_pool.update(epoch=None, key=None, posts=None, seed=None)
+    self.calls = []
+    @pagecache.cached(lambda: None, views.pageVersion)
+    def view(request):
+      self.calls.append(request.path)
+      return HttpResponse('page')
+    self.view = view
+
+  def tearDown(self):
+    pagecache.invalidate()
+    views._random_pool.update(epoch=None, key=None, posts=None, seed=None)
+    TempDirTestCase.tearDown(self)
+
+  def testRandomPostsAreDrawnPerRequestByDefault(self):
+    self.assertEqual(self.settings['RANDOM_POSTS'], 'request')
+    Config.RANDOM_POSTS = 'request'
+    self.assertEqual(views.pageVersion(), None)
+
+  def testRedrawOnlyStalesPagesOfThePool(self):
+    pagecache.put('/other/', HttpResponse('other'))
+    invalidations = pagecache.stats['invalidations']
+    for n in range(2):
+      self.view(sitebuild.getRequest('/'))
+      views.pageModified()
+    self.assertEqual(len(self.calls), 1)
+    views.pageModified()  # Over the request limit: the pool is drawn again
+    self.view(sitebuild.getRequest('/'))
+    self.assertEqual(len(self.calls), 2)
+    self.assertEqual(pagecache.get('/other/').content, 'other')
+    self.assertEqual(pagecache.stats['invalidations'], invalidations)
+
+class User:
+  '''A logged-in user.'''
+  def is_authenticated(self):
+    return True
+
+class ConditionalTest(TempDirTestCase):
+  def setUp(self):
+    TempDirTestCase.setUp(self)
+    storage.put(makeElement('first', '2010-03-01 10:00:00'))
+    self.calls = []
+    @pagecache.conditional(lambda: '2010-03-01 10:00:00')
+    def view(request):
+      self.calls.append(request.path)
+      return HttpResponse('page')
+    self.view = view
+
+  def request(self, **headers):
+    request = sitebuild.getRequest('/')
+    request.META.update(headers)
+    return request
+
+  def testMatchingValidatorsAreNotModified(self):
+    response = self.view(self.request())
+    self.assertEqual(response.status_code, 200)
+    etag, last_modified = response['ETag'], response['Last-Modified']
+    for headers in [{'HTTP_IF_NONE_MATCH': etag},
+        {'HTTP_IF_MODIFIED_SINCE': last_modified},
+        {'HTTP_IF_NONE_MATCH': etag, 'HTTP_IF_MODIFIED_SINCE': last_modified}]:
+      self.assertEqual(self.view(self.request(**headers)).status_code, 304)
+    self.assertEqual(len(self.calls), 1)
+    # The validators change with the catalog
+    storage.put(makeElement('second', '2010-04-01 10:00:00'))
+    response = self.view(self.request(HTTP_IF_NONE_MATCH=etag))
+    self.assertEqual(response.status_code, 200)
+    self.assertNotEqual(response['ETag'], etag)
+
+  def testAuthenticatedUsersBypassValidators(self):
+    etag = self.view(self.request())['ETag']
+    request = self.request(HTTP_IF_NONE_MATCH=etag)
+    request.user = User()
+    response = self.view(request)
+    self.assertEqual(response.status_code, 200)
+    self.assertFalse(response.has_header('ETag'))
+    self.assertEqual(len(self.calls), 2)
+
+  def testTemplatesAreStatedOncePerInterval(self):
+    walks = []
+    walk = os.walk
+    def countingWalk(top, *args, **kwargs):
+      walks.append(top)
+      return walk(top, *args, **kwargs)
+    os.walk = countingWalk
+    try:
+      util._template_signatures.clear()
+      Config.TEMPLATE_RECHECK_SECONDS = 60
+      for n in range(3):
+        self.view(self.request())
+      self.assertEqual(len(walks), 1)
+      Config.TEMPLATE_RECHECK_SECONDS = 0
+      for n in range(3):
+        self.view(self.request())
+      self.assertEqual(len(walks), 4)
+    finally:
+      os.walk = walk
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/python
+'''
+Copyright (C) 2012 Mark West.
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+'''
+
+'''
+Information:
+  Tests of the compact item records (see records).
+'''
+
+import cPickle as pickle
+import unittest
+
+from filestack import records
+
+def makeItem(**fields):
+  item = records.Item(type='post', name='hello', date='2011-06-15 08:30:05',
+    title='Hello', status='visible', categories=records.splitTerms('a,b'))
+  item.update(fields)
+  return item
+
+class ItemTest(unittest.TestCase):
+  def testGetAndContains(self):
+    item = makeItem()
+    self.assertEqual(item['title'], 'Hello')
+    self.assertEqual(item.get('title'), 'Hello')
+    self.assertTrue('title' in item)
+    self.assertFalse('parent' in item)
+    self.assertFalse('unknown' in item)
+    self.assertEqual(item.get('parent'), None)
+    self.assertEqual(item.get('parent', ''), '')
+    self.assertEqual(item.get('unknown', 'x'), 'x')
+
+  def testMissingKeysRaiseKeyError(self):
+    item = makeItem()
+    for key in ['parent', 'unknown']:
+      self.assertRaises(KeyError, lambda: item[key])
+    self.assertRaises(KeyError, item.__setitem__, 'unknown', 1)
+    self.assertRaises(KeyError, item.__delitem__, 'parent')
+    del item['title']
+    self.assertFalse('title' in item)
+    self.assertRaises(KeyError, lambda: item['title'])
+
+  def testDateFields(self):
+    item = makeItem()
+    self.assertEqual([item[k] for k in records.DATE_FIELDS],
+      ['2011-06-15', '2011', '06', '15', '08:30:05'])
+    self.assertRaises(KeyError, item.__setitem__, 'year', '2012')
+    self.assertFalse('year' in item.keys())
+
+  def testKeysAndCopies(self):
+    item = makeItem()
+    self.assertEqual(item.keys(),
+      ['type', 'name', 'date', 'title', 'status', 'categories'])
+    self.assertEqual(len(item), 6)
+    self.assertEqual(dict(item.iteritems())['name'], 'hello')
+    copy = item.copy()
+    copy['title'] = 'Changed'
+    self.assertEqual(item['title'], 'Hello')
+    self.assertEqual(copy.items(), [(k, copy[k]) for k in item.keys()])
+
+  def testPickle(self):
+    item = makeItem(content_ref=(10, 20))
+    loaded = pickle.loads(pickle.dumps(item, pickle.HIGHEST_PROTOCOL))
+    self.assertEqual(loaded.items(), item.items())
+
+  def testTermsAreShared(self):
+    self.assertEqual(records.splitTerms(''), ())
+    self.assertEqual(records.splitTerms('a,b'), ('a', 'b'))
+    self.assertTrue(records.splitTerms('a,b') is records.terms(['a', 'b']))
+    self.assertTrue(makeItem()['categories'] is makeItem()['categories'])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,148 @@
+#!/usr/bin/python
+'''
+Copyright (C) 2012 Mark West.
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+'''
+
+'''
+Information:
+  Tests of the per-year sharded catalog: routing of writes, the shard
+  index and listing windows over the shards (see catalog).
+'''
+
+import os
+import unittest
+
+from filestack import views
+from filestack import catalog
+from filestack import listing
+from filestack import storage
+from filestack.config import Config
+from filestack.tests.base import TempDirTestCase, makeElement, names
+
+class ShardTest(TempDirTestCase):
+  def setUp(self):
+    TempDirTestCase.setUp(self)
+    Config.CATALOG_LAYOUT = 'sharded'
+    # Names of the catalog files parsed by the test
+    self.read = []
+    self.readTree = catalog.readTree
+    def readTree(filepath):
+      self.read.append(os.path.basename(filepath))
+      return self.readTree(filepath)
+    catalog.readTree = readTree
+
+  def tearDown(self):
+    catalog.readTree = self.readTree
+    TempDirTestCase.tearDown(self)
+
+  def putSample(self):
+    for element in [
+        makeElement('first', '2010-03-01 10:00:00', categories='news'),
+        makeElement('second', '2011-06-15 08:30:00', categories='news,misc'),
+        makeElement('draft', '2011-07-01 00:00:00', status='hidden'),
+        makeElement('about', '2010-01-01 00:00:00', type='page')]:
+      storage.put(element)
+
+  def shardNames(self, name):
+    '''Get the sorted names of the elements of a shard file.'''
+    return names(self.readTree(catalog.getShardFilepath(name)))
+
+  def testWritesGoToTheShardOfTheirYear(self):
+    self.putSample()
+    self.assertEqual(catalog.getYears(), ['2011', '2010'])
+    self.assertEqual(self.shardNames('2010'), ['first'])
+    self.assertEqual(self.shardNames('2011'), ['draft', 'second'])
+    self.assertEqual(self.shardNames(catalog.PAGES_SHARD), ['about'])
+    self.assertEqual(names(storage.load()),
+      ['about', 'draft', 'first', 'second'])
+
+  def testSaveOnlyReadsItsShard(self):
+    self.putSample()
+    catalog.invalidate()
+    del self.read[:]
+    storage.put(makeElement('second', '2011-06-15 08:30:00', tags='x'))
+    # The catalog file is the small shard with the pages
+    self.assertEqual(set(self.read), set([Config.CATALOG_FILE, '2011.xml']))
+    storage.remove(['first'])
+    self.assertEqual(set(self.read),
+      set([Config.CATALOG_FILE, '2011.xml', '2010.xml']))
+
+  def testChangingTheYearMovesThePost(self):
+    self.putSample()
+    storage.put(makeElement('first', '2012-02-01 10:00:00'))
+    self.assertEqual(self.shardNames('2010'), [])
+    self.assertEqual(self.shardNames('2012'), ['first'])
+    storage.put(makeElement('later', '2012-05-01 10:00:00'), 'first')
+    self.assertEqual(self.shardNames('2012'), ['later'])
+    self.assertEqual(catalog.getNameYears('later'), ['2012'])
+    self.assertEqual(catalog.getNameYears('first'), [])
+
+  def testShardIndex(self):
+    self.putSample()
+    del self.read[:]
+    index = catalog.getShardIndex()
+    self.assertEqual(self.read, [])
+    self.assertEqual(index['2011']['posts'], ['2011-06-15 08:30:00'])
+    self.assertEqual(index['2011']['categories'],
+      {'news': ['2011-06-15 08:30:00'], 'misc': ['2011-06-15 08:30:00']})
+    self.assertEqual(sorted(index['2011']['names']), ['draft', 'second'])
+    # A shard edited by hand is summarized again
+    filepath = catalog.getShardFilepath('2010')
+    tree = self.readTree(filepath)
+    tree.getroot().append(makeElement('manual', '2010-09-09 09:00:00'))
+    catalog.writeTree(tree, filepath)
+    os.utime(filepath, (1, 1))
+    self.assertEqual(catalog.getNameYears('manual'), ['2010'])
+    self.assertEqual(len(catalog.getShardIndex()['2010']['posts']), 2)
+
+  def testShardCommand(self):
+    Config.CATALOG_LAYOUT = 'single'
+    self.putSample()
+    Config.CATALOG_LAYOUT = 'sharded'
+    self.assertEqual(catalog.shard(), 3)
+    self.assertEqual(self.shardNames(catalog.PAGES_SHARD), ['about'])
+    self.assertEqual(self.shardNames('2011'), ['draft', 'second'])
+    self.assertEqual(names(storage.load()),
+      ['about', 'draft', 'first', 'second'])
+    self.assertEqual(catalog.getNameYears('first'), ['2010'])
+
+  def testDeepWindowsSkipWholeShards(self):
+    dates = {}
+    for year in range(2005, 2011):
+      for month in range(1, 4):
+        name = 'p%d-%d' % (year, month)
+        dates[name] = '%d-%02d-10 10:00:00' % (year, month)
+        storage.put(makeElement(name, dates[name]))
+    # Interleaved with the native posts of every year
+    wp_items = [{'name': 'wp%d' % (year), 'date': '%d-02-20 10:00:00' % (year)}
+      for year in range(2010, 2003, -1)]
+    dates.update((i['name'], i['date']) for i in wp_items)
+    merged = sorted(dates, key=dates.get, reverse=True)
+    def window(start, stop):
+      catalog.invalidate()
+      del self.read[:]
+      post_lists = [views.getShardedPostList(), listing.PostList(wp_items)]
+      return [i['name'] for i in listing.getWindow(post_lists, start, stop)]
+    self.assertEqual(window(0, 100), merged)
+    for start in range(0, len(merged) + 1):
+      self.assertEqual(window(start, start + 4), merged[start:start + 4], start)
+    # Posts 16-19 are the posts of 2006; the newer shards are not loaded
+    self.assertEqual(window(16, 20), ['p2006-3', 'wp2006', 'p2006-2', 'p2006-1'])
+    self.assertEqual(self.read, ['2006.xml'])
+    self.assertEqual(window(15, 21), merged[15:21])
+    self.assertEqual(self.read, ['2007.xml', '2006.xml', '2005.xml'])
+
+if __name__ == '__main__':
+  unittest.main()
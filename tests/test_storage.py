@@ -0,0 +1,91 @@
+#!/usr/bin/python
+'''
+Copyright (C) 2012 Mark West.
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+'''
+
+'''
+Information:
+  Tests of the catalog storage: round trips between the XML and SQLite
+  catalogs (see storage).
+'''
+
+import os
+import unittest
+
+from filestack import views
+from filestack import catalog
+from filestack import storage
+from filestack.xmlbackend import ET
+from filestack.config import Config
+from filestack.tests.base import TempDirTestCase, makeElement, names
+
+def snapshot(tree):
+  '''Get the sorted serialized elements of a loaded catalog.'''
+  return sorted(catalog.toXML(e) for e in tree.getroot())
+
+def putSample():
+  '''Put two visible posts, a hidden post and a page into the catalog.'''
+  for element in [
+      makeElement('first', '2010-03-01 10:00:00', categories='news', tags='a,b'),
+      makeElement('second', '2011-06-15 08:30:00', categories='news,misc'),
+      makeElement('draft', '2011-07-01 00:00:00', status='hidden'),
+      makeElement('about', '2010-01-01 00:00:00', type='page')]:
+    storage.put(element)
+
+class StorageTest(TempDirTestCase):
+  def testXMLToSQLiteAndBack(self):
+    putSample()
+    original = snapshot(storage.load())
+    exported = os.path.join(self.dir, 'export.xml')
+    self.assertEqual(storage.exportXML(exported), 4)
+    Config.CATALOG_STORAGE = 'sqlite'
+    self.assertEqual(storage.importXML(exported), 4)
+    self.assertEqual(snapshot(storage.load()), original)
+    exported_again = os.path.join(self.dir, 'export-sqlite.xml')
+    self.assertEqual(storage.exportXML(exported_again), 4)
+    Config.CATALOG_STORAGE = 'xml'
+    Config.POST_DIR = os.path.join(self.dir, 'restored')
+    catalog.invalidate()
+    self.assertEqual(storage.importXML(exported_again), 4)
+    self.assertEqual(snapshot(storage.load()), original)
+
+  def testImportReplacesTheCatalog(self):
+    for backend in ['xml', 'sqlite']:
+      Config.CATALOG_STORAGE = backend
+      storage.put(makeElement('old', '2009-01-01 00:00:00'))
+      exported = os.path.join(self.dir, 'new.xml')
+      tree = ET.ElementTree(ET.Element('catalog', version='0.1'))
+      tree.getroot().append(makeElement('new', '2012-01-01 00:00:00'))
+      catalog.writeTree(tree, exported)
+      storage.importXML(exported)
+      self.assertEqual(names(storage.load()), ['new'], backend)
+
+  def testPutReplaceAndRemove(self):
+    for backend in ['xml', 'sqlite']:
+      Config.CATALOG_STORAGE = backend
+      Config.POST_DIR = os.path.join(self.dir, backend)
+      putSample()
+      storage.put(makeElement('renamed', '2011-06-15 08:30:00'), 'second')
+      storage.remove(['draft'])
+      self.assertEqual(names(storage.load()), ['about', 'first', 'renamed'],
+        backend)
+      signature = storage.signature()
+      storage.put(makeElement('first', '2010-03-01 10:00:00', tags='c'))
+      self.assertNotEqual(storage.signature(), signature, backend)
+      element = views.findElement(storage.load(), 'first')
+      self.assertEqual(element.findtext('tags'), 'c', backend)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/python
+'''
+Copyright (C) 2012 Mark West.
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+'''
+
+'''
+Information:
+  Tests of the content-addressed upload store (see uploads).
+'''
+
+import os
+import stat
+import unittest
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadedfile import TemporaryUploadedFile
+
+from filestack import uploads
+from filestack.tests.base import TempDirTestCase
+
+def temporaryUpload(name, data):
+  '''Get an upload that Django spooled to a (private) temporary file.'''
+  f = TemporaryUploadedFile(name, 'text/plain', len(data), None)
+  f.write(data)
+  f.seek(0)
+  return f
+
+def mode(path):
+  return stat.S_IMODE(os.stat(path).st_mode)
+
+def storedFiles():
+  '''Get the paths of the files in the store.'''
+  return [os.path.join(dirpath, f)
+    for dirpath, dirnames, filenames in os.walk(uploads.getStoreDir())
+    for f in filenames]
+
+class UploadsTest(TempDirTestCase):
+  def testUploadsAreStoredOnceAndReadable(self):
+    uploads_dir = uploads.getUploadDir()
+    a = uploads.save(SimpleUploadedFile('a.txt', 'same'), 'a.txt')
+    b = uploads.save(temporaryUpload('b.txt', 'same'), 'b.txt')
+    c = uploads.save(temporaryUpload('c.txt', 'other'), 'c.txt')
+    self.assertEqual([a, b, c], [os.path.join(uploads_dir, f)
+      for f in ['a.txt', 'b.txt', 'c.txt']])
+    self.assertTrue(os.path.samefile(a, b))
+    self.assertEqual(open(b).read(), 'same')
+    self.assertEqual(len(storedFiles()), 2)
+    for path in storedFiles() + [a, b, c]:
+      self.assertEqual(mode(path), uploads.FILE_MODE, path)
+    # The name is taken
+    self.assertEqual(uploads.save(SimpleUploadedFile('a.txt', 'new'), 'a.txt'),
+      None)
+    self.assertEqual(open(a).read(), 'same')
+
+  def testNameTakenByAConcurrentUpload(self):
+    storeUpload = uploads.storeUpload
+    def racingStoreUpload(f):
+      open(os.path.join(uploads.getUploadDir(), 'a.txt'), 'w').write('first')
+      return storeUpload(f)
+    uploads.storeUpload = racingStoreUpload
+    try:
+      self.assertEqual(uploads.save(SimpleUploadedFile('a.txt', 'second'),
+        'a.txt'), None)
+    finally:
+      uploads.storeUpload = storeUpload
+    self.assertEqual(open(os.path.join(uploads.getUploadDir(), 'a.txt')).read(),
+      'first')
+
+  def testDedupe(self):
+    uploads_dir = uploads.getUploadDir()
+    sizes_dir = os.path.join(uploads_dir, 'photos', uploads.SIZES_DIR, '320')
+    uploads.makeDirs(sizes_dir)
+    for path in ['one.jpg', 'photos/two.jpg', 'photos/sizes/320/two.jpg']:
+      open(os.path.join(uploads_dir, path), 'wb').write('image')
+      os.chmod(os.path.join(uploads_dir, path), 0600)
+    open(os.path.join(uploads_dir, 'other.txt'), 'wb').write('text')
+    counts = uploads.dedupe(processes=1)
+    self.assertEqual(counts['files'], 3)
+    self.assertEqual(counts['duplicates'], 1)
+    self.assertEqual(len(storedFiles()), 2)
+    one = os.path.join(uploads_dir, 'one.jpg')
+    self.assertTrue(os.path.samefile(one,
+      os.path.join(uploads_dir, 'photos', 'two.jpg')))
+    # Derived copies are not uploads
+    self.assertFalse(os.path.samefile(one, os.path.join(sizes_dir, 'two.jpg')))
+    for path in storedFiles():
+      self.assertEqual(mode(path), uploads.FILE_MODE, path)
+    # Running it again changes nothing
+    counts = uploads.dedupe(processes=1)
+    self.assertEqual((counts['duplicates'], counts['removed']), (0, 0))
+
+if __name__ == '__main__':
+  unittest.main()
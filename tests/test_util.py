@@ -0,0 +1,79 @@
+#!/usr/bin/python
+'''
+Copyright (C) 2012 Mark West.
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+'''
+
+'''
+Information:
+  Tests of the element wrapper (see util.ETWrap).
+'''
+
+import os
+import unittest
+
+from filestack import util
+from filestack.tests.base import TempDirTestCase
+
+ITEM = '''<rss xmlns:wp="http://wordpress.org/export/1.0/"><channel><item>
+<title>First title</title><title>Second title</title><guid/>
+<wp:post_name>hello</wp:post_name><wp:status>publish</wp:status>
+<status>plain</status>
+</item></channel></rss>'''
+
+class ETWrapTest(TempDirTestCase):
+  def setUp(self):
+    TempDirTestCase.setUp(self)
+    f = open('item.xml', 'w')
+    f.write(ITEM)
+    f.close()
+    tree, self.ns = util.parse_and_get_ns(os.path.abspath('item.xml'))
+    self.element = tree.find('./channel/item')
+
+  def wrappers(self):
+    return [util.ETWrap(self.element, self.ns),
+      util.ETWrap(self.element, self.ns, mapped=True)]
+
+  def testMappedReadsMatchFindtext(self):
+    for w in self.wrappers():
+      self.assertEqual(w.title, 'First title')  # The first one wins
+      self.assertEqual(w.guid, '')
+      self.assertEqual(w.missing, None)
+      self.assertEqual(w.status, 'plain')
+      self.assertEqual(w.ns('wp').status, 'publish')
+      self.assertEqual(w.ns('unknown').status, 'plain')
+
+  def testFields(self):
+    for w in self.wrappers():
+      self.assertEqual(w.fields('title', 'status', 'missing'),
+        ('First title', 'plain', None))
+      self.assertEqual(w.ns('wp').fields('post_name', 'status', 'title'),
+        ('hello', 'publish', None))
+      self.assertEqual(w.fields(), ())
+
+  def testMapIsReadOnce(self):
+    w = util.ETWrap(self.element, self.ns, mapped=True)
+    for child in list(self.element):
+      self.element.remove(child)
+    self.assertEqual(w.fields('title', 'status'), ('First title', 'plain'))
+    self.assertEqual(w.ns('wp').post_name, 'hello')
+    self.assertEqual(util.ETWrap(self.element, self.ns).title, None)
+
+  def testUnwrap(self):
+    for w in self.wrappers():
+      self.assertTrue(w.unwrap() is self.element)
+      self.assertTrue(w.ns('wp').unwrap() is self.element)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/python
+'''
+Copyright (C) 2012 Mark West.
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+'''
+
+'''
+Information:
+  Tests of the cached visible set of the catalog (see views.getVisibility).
+'''
+
+import datetime
+import unittest
+
+from filestack import util
+from filestack import views
+from filestack import storage
+from filestack.config import Config
+from filestack.tests.base import TempDirTestCase, makeElement, fixedClock
+
+SCHEDULED = '2012-06-01 12:00:00'
+
+class VisibilityTest(TempDirTestCase):
+  def setUp(self):
+    TempDirTestCase.setUp(self)
+    for element in [
+        makeElement('old', '2012-01-01 10:00:00', categories='news'),
+        makeElement('hidden', '2012-02-01 10:00:00', status='hidden'),
+        makeElement('scheduled', SCHEDULED, categories='news,later'),
+        makeElement('about', '2012-01-01 00:00:00', type='page'),
+        makeElement('launch', SCHEDULED, type='page')]:
+      storage.put(element)
+
+  def tearDown(self):
+    views.datetime = datetime
+    TempDirTestCase.tearDown(self)
+
+  def visible(self):
+    xml_tree = storage.load()
+    return ([p['name'] for p in views.getPostList(xml_tree).iterFrom()],
+      [p['name'] for p in views.getVisiblePages(xml_tree)],
+      sorted(views.getVisibleCategories(xml_tree)))
+
+  def testVisibilityIsReusedUntilTheScheduledPost(self):
+    self.checkScheduledPost()
+
+  def testVisibilityOfSQLiteCatalog(self):
+    Config.CATALOG_STORAGE = 'sqlite'
+    storage.importXML(util.checkBaseline())
+    self.checkScheduledPost()
+
+  def checkScheduledPost(self):
+    views.datetime = fixedClock('2012-06-01 11:00:00')
+    visibility = views.getVisibility(storage.load())
+    self.assertEqual(visibility['until'], SCHEDULED)
+    self.assertEqual(self.visible(), (['old'], ['about'], ['news']))
+    views.datetime = fixedClock('2012-06-01 11:59:59')
+    self.assertTrue(views.getVisibility(storage.load()) is visibility)
+    self.assertEqual(self.visible(), (['old'], ['about'], ['news']))
+    views.datetime = fixedClock(SCHEDULED)
+    visibility = views.getVisibility(storage.load())
+    self.assertEqual(visibility['now'][0:19], SCHEDULED)
+    self.assertEqual(visibility['until'], None)
+    self.assertEqual(self.visible(),
+      (['scheduled', 'old'], ['launch', 'about'], ['later', 'news']))
+
+  def testCatalogChangesAreVisibleAtOnce(self):
+    views.datetime = fixedClock('2012-06-01 11:00:00')
+    visibility = views.getVisibility(storage.load())
+    storage.put(makeElement('hidden', '2012-02-01 10:00:00'))
+    self.assertFalse(views.getVisibility(storage.load()) is visibility)
+    self.assertEqual(self.visible(), (['hidden', 'old'], ['about'], ['news']))
+
+if __name__ == '__main__':
+  unittest.main()
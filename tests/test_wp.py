@@ -0,0 +1,140 @@
+#!/usr/bin/python
+'''
+Copyright (C) 2012 Mark West.
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+'''
+
+'''
+Information:
+  Tests of loading the WordPress export through its sidecar (see wp).
+'''
+
+import os
+import time
+import logging
+import threading
+import unittest
+
+from filestack import wp
+from filestack.config import Config
+from filestack.tests.base import TempDirTestCase, writeExport
+
+POSTS = [('first', '2011-01-10 08:00:00'), ('second', '2011-02-10 08:00:00')]
+
+class Records(logging.Handler):
+  '''Keeps the messages logged by the wp module.'''
+  def __init__(self):
+    logging.Handler.__init__(self)
+    self.messages = []
+
+  def emit(self, record):
+    self.messages.append(record.getMessage())
+
+class SidecarTest(TempDirTestCase):
+  def setUp(self):
+    TempDirTestCase.setUp(self)
+    os.mkdir(Config.POST_DIR)
+    Config.WP_XML_FILE = 'export.xml'
+    self.export = os.path.join(Config.POST_DIR, 'export.xml')
+    self.records = Records()
+    wp.log.addHandler(self.records)
+    # Parsing waits for self.release, so a test sees the build running
+    self.release = threading.Event()
+    self.parsed = []
+    self.parseExport = wp.parseExport
+    def parseExport(filepath):
+      self.parsed.append(filepath)
+      self.release.wait(5)
+      return self.parseExport(filepath)
+    wp.parseExport = parseExport
+
+  def tearDown(self):
+    self.release.set()
+    self.waitForBuild()
+    wp.parseExport = self.parseExport
+    wp.log.removeHandler(self.records)
+    TempDirTestCase.tearDown(self)
+
+  def waitForBuild(self):
+    for i in range(500):
+      if not wp._cache['building']:
+        return
+      time.sleep(0.01)
+    self.fail('The background build did not finish')
+
+  def replaceExport(self, posts):
+    '''Write a new export with a later modification time.'''
+    writeExport(self.export, posts)
+    mtime = time.time() + 10
+    os.utime(self.export, (mtime, mtime))
+
+  def postNames(self, index):
+    return [i['name'] for i in wp.getItems(index)]
+
+  def testMissingSidecarIsBuiltInTheBackground(self):
+    writeExport(self.export, POSTS)
+    self.assertEqual(wp.loadXML(), None)
+    self.assertEqual(wp.loadXML(), None)
+    self.assertTrue(wp._cache['building'])
+    self.assertEqual(len(self.records.messages), 1)
+    self.assertTrue('No sidecar' in self.records.messages[0])
+    self.release.set()
+    self.waitForBuild()
+    index = wp.loadXML()
+    self.assertEqual(self.postNames(index), ['second', 'first'])
+    self.assertEqual(index.source, wp.sourceSignature(self.export))
+    self.assertTrue(os.path.exists(wp.getSidecarFilepath(self.export)))
+    self.assertEqual(len(self.parsed), 1)
+
+  def testOutdatedSidecarIsServedWhileRebuilding(self):
+    writeExport(self.export, POSTS)
+    self.release.set()
+    wp.buildSidecar(self.export)
+    self.release.clear()
+    self.assertEqual(self.postNames(wp.loadXML()), ['second', 'first'])
+    self.replaceExport(POSTS + [('third', '2011-03-10 08:00:00')])
+    self.assertEqual(self.postNames(wp.loadXML()), ['second', 'first'])
+    self.assertEqual(self.postNames(wp.loadXML()), ['second', 'first'])
+    self.assertTrue(wp._cache['building'])
+    self.assertEqual(self.records.messages, [])
+    self.release.set()
+    self.waitForBuild()
+    index = wp.loadXML()
+    self.assertEqual(self.postNames(index), ['third', 'second', 'first'])
+    self.assertEqual(wp.readSidecar(self.export).source, index.source)
+    self.assertEqual(len(self.parsed), 2)
+
+  def testBrokenExportIsServedWithoutItems(self):
+    open(self.export, 'w').write('<rss><channel>')
+    self.release.set()
+    self.assertEqual(wp.loadXML(), None)
+    self.waitForBuild()
+    self.assertEqual(wp.loadXML(), None)
+    self.assertEqual(len(self.parsed), 1)
+    self.assertTrue('Cannot parse' in self.records.messages[-1])
+    self.assertRaises(Exception, wp.loadXML, wait=True)
+
+  def testWaitBuildsInThisThread(self):
+    writeExport(self.export, POSTS)
+    self.release.set()
+    index = wp.loadXML(wait=True)
+    self.assertFalse(wp._cache['building'])
+    self.assertEqual(self.postNames(index), ['second', 'first'])
+    self.assertTrue(wp.loadXML() is index)
+    self.replaceExport(POSTS[:1])
+    self.assertEqual(self.postNames(wp.loadXML(wait=True)), ['first'])
+    self.assertEqual(self.records.messages, [])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,250 @@
+#!/usr/bin/python
+'''
+Copyright (C) 2012 Mark West.
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+'''
+
+'''
+Information:
+  Per-request timing of the phases of the views.
+
+  With Config.TIMING, the time spent in each phase of a request (loading
+  the catalog and the WordPress export, parsing XML, filtering items,
+  loading content, building the menu and rendering templates) is recorded
+  along with counts of the files opened, bytes read and elements walked.
+  Phases can nest: the menu phase includes the items it filters.
+  Responses to logged-in users get a Server-Timing header, and histograms
+  per view are kept in memory for the SU timing page.  With Config.TIMING
+  off, a timed function costs one thread-local lookup.
+
+  A logged-in user can profile a single request with cProfile by adding
+  "profile=1" to its query string (or "profile=time" etc. to sort the
+  report by another column).  The response is then the profile report.
+'''
+
+import os
+import time
+import pstats
+import cProfile
+import functools
+import threading
+from cStringIO import StringIO
+
+from django.http import HttpResponse
+
+from config import Config
+
+# Upper bounds (in milliseconds) of the histogram buckets; the last bucket
+# holds everything slower
+BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+BUCKET_LABELS = ['<=%d' % b for b in BUCKETS] + ['>%d' % BUCKETS[-1]]
+COUNTERS = ['files', 'bytes', 'elements']
+# Lines of the profile report
+PROFILE_LINES = 60
+PROFILE_SORTS = ['cumulative', 'time', 'calls', 'name']
+
+_local = threading.local()
+_lock = threading.Lock()
+# Aggregated timings: key=view name, value=dict (see aggregate())
+_views = {}
+
+def newHistogram():
+  '''Get an empty histogram.'''
+  return {'count': 0, 'sum': 0.0, 'max': 0.0, 'buckets': [0] * (len(BUCKETS) + 1)}
+
+def addSample(histogram, ms):
+  '''Add a time (in milliseconds) to a histogram.'''
+  n = 0
+  while n < len(BUCKETS) and ms > BUCKETS[n]:
+    n += 1
+  histogram['buckets'][n] += 1
+  histogram['count'] += 1
+  histogram['sum'] += ms
+  histogram['max'] = max(histogram['max'], ms)
+
+def percentile(histogram, fraction):
+  '''Estimate a percentile of a histogram (the upper bound of its bucket).'''
+  rank = fraction * histogram['count']
+  seen = 0
+  for n, count in enumerate(histogram['buckets']):
+    seen += count
+    if count and seen >= rank:
+      return min(BUCKETS[n], histogram['max']) if n < len(BUCKETS) else histogram['max']
+  return 0.0
+
+def count(counter, n=1):
+  '''Add n to a counter (files, bytes or elements) of the current request.'''
+  record = getattr(_local, 'record', None)
+  if record is not None:
+    record['counts'][counter] += n
+
+def countFile(filepath):
+  '''Count a file (and its size) as read by the current request.'''
+  record = getattr(_local, 'record', None)
+  if record is not None:
+    record['counts']['files'] += 1
+    try:
+      record['counts']['bytes'] += os.path.getsize(filepath)
+    except OSError:
+      pass
+
+def timed(phase):
+  '''Decorator that adds the run time of a function to a phase.
+
+  Args:
+    phase: Name of the phase (a Server-Timing metric name).
+  '''
+  def decorator(fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+      record = getattr(_local, 'record', None)
+      if record is None:
+        return fn(*args, **kwargs)
+      start = time.time()
+      try:
+        return fn(*args, **kwargs)
+      finally:
+        phases = record['phases']
+        if phase not in phases:
+          record['order'].append(phase)
+          phases[phase] = [0.0, 0]
+        phases[phase][0] += time.time() - start
+        phases[phase][1] += 1
+    return wrapper
+  return decorator
+
+@timed('render')
+def render(template, context):
+  '''Render a template (timed as the render phase).'''
+  return template.render(context)
+
+def serverTiming(total, record):
+  '''Get the Server-Timing header value of a request record.'''
+  metrics = ['%s;dur=%.1f' % (phase, record['phases'][phase][0] * 1000)
+    for phase in record['order']]
+  metrics.extend('%s;desc="%d"' % (counter, record['counts'][counter])
+    for counter in COUNTERS)
+  metrics.append('total;dur=%.1f' % (total * 1000))
+  return ', '.join(metrics)
+
+def aggregate(name, total, record):
+  '''Add a request record to the histograms of its view.'''
+  _lock.acquire()
+  try:
+    stats = _views.get(name)
+    if stats is None:
+      stats = _views[name] = {'total': newHistogram(), 'phases': {},
+        'calls': {}, 'counts': dict((c, 0) for c in COUNTERS)}
+    addSample(stats['total'], total * 1000)
+    for phase, (seconds, calls) in record['phases'].iteritems():
+      if phase not in stats['phases']:
+        stats['phases'][phase] = newHistogram()
+        stats['calls'][phase] = 0
+      addSample(stats['phases'][phase], seconds * 1000)
+      stats['calls'][phase] += calls
+    for counter, n in record['counts'].iteritems():
+      stats['counts'][counter] += n
+  finally:
+    _lock.release()
+
+def profile(request, view, *args, **kwargs):
+  '''Run a view under cProfile.
+
+  Returns:
+    A plain text response with the profile report.
+  '''
+  sort = request.GET.get('profile')
+  if sort not in PROFILE_SORTS:
+    sort = 'cumulative'
+  profiler = cProfile.Profile()
+  start = time.time()
+  response = profiler.runcall(view, request, *args, **kwargs)
+  total = time.time() - start
+  out = StringIO()
+  out.write('%s %s: status %d, %.1f ms\n\n' % (request.method,
+    request.get_full_path(), response.status_code, total * 1000))
+  stats = pstats.Stats(profiler, stream=out)
+  stats.strip_dirs().sort_stats(sort).print_stats(PROFILE_LINES)
+  return HttpResponse(out.getvalue(), content_type='text/plain')
+
+def timedView(view):
+  '''Decorator that records the phases of the requests of a view.
+
+  Also runs the view under cProfile when a logged-in user asks for it
+  (see the module information).
+  '''
+  @functools.wraps(view)
+  def wrapper(request, *args, **kwargs):
+    if 'profile' in request.GET and request.user.is_authenticated():
+      return profile(request, view, *args, **kwargs)
+    if not Config.TIMING:
+      return view(request, *args, **kwargs)
+    record = {'phases': {}, 'order': [], 'counts': dict((c, 0) for c in COUNTERS)}
+    _local.record = record
+    start = time.time()
+    try:
+      response = view(request, *args, **kwargs)
+    finally:
+      _local.record = None
+    total = time.time() - start
+    aggregate(view.__name__, total, record)
+    if request.user.is_authenticated():
+      response['Server-Timing'] = serverTiming(total, record)
+    return response
+  return wrapper
+
+def getStats():
+  '''Get a summary of the histograms for the SU timing page.
+
+  Returns:
+    A list of dicts (one per view, sorted by name) with name, requests,
+    mean, p50, p95 and max times (in milliseconds), buckets (a list of
+    (label, count) tuples), the counts per request, and phases: a list of
+    dicts with name, calls per request, mean, p50, p95 and max.
+  '''
+  def summary(histogram):
+    n = histogram['count'] or 1
+    return {'mean': histogram['sum'] / n, 'p50': percentile(histogram, 0.5),
+      'p95': percentile(histogram, 0.95), 'max': histogram['max']}
+  ret = []
+  _lock.acquire()
+  try:
+    for name in sorted(_views):
+      stats = _views[name]
+      requests = stats['total']['count']
+      view = summary(stats['total'])
+      view.update({
+        'name': name,
+        'requests': requests,
+        'buckets': zip(BUCKET_LABELS, stats['total']['buckets']),
+        'counts': dict((c, float(stats['counts'][c]) / requests) for c in COUNTERS),
+        'phases': []
+        })
+      for phase in sorted(stats['phases']):
+        row = summary(stats['phases'][phase])
+        row['name'] = phase
+        row['calls'] = float(stats['calls'][phase]) / stats['phases'][phase]['count']
+        view['phases'].append(row)
+      ret.append(view)
+  finally:
+    _lock.release()
+  return ret
+
+def reset():
+  '''Clear the histograms.'''
+  _lock.acquire()
+  try:
+    _views.clear()
+  finally:
+    _lock.release()
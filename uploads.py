@@ -0,0 +1,281 @@
+#!/usr/bin/python
+'''
+Copyright (C) 2012 Mark West.
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+'''
+
+'''
+Information:
+  Content-addressed store for uploaded files.
+
+  Every file is stored once, named by the SHA-1 digest of its content, in
+  Config.UPLOAD_STORE_DIR inside the upload directory.  The friendly name
+  in the upload directory is a hardlink to the stored file (or a relative
+  symlink where hardlinks are not possible), so identical uploads under
+  different names cost no extra disk.  The digest is computed while the
+  upload is read, and content that is already stored is never written
+  again.  "su.py uploads dedupe" moves existing uploads into the store.
+'''
+
+import os
+import errno
+import hashlib
+import tempfile
+import multiprocessing
+
+from config import Config
+
+# Read and write buffer size (in bytes)
+CHUNK_SIZE = 1024 * 1024
+# Directory of the smaller copies of an image, next to the image (see images)
+SIZES_DIR = 'sizes'
+# Mode of stored files: what open() would create (0666 less the umask), so
+# the webserver can read them whichever user it runs as
+_umask = os.umask(0)
+os.umask(_umask)
+FILE_MODE = 0666 & ~_umask
+
+def getUploadDir():
+  '''Get the upload directory (in the Django /media directory).'''
+  return os.path.join('public', 'media', Config.UPLOAD_DIR)
+
+def getStoreDir():
+  '''Get the directory of the stored files.'''
+  return os.path.join(getUploadDir(), Config.UPLOAD_STORE_DIR)
+
+def getSkippedDirs():
+  '''Get the names of the directories that hold no uploads of their own.
+
+  These are the store and the smaller copies of images (see images), at
+  any depth below an upload directory.
+  '''
+  return [Config.UPLOAD_STORE_DIR, SIZES_DIR]
+
+def storePath(digest):
+  '''Get the stored file of a digest.'''
+  return os.path.join(getStoreDir(), digest[0:2], digest)
+
+def makeDirs(path):
+  '''Create a directory and its parents unless it exists.'''
+  try:
+    os.makedirs(path, 0755)
+  except OSError, e:
+    if e.errno != errno.EEXIST:
+      raise
+
+def hashFile(filepath):
+  '''Get the SHA-1 hex digest of a file's content.'''
+  h = hashlib.sha1()
+  f = open(filepath, 'rb')
+  try:
+    for chunk in iter(lambda: f.read(CHUNK_SIZE), ''):
+      h.update(chunk)
+  finally:
+    f.close()
+  return h.hexdigest()
+
+def link(src, dst):
+  '''Link dst to src: a hardlink, or a relative symlink as fallback.
+
+  Raises:
+    OSError with errno.EEXIST if dst exists.
+  '''
+  try:
+    os.link(src, dst)
+  except OSError, e:
+    if e.errno == errno.EEXIST:
+      raise
+    os.symlink(os.path.relpath(src, os.path.dirname(dst)), dst)
+
+def replace(src, dst):
+  '''Atomically replace dst with a link to src.'''
+  tmp_path = '%s.%d.tmp' % (dst, os.getpid())
+  link(src, tmp_path)
+  os.rename(tmp_path, dst)
+
+def adopt(filepath, digest):
+  '''Make a file with a known digest the stored file of the digest.
+
+  The file is hardlinked into the store when possible (and gets
+  FILE_MODE, e.g. a private temporary file of Django); otherwise it is
+  copied.  Nothing happens if the digest is already stored.
+  '''
+  path = storePath(digest)
+  if os.path.exists(path):
+    return
+  makeDirs(os.path.dirname(path))
+  try:
+    os.link(filepath, path)
+    os.chmod(path, FILE_MODE)
+    return
+  except OSError:
+    pass  # Other filesystem or no hardlinks; copy it
+  src = open(filepath, 'rb')
+  try:
+    writeStored(iter(lambda: src.read(CHUNK_SIZE), ''), digest)
+  finally:
+    src.close()
+
+def writeStored(chunks, digest=None):
+  '''Write chunks to a temporary file in the store and store it.
+
+  Args:
+    chunks: Iterable of strings.
+    digest: Digest of the content, if known.
+
+  Returns:
+    The digest of the content.
+  '''
+  makeDirs(getStoreDir())
+  fd, tmp_path = tempfile.mkstemp(dir=getStoreDir(), suffix='.tmp')
+  os.fchmod(fd, FILE_MODE)  # mkstemp makes private (0600) files
+  h = hashlib.sha1()
+  f = os.fdopen(fd, 'wb', CHUNK_SIZE)
+  try:
+    try:
+      for chunk in chunks:
+        h.update(chunk)
+        f.write(chunk)
+    finally:
+      f.close()
+    digest = digest or h.hexdigest()
+    path = storePath(digest)
+    if os.path.exists(path):
+      os.remove(tmp_path)  # Already stored
+    else:
+      makeDirs(os.path.dirname(path))
+      os.rename(tmp_path, path)
+  except:
+    if os.path.exists(tmp_path):
+      os.remove(tmp_path)
+    raise
+  return digest
+
+def storeUpload(f):
+  '''Store a Django UploadedFile.
+
+  Uploads Django spooled to a temporary file are hashed and hardlinked
+  into the store.  Small uploads held in memory are hashed before they
+  are written.  Others are hashed while being written.
+
+  Returns:
+    The digest of the content.
+  '''
+  if hasattr(f, 'temporary_file_path'):
+    digest = hashFile(f.temporary_file_path())
+    adopt(f.temporary_file_path(), digest)
+    return digest
+  if not f.multiple_chunks():
+    data = f.read()
+    digest = hashlib.sha1(data).hexdigest()
+    if not os.path.exists(storePath(digest)):
+      writeStored([data], digest)
+    return digest
+  return writeStored(f.chunks(CHUNK_SIZE))
+
+def save(f, filename):
+  '''Store an uploaded file under a filename in the upload directory.
+
+  Args:
+    f: Django UploadedFile.
+    filename: Name of the file (without directories).
+
+  Returns:
+    The path of the file or None if the filename is already taken.
+  '''
+  upload_dir = getUploadDir()
+  makeDirs(upload_dir)
+  filepath = os.path.join(upload_dir, filename)
+  if os.path.lexists(filepath):
+    return None
+  digest = storeUpload(f)
+  try:
+    link(storePath(digest), filepath)
+  except OSError, e:
+    if e.errno != errno.EEXIST:
+      raise
+    return None  # Taken by a concurrent upload
+  return filepath
+
+def hashJob(filepath):
+  '''Hash a file; runs in a worker process of dedupe().'''
+  return (filepath, hashFile(filepath))
+
+def dedupe(processes=None):
+  '''Move the files in the upload directory into the store.
+
+  Files are hashed in parallel.  Every file is then replaced by a link to
+  the stored file of its digest, so duplicates share a single copy.
+  Stored files that are no longer linked from the upload directory are
+  removed.
+
+  Args:
+    processes: Number of worker processes.  Defaults to
+      Config.BUILD_PROCESSES or the CPU count.
+
+  Returns:
+    A dict with the counts of files, duplicates, bytes saved and removed
+    stored files.
+  '''
+  upload_dir = getUploadDir()
+  store_dir = getStoreDir()
+  todo = []
+  linked = set()
+  for dirpath, dirnames, filenames in os.walk(upload_dir):
+    for skip in getSkippedDirs():
+      if skip in dirnames:
+        dirnames.remove(skip)
+    for filename in filenames:
+      filepath = os.path.join(dirpath, filename)
+      if os.path.islink(filepath):
+        linked.add(os.path.realpath(filepath))
+      elif os.path.isfile(filepath):
+        todo.append(filepath)
+  processes = processes or Config.BUILD_PROCESSES or multiprocessing.cpu_count()
+  if len(todo) > 1 and processes > 1:
+    pool = multiprocessing.Pool(processes)
+    try:
+      hashed = pool.map(hashJob, todo)
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    hashed = [hashJob(f) for f in todo]
+  counts = {'files': len(hashed), 'duplicates': 0, 'saved': 0, 'removed': 0}
+  for filepath, digest in hashed:
+    path = storePath(digest)
+    st = os.stat(filepath)
+    if os.path.exists(path):
+      if os.path.samefile(path, filepath):
+        linked.add(os.path.realpath(path))
+        continue
+      if st.st_nlink == 1:
+        counts['duplicates'] += 1
+        counts['saved'] += st.st_size
+      replace(path, filepath)
+    else:
+      adopt(filepath, digest)
+      if not os.path.samefile(path, filepath):
+        replace(path, filepath)
+    if os.path.islink(filepath):
+      linked.add(os.path.realpath(path))
+  # Stored files whose links were all deleted
+  if os.path.isdir(store_dir):
+    for dirpath, dirnames, filenames in os.walk(store_dir):
+      for filename in filenames:
+        path = os.path.join(dirpath, filename)
+        if os.stat(path).st_nlink == 1 and os.path.realpath(path) not in linked:
+          os.remove(path)
+          counts['removed'] += 1
+  return counts
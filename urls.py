@@ -28,10 +28,12 @@ urlpatterns += patterns('filestack',
     url(r'^su/new/(?P<type>.+)/$', 'views.su_new', name='su_new'),
     url(r'^su/delete/(?P<slug>.+)/$', 'views.su_delete', name='su_delete'),
     url(r'^su/restore/(?P<slug>.+)/$', 'views.su_restore', name='su_restore'),
+    url(r'^su/timing/$', 'views.su_timing', name='su_timing'),
     url(r'^(?P<year>\d{4})/(?P<month>\d{2})/(?P<day>\d{2})/(?P<slug>.+)/$', \
       'views.detail', name='su_restore'),
     url(r'^category/(?P<category>.+)/$', 'views.category', name='category'),
     url(r'^tag/(?P<tag>.+)/$', 'views.tag', name='tag'),
+    url(r'^search/$', 'views.search', name='search'),
     # Attention: These are catch-alls.
     url(r'(.*/)$', 'views.page', name='page'),
     url(r'^$', 'views.index', name='index'),
@@ -15,12 +15,15 @@ Copyright (C) 2012 Mark West.
  limitations under the License.
 '''
 
-import elementtree.ElementTree as ET
 from django.template import loader
 import datetime
 import string
+import time
 import os
 
+import timing
+import xmlbackend
+from xmlbackend import ET
 from config import Config
 
 
@@ -34,6 +37,14 @@ class ETWrap:
   Allows for accessing namespaced tags as well:
     content = welement.ns('content').encoded
   
+  Several fields can be read at once:
+    title, link = welement.fields('title', 'link')
+  
+  Each read is a scan of the children of the element.  When an element
+  is read more than a few times, wrap it with mapped=True: the text of
+  every child is then put in a dict (keyed by the namespaced tag) once,
+  and every read is a dict lookup.
+  
   This implementation was inspired by Fredrik Lundh's RSS wrappers on
   his effbot.org site:
     http://effbot.org/zone/element-rss-wrapper.htm
@@ -42,13 +53,14 @@ class ETWrap:
     namespace: (static) Namespace dictionary.
   '''
   namespace = {}
-  def __init__(self, element, ns_dict={}, ns_uri=""):
+  def __init__(self, element, ns_dict={}, ns_uri="", mapped=False):
     '''Initializes this puppy.
     
     Args:
       element: Element to wrap.
       ns_dict: Namespace dict for looking up prefixes and URIs.
       ns_uri: Namespace URI to prefix for attribute calls.
+      mapped: Read the text of all children into a dict up front.
     
     Returns:
       A wrapped element.
@@ -56,6 +68,12 @@ class ETWrap:
     self._element = element
     self._ns_dict = ns_dict if len(ns_dict) > 0 else ETWrap.namespace
     self._ns = ns_uri
+    self._texts = None
+    if mapped:
+      texts = self._texts = {}
+      for child in element:
+        if child.tag not in texts:  # The first one wins, like findtext()
+          texts[child.tag] = child.text or ""
     
   def __getattr__(self, tag):
     '''Get an attribute.'''
@@ -67,8 +85,23 @@ class ETWrap:
       return self._element.text
     if tag == 'tail':
       return self._element.text
+    if self._texts is not None:
+      return self._texts.get(self._ns+tag)
     return self._element.findtext(self._ns+tag)
     
+  def fields(self, *names):
+    '''Get the text of several child elements.
+    
+    Args:
+      names: Tags of the children (in the namespace of the wrapper).
+    
+    Returns:
+      A tuple with the text of each child (None for missing children).
+    '''
+    if self._texts is not None:
+      return tuple([self._texts.get(self._ns+n) for n in names])
+    return tuple([self._element.findtext(self._ns+n) for n in names])
+    
   def ns(self, prefix):
     '''Get the element with the namespace set.
     
@@ -78,10 +111,12 @@ class ETWrap:
     Returns:
       A wrapped element, but with the namespace set.
     '''
-    for name, uri in self._ns_dict.iteritems():
-      if name == prefix:
-        return ETWrap(self._element, self._ns_dict, uri)
-    return self
+    uri = self._ns_dict.get(prefix)
+    if uri is None:
+      return self
+    ret = ETWrap(self._element, self._ns_dict, uri)
+    ret._texts = self._texts
+    return ret
     
   def unwrap(self):
     '''Get the raw ElementTree element.'''
@@ -136,6 +171,7 @@ def cleanCSV(csv):
   parts = [r.strip() for r in parts if r != '']
   return ','.join(set(parts))
     
+@timing.timed('parse')
 def parse_and_get_ns(file):
   '''Use ElementTree to parse an XML file, but retain namespace information.
   
@@ -150,22 +186,14 @@ def parse_and_get_ns(file):
       URI.  This is perfectly valid XML, but shows how this parser
       is deficient.
   '''
-  events = "start", "start-ns"
-  root = None
-  ns = {}
-  for event, elem in ET.iterparse(file, events):
-    if event == "start-ns":
-      if elem[0] in ns and ns[elem[0]] != elem[1]:
-        # NOTE: It is perfectly valid to have the same prefix refer
-        #   to different URI namespaces in different parts of the
-        #   document. This exception serves as a reminder that this
-        #   solution is not robust.  Use at your own peril.
-        raise KeyError("Duplicate prefix with different URI found.")
-      ns[elem[0]] = "{%s}" % elem[1]
-    elif event == "start":
-      if root is None:
-        root = elem
-  return (ET.ElementTree(root), ns)
+  # NOTE: It is perfectly valid to have the same prefix refer to
+  #   different URI namespaces in different parts of the document. The
+  #   KeyError serves as a reminder that this solution is not robust.
+  #   Use at your own peril.
+  timing.countFile(file)
+  tree, ns, elements = xmlbackend.parseNS(file)
+  timing.count('elements', elements)
+  return (tree, ns)
   
 ###
 ### Project specific utility functions
@@ -204,7 +232,7 @@ def checkBaseline():
     root = ET.Element("catalog")
     root.set("version", "0.1")
     tree = ET.ElementTree(root)
-    tree.write(filepath, "UTF-8")
+    xmlbackend.write(tree, filepath)
   return filepath
   
 def getTemplate(filename, isSU=False):
@@ -213,4 +241,36 @@ def getTemplate(filename, isSU=False):
   if template_dir:
     filename = os.path.join(template_dir, filename)
   return loader.get_template(filename)
-  
\ No newline at end of file
+  
+# Last template signature read per template dir: (time, signature)
+_template_signatures = {}
+
+def getTemplateDir(isSU=False):
+  '''Get the directory of the theme (or SU) templates.'''
+  template_dir = Config.SU_TEMPLATES if isSU else Config.THEME_TEMPLATES
+  return getFilepath(os.path.join('templates', template_dir))
+  
+def getTemplateSignature(isSU=False, max_age=0):
+  '''Get the (path, mtime, size) of every theme (or SU) template.
+
+  Args:
+    isSU: Get the signature of the SU templates.
+    max_age: Seconds the signature read last by this process is reused
+      before the templates are stat'ed again (0 to always stat them).
+
+  Returns:
+    List of (path, mtime, size) tuples.
+  '''
+  template_dir = getTemplateDir(isSU)
+  now = time.time()
+  checked = _template_signatures.get(template_dir)
+  if max_age and checked and 0 <= now - checked[0] < max_age:
+    return checked[1]
+  ret = []
+  for dirpath, dirnames, filenames in os.walk(template_dir):
+    for filename in sorted(filenames):
+      filepath = os.path.join(dirpath, filename)
+      st = os.stat(filepath)
+      ret.append((filepath, st.st_mtime, st.st_size))
+  _template_signatures[template_dir] = (now, ret)
+  return ret
@@ -19,15 +19,37 @@ from django.http import HttpResponse, HttpResponseNotFound
 from django.template import Context, RequestContext
 from django.shortcuts import redirect
 from django import forms
+from django.conf import settings
 
-import elementtree.ElementTree as ET
+import bisect
 import random
 import datetime
+import time
+import threading
 import os
 
 import util
 import wp
+import catalog
+import storage
+import contentcache
+import listing
+import pagecache
+import compress
+import uploads
+import images
+import fulltext
+import timing
+import records
+import xmlbackend
+from xmlbackend import ET
 from config import Config
+
+_random_lock = threading.Lock()
+# Random posts pool (see getRandomPosts()): epoch of the pool (see
+# getRandomEpoch()), key of the drawn posts, the drawn posts and the fixed
+# seed of a static build (see fixRandomPool())
+_random_pool = {'epoch': None, 'key': None, 'posts': None, 'seed': None}
   
 ###
 ### XML operations
@@ -37,69 +59,181 @@ def findElement(xml_tree, slug):
   '''Find an element in the XML tree with the given slug.
   
   Args:
-    xml_tree: XML tree as an ElementTree object.
+    xml_tree: XML tree as an ElementTree object (see storage.load()).
     slug: Name/ID of the item to find.
   
   Returns:
     The found element or None if no element was found.
   '''
-  types = ['/post', '/page', '/trash']
-  for t in types:
-    elements = xml_tree.findall(t)
-    for e in elements:
+  if storage.isIndexed(xml_tree):
+    return xml_tree.find(slug)
+  return getSlugIndex(xml_tree)['names'].get(slug)
+  
+def buildSlugIndex(xml_tree):
+  '''Build the slug indexes for the XML tree.
+  
+  Args:
+    xml_tree: XML tree as an ElementTree object.
+  
+  Returns:
+    A dict with these indexes:
+      names: Dict of slug to element (first of post, page, trash wins).
+      types: Dict of tag to dict of upper case slug to list of elements.
+      dates: Dict of (YYYY-MM-DD, upper case slug) to list of post elements.
+  '''
+  index = {'names': {}, 'types': {}, 'dates': {}}
+  for t in ['post', 'page', 'trash']:
+    by_slug = index['types'][t] = {}
+    for e in xml_tree.findall('./' + t):
       iwrap = util.ETWrap(e)
-      if iwrap.name == slug:
-        return e
-  return None
+      name = iwrap.name or ''
+      index['names'].setdefault(name, e)
+      by_slug.setdefault(name.upper(), []).append(e)
+      if t == 'post':
+        key = ((iwrap.date or '')[0:len("YYYY-MM-DD")], name.upper())
+        index['dates'].setdefault(key, []).append(e)
+  return index
+  
+def getSlugIndex(xml_tree):
+  '''Get the slug indexes for the XML tree (built once per catalog version).'''
+  return storage.derived(xml_tree, 'slugs', buildSlugIndex)
   
 def elementToItem(element):
-  '''Convert an XML element into a item (a simple dict).
+  '''Convert an XML element into an item (see records.Item).
   
   Args:
     element: Element to convert.
   
   Returns:
-    A dict representation of the XML element.
-  '''
-  welem = util.ETWrap(element)
-  ret = {
-    'type': welem.type,
-    'name': welem.name,
-    'date': welem.date,
-    'url': welem.url,
-    'title': welem.title,
-    'status': welem.status,
-    'filepath': welem.filepath,
-    'parent': welem.parent,
-    'content': welem.content,
-    'tags': welem.tags.split(',') if welem.tags else [],
-    'categories': welem.categories.split(',') if welem.categories else [],
-    'trash': welem.trash
-    }
-  return ret
+    The item of the XML element.
+  '''
+  (type, name, date, url, title, status, filepath, parent, content, tags,
+   categories, trash) = util.ETWrap(element, mapped=True).fields('type',
+    'name', 'date', 'url', 'title', 'status', 'filepath', 'parent',
+    'content', 'tags', 'categories', 'trash')
+  return records.Item(
+    type=type,
+    name=name,
+    date=date,
+    url=url,
+    title=title,
+    status=status,
+    filepath=filepath,
+    parent=parent,
+    content=content,
+    tags=records.splitTerms(tags),
+    categories=records.splitTerms(categories),
+    trash=trash
+    )
   
-def getItems(xml_tree, what='posts', filter_lambda=None):
+@timing.timed('items')
+def getItems(xml_tree, what='posts', filter_lambda=None, start=0, stop=None):
   '''Get all the items from the XML tree of a certain type.
   
   Args:
-    xml_tree: XML tree as an ElementTree object.
+    xml_tree: XML tree as an ElementTree object (see storage.load()).
     what: Type of elements to search for (posts, pages, or trash).
     filter_lambda: Additional filter called before adding item to
-      list.  The lambda is passed a single dict argument and should
+      list.  The lambda is passed a single item argument and should
       return True if the item should be added to the list.
+    start: Index of the first item returned.
+    stop: Index after the last item returned (None for all).
   
   Returns:
-    A list of items, which are simple dicts.
+    A list of items (see records.Item), newest first.
   '''
+  tags = {'posts': 'post', 'pages': 'page', 'trash': 'trash'}
+  if storage.isIndexed(xml_tree):
+    if filter_lambda:
+      return filter(filter_lambda, xml_tree.items(tags[what]))[start:stop]
+    return xml_tree.items(tags[what], start=start, stop=stop)
   ret = []
-  paths = {'posts': '/post', 'pages': '/page', 'trash': '/trash'}
-  elements = xml_tree.findall(paths[what])
+  elements = xml_tree.findall('./' + tags[what])
+  timing.count('elements', len(elements))
   for e in elements:
     item = elementToItem(e)
     if not filter_lambda or filter_lambda(item):
-      ret.append(addDates(item))
+      ret.append(item)
   ret = sorted(ret, key=lambda i: i['date'], reverse=True)
-  return ret
+  return ret[start:stop]
+  
+def buildPostIndex(xml_tree):
+  '''Build the post lists used by the post listings.
+  
+  Only posts with a visible status are included.  Scheduled (future) posts
+  are included and skipped when the lists are used (see listing.PostList).
+  
+  Args:
+    xml_tree: XML tree as an ElementTree object.
+  
+  Returns:
+    A dict with these lists of post items (all newest first):
+      posts: All posts.
+      categories: Dict with key=category, value=list of posts.
+      tags: Dict with key=tag, value=list of posts.
+  '''
+  index = {'posts': [], 'categories': {}, 'tags': {}}
+  for item in getItems(xml_tree, 'posts'):
+    if item['status'].lower() != 'visible':
+      continue
+    index['posts'].append(item)
+    for field in ['categories', 'tags']:
+      for term in item[field]:
+        index[field].setdefault(term, []).append(item)
+  return index
+  
+def getPostList(xml_tree, field=None, term=None):
+  '''Get the visible posts, optionally only those with a category or tag.
+  
+  The lists are built once per catalog version and kept until the next
+  scheduled post is published (see getVisibility), so they are rebuilt
+  after save() or trash() change an item.
+  
+  Args:
+    xml_tree: XML tree as an ElementTree object.
+    field: Either 'categories', 'tags', or None for all posts.
+    term: The category or tag.
+  
+  Returns:
+    A listing.PostList (a storage.QueryPostList for an SQLite catalog).
+  '''
+  visibility = getVisibility(xml_tree)
+  post_list = visibility['postlists'].get((field, term))
+  if post_list is not None:
+    return post_list
+  if storage.isIndexed(xml_tree):
+    post_list = xml_tree.postList(field, term, visibility['now'])
+  else:
+    index = storage.derived(xml_tree, 'postlists', buildPostIndex)
+    items = index[field].get(term, []) if field else index['posts']
+    post_list = listing.PostList(items, visibility['now'])
+  if len(post_list) > 0:  # Unknown terms (from any URL) are not kept
+    visibility['postlists'][(field, term)] = post_list
+  return post_list
+  
+def getShardedPostList(field=None, term=None):
+  '''Get the visible posts of a sharded catalog (see getPostList).
+  
+  The year shards are loaded newest first, only as far as they are used.
+  The length and the oldest date of a shard come from the shard index (see
+  catalog.getShardIndex()).
+  
+  Returns:
+    A listing.ShardedPostList.
+  '''
+  def loader(year):
+    return getPostList(catalog.load(years=[year], pages=False), field, term)
+  def visibleDates(year):
+    entry = catalog.getShardIndex()[year]
+    dates = entry[field].get(term, []) if field else entry['posts']
+    now = datetime.datetime.utcnow().isoformat(' ')
+    return (dates, bisect.bisect_right(dates, now))
+  def sizer(year):
+    return visibleDates(year)[1]
+  def dater(year):
+    dates, size = visibleDates(year)
+    return dates[0] if size else None
+  return listing.ShardedPostList(catalog.getYears(), loader, sizer, dater)
   
 def newElem(type='post'):
   '''Create a new XML element.
@@ -156,7 +290,7 @@ def updateElem(element, item):
     raise Exception('Dict parameter is missing required key')
   element.clear()
   for key, value in item.iteritems():
-    if value and not isinstance(value, basestring):
+    if value is not None and not isinstance(value, basestring):
       value = ','.join(value)
     if key == 'tag':
       element.tag = value
@@ -196,8 +330,8 @@ def writeContentFile(element):
     element: The element used to write the content file.
   '''
   welement = util.ETWrap(element)
-  xml_tree = ET.ElementTree(element)
-  xml_tree.write(welement.filepath, 'UTF-8')
+  xmlbackend.write(ET.ElementTree(element), welement.filepath)
+  contentcache.invalidate(welement.filepath)
   
 def save(slug, item=None):
   '''Write an item to the filesystem (both catalog and content file).
@@ -213,12 +347,9 @@ def save(slug, item=None):
   Raises:
     Exception: If the item is None and the slug isn't "post" or "page".
   '''
-  catalog_path = util.checkBaseline()
-  xml_tree = ET.parse(catalog_path)
-  root = xml_tree.getroot()
+  xml_tree = storage.loadNamed([slug] + ([item['name']] if item else []))
   new_elem = None
   content = None
-  oldFilepath = None
   if slug != 'post' and slug != 'page':
     if item == None:
       raise Exception('Argument cannot be None')
@@ -230,15 +361,18 @@ def save(slug, item=None):
     if element:
       welement = util.ETWrap(element)
       os.remove(welement.filepath)
-      root.remove(element)
+      contentcache.invalidate(welement.filepath)
     new_elem = ET.Element(item['type'])
     updateElem(new_elem, item)
     content = item['content']
+    storage.put(new_elem, replace=slug)
   else: # Create new element
     new_elem = newElem(slug)
-  root.append(new_elem)
-  xml_tree.write(catalog_path, 'UTF-8')
+    storage.put(new_elem)
   writeContentFile(toContentElement(new_elem, content))
+  if content is not None:
+    fulltext.update(item, content, old_name=slug)
+  pagecache.invalidate()
   return True
   
 def trash(request, slug, delete=True):
@@ -252,78 +386,416 @@ def trash(request, slug, delete=True):
   Returns:
     True on success; False on error.
   '''
-  catalog_path = util.checkBaseline()
-  xml_tree = ET.parse(catalog_path)
-  root = xml_tree.getroot()
-  element = findElement(xml_tree, slug)
+  element = findElement(storage.loadNamed([slug]), slug)
   if not element:
     return False
   welement = util.ETWrap(element)
   item = elementToItem(element)
   item['tag'] = 'trash' if delete else welement.type
   item['trash'] = 'true' if delete else 'false'
-  root.remove(element)
-  updateElem(element, item)
-  root.append(element)
-  xml_tree.write(catalog_path, 'UTF-8')
+  storage.put(updateElem(ET.Element(element.tag), item), replace=slug)
+  if delete:
+    fulltext.remove([slug])
+  else:
+    fulltext.update(item, contentcache.load(welement.filepath))
+  pagecache.invalidate()
   return True
   
 def loadContent(item, force=False):
   '''Load the content into an item from the filesystem.
     
   Args:
-    item: Item to load the content into.  Uses item['filepath'].
+    item: Item to load the content into.  Uses item['filepath'] (or
+      item['content_ref'] for WordPress items).
     force: If true, overwrite item['content'] even if it already exists.
     
   Returns:
     The content string.
   '''
-  if force or not item['content']:
-    if not os.path.exists(item['filepath']):
-      return ""
-    xml_tree = ET.parse(item['filepath'])
-    wroot = util.ETWrap(xml_tree.getroot())
-    return wroot.content
-  else:
-    return item['content']
+  return loadContents([item], force)[0]
+  
+@timing.timed('content')
+def loadContents(items, force=False):
+  '''Load the content of several items at once (see loadContent).
+  
+  Content files that are not cached are parsed in parallel.
+    
+  Args:
+    items: Items to load the content into.
+    force: If true, overwrite item['content'] even if it already exists.
+    
+  Returns:
+    A list with the content string of each item.
+  '''
+  ret = [i['content'] for i in items]
+  native = []
+  for n, i in enumerate(items):
+    if force or not i['content']:
+      if 'content_ref' in i:
+        ret[n] = wp.loadContent(i)
+      else:
+        native.append(n)
+  loaded = contentcache.loadMany([items[n]['filepath'] for n in native])
+  for n, text in zip(native, loaded):
+    ret[n] = text
+  return ret
   
 ###
 ### Item operations
 ###
 
-def isVisible(item):
+def isVisible(item, now=None):
   '''Should the item be shown to the site visitor?
     
   Args:
     item: Item to test.
+    now: Items dated after this are not visible yet.  Defaults to
+      utcnow(); pass getVisibility()['now'] when testing many items.
     
   Returns:
     True if the item is visible; false otherwise.
   '''
   if item['status'].lower() != 'visible':
     return False
-  now = datetime.datetime.utcnow().isoformat(' ')
+  if not now:
+    now = datetime.datetime.utcnow().isoformat(' ')
   if item['date'] > now:
     return False
   return True
   
-def addDates(item):
-  '''Add additional date fields to an item.
+def buildSchedule(xml_tree):
+  '''Get the sorted dates of all pages and posts with a visible status.'''
+  if storage.isIndexed(xml_tree):
+    return xml_tree.schedule()
+  items = getItems(xml_tree, 'posts') + getItems(xml_tree, 'pages')
+  return sorted(i['date'] for i in items if i['status'].lower() == 'visible')
+  
+def getVisibility(xml_tree):
+  '''Get what of the catalog is visible now.
+  
+  Which items are visible only changes when the catalog changes or when
+  the next scheduled page or post is published.  So it is worked out once
+  and reused until either happens, instead of testing every item against
+  utcnow() on every request.
+  
+  Args:
+    xml_tree: Standard XML tree object.
+    
+  Returns:
+    A dict with these keys (shared; do not change the values):
+      now: The moment the visibility was worked out for.  Items dated up
+        to this are published, and that holds until 'until'.
+      until: Date of the next scheduled page or post, or None.
+      postlists: Dict with key=(field, term), value=post list (see
+        getPostList).
+      pages: List of the visible pages or None (see getVisiblePages).
+      categories: Set of the categories with visible posts or None (see
+        getVisibleCategories).
+  '''
+  now = datetime.datetime.utcnow().isoformat(' ')
+  current = storage.derived(xml_tree, 'visibility', lambda t: {})
+  visibility = current.get('visibility')
+  if visibility is None or (visibility['until'] and visibility['until'] <= now):
+    schedule = storage.derived(xml_tree, 'schedule', buildSchedule)
+    n = bisect.bisect_right(schedule, now)
+    visibility = current['visibility'] = {
+      'now': now,
+      'until': schedule[n] if n < len(schedule) else None,
+      'postlists': {},
+      'pages': None,
+      'categories': None
+      }
+  return visibility
+  
+def getVisiblePages(xml_tree):
+  '''Get the visible pages, newest first (see getVisibility).
+  
+  NOTE: The items are shared; copy them before making changes.
+  '''
+  visibility = getVisibility(xml_tree)
+  if visibility['pages'] is None:
+    now = visibility['now']
+    visibility['pages'] = getItems(xml_tree, 'pages', lambda i: isVisible(i, now))
+  return visibility['pages']
+  
+def getVisibleCategories(xml_tree):
+  '''Get the categories with at least one visible post (see getVisibility).'''
+  visibility = getVisibility(xml_tree)
+  if visibility['categories'] is None:
+    now = visibility['now']
+    if storage.isIndexed(xml_tree):
+      categories = xml_tree.categories(now)
+    else:
+      index = storage.derived(xml_tree, 'postlists', buildPostIndex)
+      categories = set(cat for cat, items in index['categories'].iteritems()
+        if len(listing.PostList(items, now)) > 0)
+    visibility['categories'] = categories
+  return visibility['categories']
+  
+def getSchedules(xml_tree, wp_tree):
+  '''Get the schedules (see buildSchedule) of the catalog and the export.
+  
+  With a sharded catalog the post dates come from the shard index (see
+  catalog.getShardIndex()), so no year shard is loaded.
     
   Args:
-    item: Item to update.
+    xml_tree: Standard XML tree object.
+    wp_tree: WordPress XML tree object.
     
   Returns:
-    The updated item.
+    A list of sorted lists of dates.
   '''
-  date_size = len("YYYY-MM-DD")
-  item['date_short'] = item['date'][0:date_size]
-  (item['year'], item['month'], item['day']) = item['date_short'].split('-')
-  item['time'] = item['date'][date_size+1:date_size+9]
-  return item
+  if storage.isSharded():
+    schedules = [storage.derived(catalog.load(years=[]), 'schedule', buildSchedule)]
+    schedules += [e['posts'] for e in catalog.getShardIndex().itervalues()]
+  else:
+    schedules = [storage.derived(xml_tree, 'schedule', buildSchedule)]
+  if wp_tree:
+    schedules.append(wp_tree.schedule)
+  return schedules
+  
+def getShardedCategories():
+  '''Get the categories with a visible post of a sharded catalog.
+  
+  Uses the shard index (see catalog.getShardIndex()), so no year shard is
+  loaded.
+  '''
+  now = datetime.datetime.utcnow().isoformat(' ')
+  ret = set()
+  for entry in catalog.getShardIndex().itervalues():
+    for cat, dates in entry['categories'].iteritems():
+      if dates[0] <= now:
+        ret.add(cat)
+  return ret
+  
+def nextPublishDate(xml_tree, wp_tree, now=None):
+  '''Get the date when the next scheduled page or post becomes visible.
+    
+  Args:
+    xml_tree: Standard XML tree object.
+    wp_tree: WordPress XML tree object.
+    now: Only consider dates after this.  Defaults to utcnow().
+    
+  Returns:
+    A date string or None if nothing is scheduled.
+  '''
+  if not now:
+    now = datetime.datetime.utcnow().isoformat(' ')
+  dates = []
+  for schedule in getSchedules(xml_tree, wp_tree):
+    n = bisect.bisect_right(schedule, now)
+    if n < len(schedule):
+      dates.append(schedule[n])
+  return min(dates) if dates else None
+  
+def publishedCount(xml_tree, wp_tree, now=None):
+  '''Get the number of visible pages and posts published by now.
+  
+  The count only changes when the catalog or export changes or when a
+  scheduled item is published, so it can key data that depends on which
+  items are visible.
+    
+  Args:
+    xml_tree: Standard XML tree object.
+    wp_tree: WordPress XML tree object.
+    now: Defaults to utcnow().
+    
+  Returns:
+    The count.
+  '''
+  if not now:
+    now = datetime.datetime.utcnow().isoformat(' ')
+  return sum(bisect.bisect_right(schedule, now)
+    for schedule in getSchedules(xml_tree, wp_tree))
+  
+def lastPublishDate(xml_tree, wp_tree, now=None):
+  '''Get the date when the last published page or post became visible.
+    
+  Args:
+    xml_tree: Standard XML tree object.
+    wp_tree: WordPress XML tree object.
+    now: Only consider dates up to this.  Defaults to utcnow().
+    
+  Returns:
+    A date string or None if nothing is published.
+  '''
+  if not now:
+    now = datetime.datetime.utcnow().isoformat(' ')
+  dates = []
+  for schedule in getSchedules(xml_tree, wp_tree):
+    n = bisect.bisect_right(schedule, now)
+    if n > 0:
+      dates.append(schedule[n-1])
+  return max(dates) if dates else None
+  
+def pageExpires():
+  '''Get the expiry date of a cached public page (see pagecache).
+  
+  Pages expire when the next scheduled item is published or when the
+  random posts pool is re-drawn, whichever comes first.
+  '''
+  ret = nextPublishDate(storage.load(years=[]), wp.loadXML())
+  if Config.RANDOM_POSTS == 'pool':
+    until = getRandomEpoch()['until']
+    if until and (not ret or until < ret):
+      ret = until
+  return ret
+  
+def pageVersion():
+  '''Get the version of a cached public page (see pagecache).
+  
+  That is the seed of the random posts pool, which a draw caused by
+  Config.RANDOM_POOL_REQUESTS changes before the page expires.
+  '''
+  if Config.RANDOM_POSTS == 'pool':
+    return getRandomEpoch()['seed']
+  return None
+  
+def pageModified():
+  '''Get the date a public page last changed (see pagecache).
+  
+  That is the date of the last published item or of the last draw of the
+  random posts pool, whichever is later.  Counts a public request for
+  Config.RANDOM_POOL_REQUESTS.
+  '''
+  ret = lastPublishDate(storage.load(years=[]), wp.loadXML())
+  if Config.RANDOM_POSTS == 'pool':
+    drawn = getRandomEpoch(request=True)['drawn']
+    if drawn and (not ret or drawn > ret):
+      ret = drawn
+  return ret
+  
+def utcDate(timestamp):
+  '''Get the date string (UTC, 'YYYY-MM-DD HH:MM:SS') of a timestamp.'''
+  return datetime.datetime.utcfromtimestamp(timestamp).isoformat(' ')[0:19]
+  
+def getRandomEpoch(request=False):
+  '''Get the current epoch of the random posts pool (see getRandomPosts).
+  
+  The pool is re-drawn every Config.RANDOM_POOL_SECONDS, on the clock, so
+  every process draws the same pool, and after every
+  Config.RANDOM_POOL_REQUESTS public requests of this process.  Cached
+  pages expire with the timed draws and are stale after a draw caused by
+  the request limit (see pageExpires and pageVersion).  A fixed seed (see
+  fixRandomPool) replaces both.
+    
+  Args:
+    request: Count a public request.
+    
+  Returns:
+    A dict with these keys:
+      seed: Seed of the draw.
+      drawn: Date string (UTC) of the draw or None (never re-drawn).
+      until: Date string (UTC) of the next timed draw or None.
+  '''
+  if _random_pool['seed'] is not None:
+    return {'seed': _random_pool['seed'], 'drawn': None, 'until': None}
+  seconds = Config.RANDOM_POOL_SECONDS
+  now = time.time()
+  window = int(now // seconds) if seconds > 0 else 0
+  _random_lock.acquire()
+  try:
+    epoch = _random_pool['epoch']
+    if epoch is None or epoch['window'] != window:
+      epoch = _random_pool['epoch'] = {
+        'window': window,
+        'generation': 0,
+        'requests': 0,
+        'drawn': utcDate(window * seconds) if seconds > 0 else None
+        }
+    if request:
+      epoch['requests'] += 1
+      if Config.RANDOM_POOL_REQUESTS and \
+         epoch['requests'] > Config.RANDOM_POOL_REQUESTS:
+        epoch['generation'] += 1
+        epoch['requests'] = 1
+        # Full precision, so the ETag changes even within a second
+        epoch['drawn'] = datetime.datetime.utcfromtimestamp(now).isoformat(' ')
+    ret = {
+      'seed': '%d.%d' % (window, epoch['generation']),
+      'drawn': epoch['drawn'],
+      'until': utcDate((window + 1) * seconds) if seconds > 0 else None
+      }
+  finally:
+    _random_lock.release()
+  return ret
+  
+def fixRandomPool(seed):
+  '''Draw the random posts pool from a fixed seed instead of the clock.
+  
+  Used by static builds (see sitebuild), so every page of a build shows the
+  same pool and an unchanged site draws the same pool again.
+    
+  Args:
+    seed: Seed string of the pool or None to go back to the clock.
+  '''
+  _random_lock.acquire()
+  try:
+    _random_pool['seed'] = seed
+  finally:
+    _random_lock.release()
+  
+def drawRandomPosts(state, count, rnd=random):
+  '''Draw random visible posts without building the list of all posts.
+  
+  Only the lists (and with a sharded catalog, the year shards) of the
+  drawn posts are visited.
+    
+  Args:
+    state: SiteState of the request.
+    count: Number of posts to draw (at most the number of visible posts).
+    rnd: random.Random object to draw with.
+    
+  Returns:
+    A list of copies of the drawn posts.
+  '''
+  post_lists = state.postLists()
+  indices = rnd.sample(xrange(state.count()), count)
+  return [listing.getItem(post_lists, i) for i in indices]
+  
+def getRandomPosts(state):
+  '''Get the posts of the "Random News" sidebar.
+  
+  With Config.RANDOM_POSTS = 'pool' the posts are drawn once per epoch of
+  the pool (see getRandomEpoch) and shared by every request, so pages stay
+  the same between draws.  The pool is drawn again if the posts change
+  within an epoch.
+    
+  Args:
+    state: SiteState of the request.
+    
+  Returns:
+    A list of copies of the posts.
+  '''
+  count = min(state.count(), Config.POSTS_PER_PAGE)
+  if Config.RANDOM_POSTS != 'pool':
+    return drawRandomPosts(state, count)
+  epoch = getRandomEpoch()
+  key = (epoch['seed'], pagecache.signature(), state.count())
+  _random_lock.acquire()
+  try:
+    posts = _random_pool['posts'] if _random_pool['key'] == key else None
+  finally:
+    _random_lock.release()
+  if posts is None:
+    posts = drawRandomPosts(state, count, random.Random(epoch['seed']))
+    _random_lock.acquire()
+    try:
+      _random_pool['key'] = key
+      _random_pool['posts'] = posts
+    finally:
+      _random_lock.release()
+  return [p.copy() for p in posts]
+  
+def detailFilepath(year=None, month=None, day=None, slug=None):
+  '''Get the content file of the post of a detail URL (see pagecache).'''
+  return util.getContentFilepath(datetime.datetime(int(year), int(month), int(day)), slug)
   
 def findContext(items, slug):
   '''Find an item with the slug in items (a list of items).
+  
+  An exact (case-insensitive) match wins; otherwise the first item whose
+  slug ends with the given slug is returned.
     
   Args:
     items: List of items to search.
@@ -333,9 +805,57 @@ def findContext(items, slug):
     A found item or None if not found.
   '''
   slug = slug.upper()
-  item = next((i for i in items if i['name'].upper().endswith(slug)), None)
+  item = next((i for i in items if i['name'].upper() == slug), None)
+  if not item:
+    item = next((i for i in items if i['name'].upper().endswith(slug)), None)
   return item
   
+def findVisible(xml_tree, wp_tree, type, slug, date=None):
+  '''Find a visible page or post using the slug indexes.
+  
+  Falls back to a suffix match (see findContext) over all visible items
+  when no exact (case-insensitive) match exists.
+    
+  Args:
+    xml_tree: Standard XML tree object.
+    wp_tree: WordPress XML tree object.
+    type: Type of the item.  Must be 'page' or 'post'.
+    slug: Name/ID of the item.
+    date: Optional date of the item; WordPress items are only searched
+      if the date is on or before Config.WP_END_DATE.
+    
+  Returns:
+    A found item or None if not found.
+  '''
+  what = {'post': 'posts', 'page': 'pages'}
+  useWP = not date or date.strftime('%Y-%m-%d') <= Config.WP_END_DATE
+  day = date.strftime('%Y-%m-%d') if date and type == 'post' else None
+  now = getVisibility(xml_tree)['now']
+  if storage.isIndexed(xml_tree):
+    items = xml_tree.findSlug(type, slug, day)
+  else:
+    index = getSlugIndex(xml_tree)
+    elements = []
+    if day:
+      elements = index['dates'].get((day, slug.upper()), [])
+    if not elements:
+      elements = index['types'][type].get(slug.upper(), [])
+    items = [elementToItem(e) for e in elements]
+  items = sorted([i for i in items if isVisible(i, now)], key=lambda i: i['date'], reverse=True)
+  if items:
+    return items[0]
+  if useWP:
+    item = wp.findItem(wp_tree, what[type], slug)
+    if item:
+      return item
+  if storage.isIndexed(xml_tree):
+    items = xml_tree.items(type, visible=True, suffix=slug, now=now)
+  else:
+    items = getItems(xml_tree, what[type], lambda i: isVisible(i, now))
+  if useWP:
+    items += wp.getItems(wp_tree, what[type])
+  return findContext(items, slug)
+  
 def getCategories(items):
   '''Get all the categories in the list of items.
     
@@ -383,25 +903,129 @@ def getDefaultContext(request):
   })
   return c
   
-def assembleContext(context, xml_tree, wp_tree):
-  '''Update a template context with info from both XML trees.
+class SiteState:
+  '''The site as seen by a single request.
+  
+  Post lists, menu, recent posts and categories are computed lazily and at
+  most once per request, no matter how many helpers need them.
+  
+  With a sharded catalog, xml_tree only needs the pages shard (see
+  catalog.load()); posts are loaded from the year shards as needed.
+  
+  Attributes:
+    xml_tree: Standard XML tree object (see storage.load()).
+    wp_tree: WordPress XML tree object.
+    walks: Number of walks over every post of the catalog and the
+      WordPress export made for this request (for debugging).
+  '''
+  def __init__(self, xml_tree, wp_tree):
+    '''Initializes SiteState.
+    
+    Args:
+      xml_tree: Standard XML tree object (see storage.load()).
+      wp_tree: WordPress XML tree object (see wp.loadXML()).
+    '''
+    self.xml_tree = xml_tree
+    self.wp_tree = wp_tree
+    self.walks = 0
+    self._memo = {}
+    
+  def _get(self, key, builder):
+    if key not in self._memo:
+      self._memo[key] = builder()
+    return self._memo[key]
+    
+  def postLists(self, field=None, term=None):
+    '''Get the native and WordPress listing.PostList objects.
+    
+    Args:
+      field: Either 'categories', 'tags', or None for all posts.
+      term: The category or tag.
+    '''
+    def build():
+      if storage.isSharded():
+        native = getShardedPostList(field, term)
+      else:
+        native = getPostList(self.xml_tree, field, term)
+      return [native, wp.getPostList(self.wp_tree, field, term)]
+    return self._get(('postlists', field, term), build)
+      
+  def count(self, field=None, term=None):
+    '''Get the number of visible posts (see postLists).'''
+    return sum(len(l) for l in self.postLists(field, term))
+    
+  def window(self, start, stop, field=None, term=None):
+    '''Get copies of the [start:stop] window of the visible posts.'''
+    return listing.getWindow(self.postLists(field, term), start, stop)
+    
+  def posts(self):
+    '''Get all visible posts, newest first.'''
+    def build():
+      self.walks += 1
+      return self.window(0, self.count())
+    return self._get('posts', build)
+    
+  def pages(self):
+    '''Get all visible pages.'''
+    def build():
+      self.walks += 1
+      return [p.copy() for p in getVisiblePages(self.xml_tree)] + \
+        wp.getItems(self.wp_tree, 'pages')
+    return self._get('pages', build)
+    
+  def menu(self):
+    '''Get the menu (see getMenu).'''
+    return self._get('menu', lambda: getMenu(self.xml_tree, self.wp_tree))
+    
+  def recent(self):
+    '''Get the newest visible posts.'''
+    return self._get('recent', lambda: self.window(0, Config.POSTS_PER_PAGE))
+    
+  def categories(self):
+    '''Get the categories that have at least one visible post.'''
+    def build():
+      if storage.isSharded():
+        ret = getShardedCategories()
+      else:
+        ret = set(getVisibleCategories(self.xml_tree))
+      if self.wp_tree:
+        for cat, items in self.wp_tree.terms['categories'].iteritems():
+          if cat not in ret and len(listing.PostList(items)) > 0:
+            ret.add(cat)
+      return ret
+    return self._get('categories', build)
+    
+def assembleContext(context, state):
+  '''Update a template context with info about the whole site.
   
   Updated fields: posts, menu, recent, random, and categories.
+  
+  NOTE: 'posts' is set to a callable, so the list of all posts is only
+    built if a template actually uses it.
     
   Args:
     context: Context to update (usually a default context).
-    xml_tree: Standard XML tree object.
-    wp_tree:  Wordpress XML tree object.
-  '''
-  context['posts'] = getItems(xml_tree, 'posts', isVisible) + \
-    wp.getItems(wp_tree, 'posts', isVisible)
-  context['menu'] = getMenu(xml_tree, wp_tree)
-  context['recent'] = context['posts'][0:Config.POSTS_PER_PAGE]
-  rdm_posts = len(context['posts'])
-  if rdm_posts > Config.POSTS_PER_PAGE:
-    rdm_posts = Config.POSTS_PER_PAGE
-  context['random'] = random.sample(context['posts'], rdm_posts)
-  context['categories'] = getCategories(context['posts'])
+    state: SiteState of the request.
+  '''
+  context['posts'] = state.posts
+  context['menu'] = state.menu()
+  context['recent'] = state.recent()
+  context['random'] = getRandomPosts(state)
+  context['categories'] = state.categories()
+  
+def debugResponse(response, state):
+  '''Add debugging headers to a response when settings.DEBUG is on.
+    
+  Args:
+    response: The HttpResponse.
+    state: SiteState of the request.
+    
+  Returns:
+    The response.
+  '''
+  if settings.DEBUG:
+    response['X-Filestack-Catalog-Walks'] = str(state.walks)
+  return response
   
 def getSUContext(request, xml_tree):
   '''Get the context for the SU pages.
@@ -410,13 +1034,29 @@ def getSUContext(request, xml_tree):
     request:  View request object.
     xml_tree: XML tree object used to build the context.
     
+  With Config.SU_POSTS_PER_PAGE set, only that many posts are listed, and
+  request.GET['p'] picks the page.
+    
   Returns:
-    A context with posts, pages, and trash already set.
+    A context with posts, pages, trash, and cache stats already set.
   '''
   context = getDefaultContext(request)
-  context['posts'] = getItems(xml_tree, 'posts')
+  perPage = Config.SU_POSTS_PER_PAGE
+  if perPage:
+    p = int(request.GET.get('p', 0)) if request else 0
+    # One more post than shown tells if there is a next page
+    posts = getItems(xml_tree, 'posts', start=p*perPage, stop=(p+1)*perPage + 1)
+    context['prev'] = -1 if p == 0 else p-1
+    context['next'] = -1 if len(posts) <= perPage else p+1
+    context['posts'] = posts[0:perPage]
+  else:
+    context['prev'], context['next'] = -1, -1
+    context['posts'] = getItems(xml_tree, 'posts')
   context['pages'] = getItems(xml_tree, 'pages')
   context['trash'] = getItems(xml_tree, 'trash')
+  context['catalog_stats'] = catalog.getStats()
+  context['page_cache_stats'] = pagecache.getStats()
+  context['compress_stats'] = compress.getStats()
   return context
   
 ###
@@ -425,32 +1065,33 @@ def getSUContext(request, xml_tree):
   
 def getChildren(family_tree, id='0'):
   '''Get the list of children for an id in the tree.
+  
+  The tree is walked iteratively, so deep hierarchies cannot exhaust the
+  stack, and a page is only expanded once, so parent loops terminate.
     
   Args:
     family_tree: Dict with key=id, value=list of children (title,slug,id)
-    wp_tree:  WordPress tree used to build the menu.
+    id: Id of the parent.
     
   Returns:
     A list of tuples structred like: (title, slug, [child tuples])
   '''
   ret = []
-  if id not in family_tree or len(family_tree[id]) <= 0:
-    return ret
-  for member in family_tree[id]:
-    ret.append((member[0], member[1], getChildren(family_tree, member[2])))
+  stack = [(id, ret)]
+  expanded = set([id])
+  while stack:
+    parent, siblings = stack.pop()
+    for member in family_tree.get(parent, []):
+      children = []
+      siblings.append((member[0], member[1], children))
+      if member[2] not in expanded:
+        expanded.add(member[2])
+        stack.append((member[2], children))
   return ret
   
-def getMenu(xml_tree, wp_tree=None):
-  '''Build a menu using the XML trees.
-    
-  Args:
-    xml_tree: XML tree object used to build the menu.
-    wp_tree:  WordPress tree used to build the menu.
-    
-  Returns:
-    A list of tuples structred like: (title, slug, [child tuples])
-  '''
-  pages = getItems(xml_tree, 'pages', isVisible)
+def buildMenu(xml_tree, wp_tree=None):
+  '''Build a menu using the XML trees (see getMenu).'''
+  pages = list(getVisiblePages(xml_tree))
   if wp_tree:
     pages.extend(wp.getItems(wp_tree, 'pages'))
   family_tree = {}
@@ -463,7 +1104,39 @@ def getMenu(xml_tree, wp_tree=None):
       family_tree[parent].append((p['title'], p['name'], id))
     if id not in family_tree:
       family_tree[id] = []
-  return getChildren(family_tree)
+  menu = getChildren(family_tree)
+  return (menu, flattenMenu(menu))
+  
+@timing.timed('menu')
+def getCachedMenu(xml_tree, wp_tree=None):
+  '''Get the menu and its slugs, built once per catalog/export version.
+  
+  The cache key includes the number of pages and posts published so far,
+  so a scheduled page shows up in the menu as soon as it is published.
+    
+  Returns:
+    Tuple with this structure: (menu, list of slugs)
+  '''
+  key = ('menu', wp_tree and wp_tree.source, publishedCount(xml_tree, wp_tree))
+  return storage.derived(xml_tree, key, lambda t: buildMenu(t, wp_tree))
+  
+def getMenu(xml_tree, wp_tree=None):
+  '''Get the menu built from the XML trees.
+  
+  NOTE: The menu is shared between requests and must not be modified.
+    
+  Args:
+    xml_tree: XML tree object used to build the menu.
+    wp_tree:  WordPress tree used to build the menu.
+    
+  Returns:
+    A list of tuples structred like: (title, slug, [child tuples])
+  '''
+  return getCachedMenu(xml_tree, wp_tree)[0]
+  
+def getMenuSlugs(xml_tree, wp_tree=None):
+  '''Get a list (a copy) of all the slugs in the menu.'''
+  return list(getCachedMenu(xml_tree, wp_tree)[1])
   
 def flattenMenu(menu):
   '''Get a list of all the slugs in a menu.
@@ -474,12 +1147,15 @@ def flattenMenu(menu):
   Returns:
     List of slugs.
   '''
-  if not menu:
-    return []
   ret = []
-  for i in menu:
-    ret.append(i[1])
-    ret.extend(flattenMenu(i[2]))
+  stack = [menu or []]
+  while stack:
+    siblings = stack.pop()
+    if not siblings:
+      continue
+    ret.append(siblings[0][1])
+    stack.append(siblings[1:])
+    stack.append(siblings[0][2])
   return ret
   
 ###
@@ -558,12 +1234,12 @@ def formToItem(form, orig_item):
   keys = ['status','categories','name','title','tags','content']
   if orig_item['type'] == 'page':
     keys.append('parent')
-  item = dict((k, form.cleaned_data[k]) for k in keys)
+  item = records.Item(**dict((k, form.cleaned_data[k]) for k in keys))
   date = datetime.datetime.combine(form.cleaned_data['date'], form.cleaned_data['time'])
   item['date'] = date.isoformat(' ')
   item['url'] = util.getURL(date, item['name'], orig_item['type'])
-  item['categories'] = util.cleanCSV(item['categories'])
-  item['tags'] = util.cleanCSV(item['tags'])
+  item['categories'] = records.splitTerms(util.cleanCSV(item['categories']))
+  item['tags'] = records.splitTerms(util.cleanCSV(item['tags']))
   item['type'] = orig_item['type']
   item['filepath'] = util.getContentFilepath(date, item['name'])
   return item
@@ -576,7 +1252,7 @@ def handleUpload(request):
   '''Handle a file upload.
   
   All files will be saved in Config.UPLOAD_DIR inside the
-    Django /media directory.
+    Django /media directory (see uploads.save()).
     
   Args:
     request: View request object.
@@ -589,16 +1265,10 @@ def handleUpload(request):
     if form.is_valid():
       f = request.FILES['file']
       filename = os.path.basename(f.name)
-      filepath = os.path.join('public', 'media', Config.UPLOAD_DIR)
-      if not os.path.exists(filepath):
-        os.makedirs(filepath, 0755)
-      filepath = os.path.join(filepath, filename)
-      if os.path.exists(filepath):
+      filepath = uploads.save(f, filename)
+      if not filepath:
         return (form, 'Upload failed', 'The file \'%s\' already exists.'%(filename))
-      destination = open(filepath, 'wb+')
-      for chunk in f.chunks():
-          destination.write(chunk)
-      destination.close()
+      images.enqueue(filepath)
       msg = 'The file has been successfully uploaded.  Congrats!<br/><br/> \
              See for yourself:<br/> \
              <a href=\'/media/%s/%s\'>.../media/%s/%s</a>' % (Config.UPLOAD_DIR, \
@@ -609,62 +1279,93 @@ def handleUpload(request):
     form = UploadFileForm()
   return (form, '', '')
   
-def showList(request, category=None, tag=None):
+def showList(request, category=None, tag=None, state=None):
   '''Get response for showing a list of posts.
     
   Args:
     request: View request object.
     category: Show only items containing this category string.
     tag: Show only items containing this tag string.
+    state: SiteState of the request (created if None).
     
   Returns:
     A post list response.
   '''
   p = int(request.GET.get('p', 0))
   itemsPerPage = Config.POSTS_PER_PAGE
-  xml_tree = ET.parse(util.checkBaseline())
-  wp_tree = wp.loadXML()
+  if not state:
+    state = SiteState(storage.load(years=[]), wp.loadXML())
   c = getDefaultContext(request)
-  filter = isVisible
-  if category:
-    filter = lambda d: category in d['categories'] and isVisible(d)
+  field, term = None, None
   if tag:
-    filter = lambda d: tag in d['tags'] and isVisible(d)
-  all_posts = getItems(xml_tree, 'posts', filter) + \
-    wp.getItems(wp_tree, 'posts', filter)
-  posts = all_posts[p*itemsPerPage:(p+1)*itemsPerPage]
+    field, term = 'tags', tag
+  elif category:
+    field, term = 'categories', category
+  # One more post than shown tells if there is a next page
+  posts = state.window(p*itemsPerPage, (p+1)*itemsPerPage + 1, field, term)
   c['prev'] = -1 if p == 0 else p-1
-  c['next'] = -1 if p >= len(all_posts)/itemsPerPage else p+1
+  c['next'] = -1 if len(posts) <= itemsPerPage else p+1
+  posts = posts[0:itemsPerPage]
   if len(posts) > 0:
-    for p in posts:
-      p['content'] = loadContent(p)
-    assembleContext(c, xml_tree, wp_tree)
+    host = request.META.get('HTTP_HOST')
+    for p, text in zip(posts, loadContents(posts)):
+      p['content'] = images.addSrcset(text or '', host)
+    assembleContext(c, state)
     c['posts'] = posts
     tfile = 'index.html'
     if category or tag:
       tfile = 'cattag.html'
       c['title'] += " - Tagged %s" % (tag) if tag else " - Category %s" % (category)
     t = util.getTemplate(tfile)
-    return HttpResponse(t.render(c))
-  return get404(request, xml_tree, wp_tree)
+    return debugResponse(HttpResponse(timing.render(t, c)), state)
+  return get404(request, state)
   
-def get404(request, xml_tree, wp_tree):
+def showSearch(request, state=None):
+  '''Get the response for the search results of request.GET['q'].
+    
+  Args:
+    request: View request object.
+    state: SiteState of the request (created if None).
+    
+  Returns:
+    A search results response.
+  '''
+  query = request.GET.get('q', '').strip()
+  p = int(request.GET.get('p', 0))
+  itemsPerPage = Config.POSTS_PER_PAGE
+  if not state:
+    state = SiteState(storage.load(years=[]), wp.loadXML())
+  c = getDefaultContext(request)
+  total, results = fulltext.search(query, p*itemsPerPage, (p+1)*itemsPerPage)
+  c['query'] = query
+  c['total'] = total
+  c['results'] = results
+  c['prev'] = -1 if p == 0 else p-1
+  c['next'] = -1 if (p+1)*itemsPerPage >= total else p+1
+  assembleContext(c, state)
+  if query:
+    c['title'] += " - Search %s" % (query)
+  t = util.getTemplate('search.html')
+  return debugResponse(HttpResponse(timing.render(t, c)), state)
+  
+def get404(request, state=None):
   '''Get a 404 response.
     
   Args:
     request: View request object.
-    xml_tree: Standard XML tree object.
-    wp_tree: WordPress XML tree object.
+    state: SiteState of the request (created if None).
     
   Returns:
     HttpResponseNotFound object.
   '''
+  if not state:
+    state = SiteState(storage.load(years=[]), wp.loadXML())
   c = getDefaultContext(request)
-  c['menu'] = getMenu(xml_tree, wp_tree)
+  c['menu'] = state.menu()
   t = util.getTemplate('404.html')
-  return HttpResponseNotFound(t.render(c))
+  return debugResponse(HttpResponseNotFound(timing.render(t, c)), state)
   
-def getDetail(request, type, slug, date=None):
+def getDetail(request, type, slug, date=None, state=None):
   '''Get the response for a page or post.
   
   Args:
@@ -672,25 +1373,27 @@ def getDetail(request, type, slug, date=None):
     type: The type of response requested.  Must be 'page' or 'post'.
     slug: Name/ID of the item.
     date: Optional date of item used to reduce searching.
+    state: SiteState of the request (created if None).
   
   Returns:
     An HttpResponse for the requested item.
   '''
-  what = {'post': 'posts', 'page': 'pages'}
-  xml_tree = ET.parse(util.checkBaseline())
-  wp_tree = wp.loadXML()
+  if not state:
+    state = SiteState(storage.load(years=[]), wp.loadXML())
   c = getDefaultContext(request)
-  c['posts'] = getItems(xml_tree, what[type], isVisible)
-  if not date or date.strftime('%Y-%m-%d') <= Config.WP_END_DATE:
-    c['posts'] += wp.getItems(wp_tree, what[type])
-  c['post'] = findContext(c['posts'], slug)
+  xml_tree = state.xml_tree
+  if type == 'post' and storage.isSharded():
+    # The date of the URL tells which year shard has the post
+    xml_tree = catalog.load(years=[date.strftime('%Y')] if date else None, pages=False)
+  c['post'] = findVisible(xml_tree, state.wp_tree, type, slug, date)
   if c['post']:
-    c['post']['content'] = loadContent(c['post'])
+    c['post']['content'] = images.addSrcset(loadContent(c['post']) or '',
+      request.META.get('HTTP_HOST'))
     c['title'] += " - %s" % (c['post']['title'])
-    assembleContext(c, xml_tree, wp_tree)
+    assembleContext(c, state)
     t = util.getTemplate('detail.html')
-    return HttpResponse(t.render(c))
-  return get404(request, xml_tree, wp_tree)
+    return debugResponse(HttpResponse(timing.render(t, c)), state)
+  return get404(request, state)
   
 def getSU(request, err_title_msg=None):
   '''Get the SU page response
@@ -704,7 +1407,7 @@ def getSU(request, err_title_msg=None):
   '''
   if not request.user.is_authenticated():
     return redirect('django.contrib.auth.views.login')
-  tree = ET.parse(util.checkBaseline())
+  tree = storage.load()
   c = getSUContext(request, tree)
   if err_title_msg:
     c['dlg_title'] = err_title_msg[0]
@@ -712,50 +1415,81 @@ def getSU(request, err_title_msg=None):
   else:
     c['upload'], c['dlg_title'], c['dlg_msg'] = handleUpload(request)
   t = util.getTemplate('su.html', isSU=True)
-  return HttpResponse(t.render(c))
+  return HttpResponse(timing.render(t, c))
   
 ###
 ### View Handlers ###
 ###
 
+@timing.timedView
+@pagecache.conditional(pageModified)
+@compress.compressed
+@pagecache.cached(pageExpires, pageVersion)
 def index(request):
   '''The main index page for the site.'''
   return showList(request)
 
+@timing.timedView
+@pagecache.conditional(pageModified)
+@compress.compressed
+@pagecache.cached(pageExpires, pageVersion)
 def category(request, category):
   '''Show all posts with a given category.'''
   return showList(request, category)
   
+@timing.timedView
+@pagecache.conditional(pageModified)
+@compress.compressed
+@pagecache.cached(pageExpires, pageVersion)
 def tag(request, tag):
   '''Show all posts with a given tag.'''
   return showList(request, tag=tag)
   
+@timing.timedView
+@pagecache.conditional(pageModified, detailFilepath)
+@compress.compressed
+@pagecache.cached(pageExpires, pageVersion)
 def detail(request, year=None, month=None, day=None, slug=None):
   '''Individual post.'''
   date = datetime.datetime(int(year), int(month), int(day))
   return getDetail(request, 'post', slug, date)
   
+@timing.timedView
+@pagecache.conditional(pageModified)
+@compress.compressed
+@pagecache.cached(pageExpires, pageVersion)
 def page(request, slug):
   '''Individual page.'''
   slug = slug.split('/')[-2] if slug[-1:] =='/' else slug.split('/')[-1]
   return getDetail(request, 'page', slug)
   
+@timing.timedView
+def search(request):
+  '''Search results page.'''
+  return showSearch(request)
+  
+@timing.timedView
 def su(request):
   '''Super User page.'''
   return getSU(request)
   
+@timing.timedView
 def su_edit(request, slug):
   '''SU edit item page.'''
   if not request.user.is_authenticated():
     return redirect('django.contrib.auth.views.login')
-  tree = ET.parse(util.checkBaseline())
+  tree = storage.load()
   c = getSUContext(request, tree)
   c['upload'], c['dlg_title'], c['dlg_msg'] = handleUpload(request)
-  c['post'] = findContext(c['pages']+c['posts']+c['trash'], slug)
+  element = findElement(tree, slug)
+  if element is not None:
+    c['post'] = elementToItem(element)
+  else:
+    c['post'] = findContext(c['pages']+c['posts']+c['trash'], slug)
   c['post']['content'] = loadContent(c['post'])
   parent_choices = [('0', '0')]
   if c['post']['type'] == 'page':
-    pages = flattenMenu(getMenu(tree))
+    pages = getMenuSlugs(tree)
     if slug in pages:
       pages.remove(slug)
     page_choices = [(p, p) for p in pages]
@@ -773,22 +1507,22 @@ def su_edit(request, slug):
   if c['post']['trash'] and c['post']['trash'].lower() == 'true':
     c['readonly'] = True
   t = util.getTemplate('su_edit.html', isSU=True)
-  return HttpResponse(t.render(c))
+  return HttpResponse(timing.render(t, c))
   
+@timing.timedView
 def su_new(request, type):
   '''SU create new page or post item.'''
   if not request.user.is_authenticated():
     return redirect('django.contrib.auth.views.login')
   if type != 'post' and type != 'page':
     return redirect('django.contrib.auth.views.login')
-  catalog_path = util.checkBaseline()
-  tree = ET.parse(catalog_path)
   new_post = newElem(type)
-  tree.getroot().append(new_post)
-  tree.write(catalog_path, 'UTF-8')
+  storage.put(new_post)
   writeContentFile(toContentElement(new_post))
+  pagecache.invalidate()
   return redirect('su')
   
+@timing.timedView
 def su_delete(request, slug):
   '''SU delete item.'''
   if not request.user.is_authenticated():
@@ -799,6 +1533,7 @@ def su_delete(request, slug):
                "An error occurred while attempting to delete item.  Try again.")
   return getSU(request, err_msg)
   
+@timing.timedView
 def su_restore(request, slug):
   '''SU restore deleted item.'''
   if not request.user.is_authenticated():
@@ -808,4 +1543,18 @@ def su_restore(request, slug):
     err_msg = ("Failed to restore",\
                "An error occurred while attempting to restore item.  Try again.")
   return getSU(request, err_msg)
-  
\ No newline at end of file
+    
+@timing.timedView
+def su_timing(request):
+  '''SU request timing page (see timing).'''
+  if not request.user.is_authenticated():
+    return redirect('django.contrib.auth.views.login')
+  if 'reset' in request.GET:
+    timing.reset()
+    return redirect('su_timing')
+  c = getSUContext(request, storage.load())
+  c['upload'], c['dlg_title'], c['dlg_msg'] = handleUpload(request)
+  c['timing_enabled'] = Config.TIMING
+  c['timing_stats'] = timing.getStats()
+  t = util.getTemplate('su_timing.html', isSU=True)
+  return HttpResponse(timing.render(t, c))
@@ -16,27 +16,361 @@ Copyright (C) 2012 Mark West.
 '''
 
 import os
-import elementtree.ElementTree as ET
+import logging
+import threading
+import cPickle as pickle
 from django.template import Context, loader
 
 import util
+import listing
+import timing
+import records
 from config import Config
 
-def loadXML():
-  '''Load the WordPress XML export file and return an ElementTree.
+log = logging.getLogger('filestack.wp')
 
-  Returns:
-    ElementTree for the WordPress XML export file.
+# Bump when the layout of the sidecar file changes.
+SIDECAR_FORMAT = 1
+SIDECAR_SUFFIX = '.sidecar'
+
+_lock = threading.Lock()
+# Held while the export is parsed, so it is parsed by one thread at a time
+_build_lock = threading.Lock()
+# Loaded sidecar, whether a background rebuild is running and the
+# signature of an export that could not be parsed
+_cache = {'index': None, 'building': False, 'failed': None}
+
+class Sidecar:
+  '''Pre-parsed form of the WordPress XML export file.
+
+  The sidecar file is stored next to the export (with SIDECAR_SUFFIX
+  appended) and holds a pickled header followed by the cleaned content
+  of every item.  The header contains the namespace map and the item
+  metadata for posts and pages, already filtered and sorted the way
+  getItems() expects.  Content is only read from disk when an item is
+  displayed (see loadContent()).
+
+  A sidecar that could not be written (e.g. the posts directory is read
+  only) is kept in memory instead, with the content blobs.
+
+  Attributes:
+    filepath: Path of the sidecar file.
+    source: Signature of the export the sidecar was built from.
+    ns: Namespace dict of the export.
+    items: Dict with key=type ('posts' or 'pages'), value=list of items.
+    offset: File offset where the content blobs start.
+    blobs: The content blobs of an in-memory sidecar or None.
+    names: Dict with key=type, value=dict of upper case slug to item.
+    schedule: Sorted dates of all posts and pages.
+    terms: Dict with keys 'categories' and 'tags'; each value is a dict
+      with key=category or tag, value=list of posts (newest first).
   '''
+  def __init__(self, filepath, header, offset, blobs=None):
+    self.filepath = filepath
+    self.blobs = blobs
+    self.source = header['source']
+    self.ns = header['ns']
+    self.items = {}
+    for type, items in header['items'].iteritems():
+      self.items[type] = [toItem(i) for i in items]
+    self.offset = offset
+    self.names = {}
+    for type, items in self.items.iteritems():
+      names = self.names[type] = {}
+      for item in items:
+        names.setdefault((item['name'] or '').upper(), item)
+    self.schedule = sorted(i['date'] for items in self.items.values()
+      for i in items)
+    self.terms = {'categories': {}, 'tags': {}}
+    for item in self.items['posts']:
+      for field, terms in self.terms.iteritems():
+        for term in item[field]:
+          terms.setdefault(term, []).append(item)
+
+  def content(self, ref):
+    '''Read the content of an item.
+
+    Args:
+      ref: Tuple with this structure: (offset, length)
+
+    Returns:
+      The content string.
+    '''
+    if self.blobs is not None:
+      return self.blobs[ref[0]:ref[0]+ref[1]].decode('utf-8')
+    timing.count('files')
+    timing.count('bytes', ref[1])
+    f = open(self.filepath, 'rb')
+    try:
+      f.seek(self.offset + ref[0])
+      return f.read(ref[1]).decode('utf-8')
+    finally:
+      f.close()
+
+def getXMLFilepath():
+  '''Get the path of the WordPress export or None if there is none.'''
   if not Config.WP_XML_FILE:
     return None
   filepath = os.path.join(Config.POST_DIR, Config.WP_XML_FILE)
   filepath = util.getFilepath(filepath)
   if not os.path.exists(filepath):
     return None
+  return filepath
+
+def getSidecarFilepath(filepath):
+  '''Get the path of the sidecar of a WordPress export.'''
+  return filepath + SIDECAR_SUFFIX
+
+def sourceSignature(filepath):
+  '''Get the (size, mtime) signature the sidecar is validated against.'''
+  st = os.stat(filepath)
+  return (st.st_size, st.st_mtime)
+
+def parseExport(filepath):
+  '''Parse the WordPress export into the parts of a sidecar.
+
+  Args:
+    filepath: Path of the WordPress XML export file.
+
+  Returns:
+    Tuple with this structure: (header, content blobs as one string)
+  '''
+  source = sourceSignature(filepath)
   tree, ns = util.parse_and_get_ns(filepath)
   util.ETWrap.namespace = ns
-  return tree
+  elements = tree.findall("./channel/item")
+  blobs = []
+  size = 0
+  header = {
+    'format': SIDECAR_FORMAT,
+    'source': source,
+    'ns': ns,
+    'items': {}
+  }
+  for type, wp_type in (('posts', 'post'), ('pages', 'page')):
+    items = []
+    for element in filterElements(elements, wp_type):
+      item = dict(elementToItem(util.ETWrap(element, mapped=True)).iteritems())
+      blob = (item['content'] or '').encode('utf-8')
+      item['content'] = ''
+      item['content_ref'] = (size, len(blob))
+      blobs.append(blob)
+      size += len(blob)
+      items.append(item)
+    header['items'][type] = items
+  return (header, ''.join(blobs))
+
+def writeSidecar(filepath, header, blobs):
+  '''Write the sidecar file of a WordPress export.
+
+  The sidecar is written to a temporary file and renamed into place, so
+  readers never see a partially written sidecar.
+
+  Args:
+    filepath: Path of the WordPress XML export file.
+    header: Header of the sidecar (see parseExport()).
+    blobs: Content blobs of the sidecar (see parseExport()).
+
+  Returns:
+    File offset where the content blobs start.
+  '''
+  sidecar_path = getSidecarFilepath(filepath)
+  tmp_path = '%s.%d.tmp' % (sidecar_path, os.getpid())
+  f = open(tmp_path, 'wb')
+  try:
+    pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+    offset = f.tell()
+    f.write(blobs)
+  finally:
+    f.close()
+  os.rename(tmp_path, sidecar_path)
+  return offset
+
+def buildSidecar(filepath):
+  '''Parse the WordPress export and write its sidecar file.
+
+  Args:
+    filepath: Path of the WordPress XML export file.
+
+  Returns:
+    Path of the sidecar file.
+  '''
+  header, blobs = parseExport(filepath)
+  writeSidecar(filepath, header, blobs)
+  return getSidecarFilepath(filepath)
+
+def buildIndex(filepath):
+  '''Parse the WordPress export and write its sidecar, if possible.
+
+  Args:
+    filepath: Path of the WordPress XML export file.
+
+  NOTE: Call with _build_lock held.
+
+  Returns:
+    The Sidecar, kept in memory if its file could not be written.
+  '''
+  header, blobs = parseExport(filepath)
+  try:
+    offset = writeSidecar(filepath, header, blobs)
+  except (IOError, OSError):
+    return Sidecar(getSidecarFilepath(filepath), header, 0, blobs)
+  return Sidecar(getSidecarFilepath(filepath), header, offset)
+
+def rebuild(filepath, source):
+  '''Build the sidecar in the background (see loadXML()).'''
+  index = None
+  _build_lock.acquire()
+  try:
+    current = _cache['index']
+    if current and current.source == source:
+      index = current  # Built by buildCurrent() meanwhile
+    else:
+      try:
+        index = buildIndex(filepath)
+      except Exception, e:
+        log.error('Cannot parse the WordPress export %s (%s)', filepath, e)
+  finally:
+    _build_lock.release()
+    _lock.acquire()
+    try:
+      _cache['building'] = False
+      if index:
+        _cache['index'] = index
+      else:
+        _cache['failed'] = source
+    finally:
+      _lock.release()
+
+def readSidecar(filepath, source=None):
+  '''Read the sidecar file of a WordPress export.
+
+  Args:
+    filepath: Path of the WordPress XML export file.
+    source: If set, only accept a sidecar built from an export with this
+      signature.
+
+  Returns:
+    A Sidecar or None if the sidecar is missing, outdated or unreadable.
+  '''
+  sidecar_path = getSidecarFilepath(filepath)
+  if not os.path.exists(sidecar_path):
+    return None
+  timing.countFile(sidecar_path)
+  f = open(sidecar_path, 'rb')
+  try:
+    try:
+      header = pickle.load(f)
+    except Exception:
+      return None
+    offset = f.tell()
+  finally:
+    f.close()
+  if header.get('format') != SIDECAR_FORMAT:
+    return None
+  if source and header.get('source') != source:
+    return None
+  return Sidecar(sidecar_path, header, offset)
+
+def buildCurrent(filepath, source):
+  '''Build the sidecar in this thread (see loadXML()).
+
+  Raises:
+    Exception: If the export cannot be parsed.
+  '''
+  _build_lock.acquire()
+  try:
+    index = _cache['index']
+    if index and index.source == source:
+      return index  # Built by another thread meanwhile
+    try:
+      index = buildIndex(filepath)
+    except Exception, e:
+      raise Exception('Cannot parse the WordPress export %s (%s)' % (filepath, e))
+    _lock.acquire()
+    try:
+      _cache['index'] = index
+      _cache['failed'] = None
+    finally:
+      _lock.release()
+    return index
+  finally:
+    _build_lock.release()
+
+@timing.timed('wp')
+def loadXML(wait=False):
+  '''Load the pre-parsed WordPress export.
+
+  The sidecar should be built with "su.py wp build" whenever the export
+  changes.  Requests never parse the export themselves: when the export
+  changed since the sidecar was built, the outdated sidecar is served
+  while a background thread builds it again.  Without any sidecar the
+  site is served without WordPress items until the background build is
+  done.  The loaded sidecar is kept in memory until the export changes.
+
+  Args:
+    wait: Build a missing or outdated sidecar in this thread instead, for
+      commands that need the current export (e.g. "su.py reindex").
+
+  Returns:
+    Sidecar for the WordPress XML export file or None if there is none
+    (yet).
+
+  Raises:
+    Exception: With wait set, if the export cannot be parsed.
+  '''
+  filepath = getXMLFilepath()
+  if not filepath:
+    return None
+  source = sourceSignature(filepath)
+  _lock.acquire()
+  try:
+    index = _cache['index']
+    if not index or index.source != source:
+      if _cache['building'] or _cache['failed'] == source:
+        pass  # Keep serving the outdated sidecar, if any
+      else:
+        if not index or index.blobs is None:
+          index = readSidecar(filepath) or index
+        if not wait and (not index or index.source != source):
+          if not index:
+            log.warning('No sidecar for the WordPress export %s, serving '
+              'without WordPress items while it is built (see "su.py wp '
+              'build")', filepath)
+          _cache['building'] = True
+          thread = threading.Thread(target=rebuild, args=(filepath, source))
+          thread.setDaemon(True)
+          thread.start()
+        _cache['index'] = index
+  finally:
+    _lock.release()
+  if wait and (not index or index.source != source):
+    index = buildCurrent(filepath, source)
+  if not index:
+    return None
+  util.ETWrap.namespace = index.ns
+  return index
+
+def getFilepaths():
+  '''Get the files the served WordPress items come from (see loadXML()).'''
+  filepath = getXMLFilepath()
+  if not filepath:
+    return []
+  return [filepath, getSidecarFilepath(filepath)]
+
+def loadContent(item):
+  '''Load the content of a WordPress item from the sidecar.
+
+  Args:
+    item: Item returned by getItems().
+
+  Returns:
+    The content string.
+  '''
+  index = loadXML()
+  if not index:
+    return ""
+  return index.content(item['content_ref'])
   
 def cleanContent(content):
   '''Clean and insert proper HTML 'newlines'.
@@ -71,7 +405,7 @@ def getCatTags(element):
   return (cats, tags)
 
 def elementToItem(welement):
-  '''Get the dict representation of an element.
+  '''Get the item (see records.Item) of an element.
     
   Args:
     welement: util.ETWrap of the element to convert.
@@ -80,20 +414,29 @@ def elementToItem(welement):
     The item.
   '''
   cats, tags = getCatTags(welement.unwrap())
-  item = {
-    'title': welement.title,
-    'name': welement.ns('wp').post_name,
-    'url': welement.link,
-    'date': welement.ns('wp').post_date,
-    'categories': cats,
-    'tags': tags,
-    'content': cleanContent(welement.ns('content').encoded),
-    'type': welement.ns('wp').post_type,
-    'status': 'visible'
-  }
-  if item['type'] == 'page':
-    item['parent'] = welement.ns('wp').post_parent
-    item['post_id'] = welement.ns('wp').post_id
+  name, date, type, parent, post_id = welement.ns('wp').fields(
+    'post_name', 'post_date', 'post_type', 'post_parent', 'post_id')
+  item = records.Item(
+    title=welement.title,
+    name=name,
+    url=welement.link,
+    date=date,
+    categories=records.terms(cats),
+    tags=records.terms(tags),
+    content=cleanContent(welement.ns('content').encoded),
+    type=type,
+    status='visible'
+  )
+  if type == 'page':
+    item['parent'] = parent
+    item['post_id'] = post_id
+  return item
+
+def toItem(fields):
+  '''Get the item of the fields dict of an item in the sidecar.'''
+  item = records.Item(**fields)
+  item['categories'] = records.terms(item['categories'])
+  item['tags'] = records.terms(item['tags'])
   return item
   
 def filterElements(elements, type):
@@ -108,37 +451,68 @@ def filterElements(elements, type):
   '''
   ret = {}
   for element in elements:
-    welement = util.ETWrap(element)
-    if welement.ns('wp').post_type == type and \
-      (welement.ns('wp').status == "publish" or \
-      welement.ns('wp').status == "future"):
-      ret[welement.ns('wp').post_date] = element
+    post_type, status, date = util.ETWrap(element).ns('wp').fields(
+      'post_type', 'status', 'post_date')
+    if post_type == type and (status == "publish" or status == "future"):
+      ret[date] = element
   ret = sorted(ret.items(), reverse=True)
   final = [i[1] for i in ret]
   return final
       
+@timing.timed('items')
 def getItems(wp_tree, type='posts', filter_lambda=None):
-  '''Get all the items from the XML tree of a certain type.
+  '''Get all the items from the WordPress export of a certain type.
   
   Args:
-    wp_tree: WordPress XML tree as an ElementTree object.
+    wp_tree: WordPress export as returned by loadXML().
     type: Type of elements to search for (posts or pages).
     filter_lambda: Additional filter called before adding item to
-      list.  The lambda is passed a single dict argument and should
+      list.  The lambda is passed a single item argument and should
       return True if the item should be added to the list.
   
   Returns:
-    A list of items, which are simple dicts.
+    A list of items (see records.Item).  The content of the items is
+    not loaded; use loadContent() for that.
   '''
   if not wp_tree:
     return []
-  paths = {'posts': 'post', 'pages': 'page'}
-  all = wp_tree.findall("/channel/item")
-  items = filterElements(all, paths[type])
   ret = []
-  for i in items:
-    d = elementToItem(util.ETWrap(i))
+  timing.count('elements', len(wp_tree.items[type]))
+  for i in wp_tree.items[type]:
+    d = i.copy()
     if not filter_lambda or filter_lambda(d):
       ret.append(d)
   return ret
-  
\ No newline at end of file
+
+def findItem(wp_tree, type, slug):
+  '''Find an item by slug (case-insensitive) using the sidecar index.
+
+  Args:
+    wp_tree: WordPress export as returned by loadXML().
+    type: Type of item to search for (posts or pages).
+    slug: Name/ID of the item to find.
+
+  Returns:
+    A copy of the found item or None if no item was found.
+  '''
+  if not wp_tree:
+    return None
+  item = wp_tree.names[type].get(slug.upper())
+  return item.copy() if item else None
+
+def getPostList(wp_tree, field=None, term=None):
+  '''Get the visible posts, optionally only those with a category or tag.
+
+  Args:
+    wp_tree: WordPress export as returned by loadXML().
+    field: Either 'categories', 'tags', or None for all posts.
+    term: The category or tag.
+
+  Returns:
+    A listing.PostList.
+  '''
+  if not wp_tree:
+    return listing.PostList([])
+  if not field:
+    return listing.PostList(wp_tree.items['posts'])
+  return listing.PostList(wp_tree.terms[field].get(term, []))
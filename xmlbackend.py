@@ -0,0 +1,140 @@
+#!/usr/bin/python
+'''
+Copyright (C) 2012 Mark West.
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+'''
+
+'''
+Information:
+  The ElementTree implementation used to parse and write XML files.
+
+  The fastest available implementation is picked when this module is
+  imported: lxml, then cElementTree, then the pure Python ElementTree.
+  Set Config.XML_BACKEND to one of BACKENDS to force one (e.g. to compare
+  them, see bench/parsers.py).  Modules import the implementation as:
+    from xmlbackend import ET
+
+  The implementations differ in a few places, so writing files,
+  serializing elements and parsing with namespaces go through the
+  functions of this module.  Paths must be relative ("./post"); lxml
+  elements can only have one parent, so elements shared between trees
+  are added with appendShared().
+'''
+
+import copy
+
+from config import Config
+
+# Fastest first
+BACKENDS = ['lxml', 'cElementTree', 'ElementTree']
+
+def load(name):
+  '''Import a backend.
+
+  Args:
+    name: One of BACKENDS.
+
+  Returns:
+    The ElementTree module or None if it is not installed.
+  '''
+  try:
+    if name == 'lxml':
+      from lxml import etree
+      return etree
+    if name == 'cElementTree':
+      import xml.etree.cElementTree as et
+      return et
+    if name == 'ElementTree':
+      try:
+        import elementtree.ElementTree as et
+      except ImportError:
+        import xml.etree.ElementTree as et
+      return et
+  except ImportError:
+    return None
+  raise ValueError('Unknown XML backend: %s' % (name))
+
+def select(name=None):
+  '''Get a backend: the named one or else the fastest installed one.
+
+  Returns:
+    Tuple with this structure: (name, ElementTree module)
+  '''
+  if name:
+    et = load(name)
+    if et is None:
+      raise ImportError('XML backend %s is not installed' % (name))
+    return (name, et)
+  for name in BACKENDS:
+    et = load(name)
+    if et is not None:
+      return (name, et)
+  raise ImportError('No ElementTree implementation is installed')
+
+NAME, ET = select(Config.XML_BACKEND)
+
+def isLxml(et=None):
+  '''Is the backend (by default the selected one) lxml?'''
+  return getattr(et or ET, '__name__', '') == 'lxml.etree'
+
+def parse(source, et=None):
+  '''Parse an XML file into an ElementTree.'''
+  return (et or ET).parse(source)
+
+def parseNS(source, et=None):
+  '''Parse an XML file and collect its namespace prefixes.
+
+  Returns:
+    Tuple with this structure: (ElementTree, namespace dict, number of
+    elements).  The namespace dict maps prefixes to "{URI}".
+
+  Raises:
+    KeyError: A duplicate prefix was found that has a different URI.
+  '''
+  et = et or ET
+  events = "start", "start-ns"
+  root = None
+  ns = {}
+  elements = 0
+  for event, elem in et.iterparse(source, events):
+    if event == "start-ns":
+      prefix = elem[0] or ''  # lxml uses None for the default namespace
+      if prefix in ns and ns[prefix] != "{%s}" % elem[1]:
+        raise KeyError("Duplicate prefix with different URI found.")
+      ns[prefix] = "{%s}" % elem[1]
+    elif event == "start":
+      elements += 1
+      if root is None:
+        root = elem
+  return (et.ElementTree(root), ns, elements)
+
+def write(tree, filepath, et=None):
+  '''Write an ElementTree to a file (UTF-8 with an XML declaration).'''
+  if isLxml(et):
+    tree.write(filepath, encoding='UTF-8', xml_declaration=True)
+  else:
+    tree.write(filepath, 'UTF-8')
+
+def tostring(element, et=None):
+  '''Serialize an element to UTF-8 (without an XML declaration).'''
+  if isLxml(et):
+    return (et or ET).tostring(element, encoding='utf-8')
+  return (et or ET).tostring(element, 'utf-8')
+
+def appendShared(parent, element):
+  '''Append an element that stays in its own tree as well.
+
+  lxml moves an element to its new parent, so a copy is appended.
+  '''
+  parent.append(copy.deepcopy(element) if isLxml() else element)